@@ -0,0 +1,118 @@
+"""
+Compares the buffered BatchAssembler of DGCNN with the prepare_feature_labels it replaced: checks that both give the
+same node features, tags and labels and reports the tensor allocations and the time of assembling an epoch of
+batches.
+
+Allocations are counted with a dispatch mode, as the operators whose outputs do not reuse the memory of their
+inputs. The legacy constructors from Python lists, such as torch.LongTensor(list), bypass the dispatcher, so the
+counts of the old version are lower bounds.
+
+Run from the repository root: python -m benchmarks.batch_assembly
+"""
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_leaves
+
+from code.libs.dgcnn.features import BatchAssembler
+
+
+class AllocationCounter(TorchDispatchMode):
+    def __init__(self):
+        super(AllocationCounter, self).__init__()
+        self.allocations = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        inputs = {leaf.untyped_storage().data_ptr() for leaf in tree_leaves((args, kwargs))
+                  if isinstance(leaf, torch.Tensor)}
+        for leaf in tree_leaves(out):
+            if isinstance(leaf, torch.Tensor) and leaf.untyped_storage().nbytes() > 0 and \
+                    leaf.untyped_storage().data_ptr() not in inputs:
+                self.allocations += 1
+        return out
+
+
+class RandomGraph(object):
+    def __init__(self, num_nodes: int, feat_dim: int, attr_dim: int, label_dim: int, rng):
+        self.num_nodes = num_nodes
+        self.node_tags = rng.integers(0, feat_dim, num_nodes).astype(np.int32)
+        # Graphs pickled by the previous version kept the tags in a list
+        self.node_tag_list = self.node_tags.tolist()
+        self.node_features = rng.standard_normal((num_nodes, attr_dim)).astype(np.float32)
+        self.labels = list(rng.standard_normal(label_dim))
+        self.edge_features = None
+
+
+def prepare_feature_labels(batch_graph: list, feat_dim: int):
+    """
+        The node features and labels of the previous version, without the unused edge features, on the tag lists
+    """
+    labels = torch.FloatTensor(len(batch_graph), len(batch_graph[0].labels))
+    n_nodes = 0
+    concat_tag = []
+    concat_feat = []
+    for i in range(len(batch_graph)):
+        labels[i] = torch.FloatTensor(batch_graph[i].labels)
+        n_nodes += batch_graph[i].num_nodes
+        concat_tag += batch_graph[i].node_tag_list
+        concat_feat.append(torch.from_numpy(batch_graph[i].node_features).type('torch.FloatTensor'))
+
+    concat_tag = torch.LongTensor(concat_tag).view(-1, 1)
+    node_tag = torch.zeros(n_nodes, feat_dim)
+    node_tag.scatter_(1, concat_tag, 1)
+    node_feat = torch.cat(concat_feat, 0)
+    node_feat = torch.cat([node_tag.type_as(node_feat), node_feat], 1)
+    return node_feat, labels
+
+
+def run_epoch(assemble, batches: list):
+    counter = AllocationCounter()
+    time_start = timer()
+    with counter:
+        for batch in batches:
+            assemble(batch)
+    return timer() - time_start, counter.allocations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DGCNN batch assembly with and without reused buffers')
+    parser.add_argument('-num_graphs', type=int, default=1000, help='number of random graphs')
+    parser.add_argument('-batch_size', type=int, default=50, help='graphs per batch')
+    parser.add_argument('-max_nodes', type=int, default=20000, help='maximum number of nodes of a graph')
+    parser.add_argument('-feat_dim', type=int, default=3, help='number of node tags')
+    parser.add_argument('-attr_dim', type=int, default=64, help='dimension of the node features')
+    parser.add_argument('-epochs', type=int, default=3, help='number of measured epochs')
+    args, _ = parser.parse_known_args()
+
+    rng = np.random.default_rng(0)
+    graphs = [RandomGraph(int(rng.integers(1, args.max_nodes)), args.feat_dim, args.attr_dim, 31, rng)
+              for _ in range(args.num_graphs)]
+    batches = [graphs[start:start + args.batch_size] for start in range(0, len(graphs), args.batch_size)]
+
+    assembler = BatchAssembler(0, 'cpu')
+    for batch in batches[:3]:
+        node_feat, labels = prepare_feature_labels(batch, args.feat_dim)
+        node_tags, features, _, assembled_labels = assembler.prepare_feature_labels(batch)
+        one_hot = torch.nn.functional.one_hot(node_tags, args.feat_dim).float()
+        if not torch.equal(node_feat, torch.cat([one_hot, features], 1)) or not torch.equal(labels, assembled_labels):
+            raise AssertionError("The assembled batch differs from prepare_feature_labels")
+    print(f"Identical batches, {len(batches)} batches of {args.batch_size} graphs per epoch")
+
+    print(f"{'method':>10} {'epoch':>10} {'allocations':>12} {'speedup':>10}")
+    old_time, old_allocations = min(run_epoch(lambda batch: prepare_feature_labels(batch, args.feat_dim), batches)
+                                    for _ in range(args.epochs))
+    print(f"{'old':>10} {1000 * old_time:>8.1f}ms {old_allocations:>12} {1:>9.2f}x")
+    # The buffers are allocated in the first epoch
+    assembler.reset_statistics()
+    for epoch in range(args.epochs):
+        new_time, new_allocations = run_epoch(assembler.prepare_feature_labels, batches)
+        print(f"{f'epoch {epoch}':>10} {1000 * new_time:>8.1f}ms {new_allocations:>12} {old_time / new_time:>9.2f}x")
+    print(assembler)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures the time of a GCN training epoch with the graphs loaded in the training process and with worker processes
+prefetching the batches.
+
+Run from the repository root: python -m benchmarks.data_loader_epoch -cnf_dir INSTANCES -workers 0-2-4
+"""
+import argparse
+import os
+from timeit import default_timer as timer
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from code.gcn import GCN
+from code.common.nn import create_data_loader
+from code.preprocessing.cnf.generate_data import generate_cnf_datasets_for_training
+
+
+def run_epoch(data_loader, predictor=None, optimizer=None, loss_func=None):
+    time_start = timer()
+    for bg, label in data_loader:
+        if predictor is None:
+            continue
+        optimizer.zero_grad()
+        loss = loss_func(predictor(bg), label)
+        loss.backward()
+        optimizer.step()
+    return timer() - time_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GCN epoch time with and without loading workers')
+    parser.add_argument('-cnf_dir', type=str, required=True, help='directory with splits.csv and all_data_y.csv')
+    parser.add_argument('-workers', type=str, default='0-2-4', help='numbers of loading workers')
+    parser.add_argument('-batch_size', type=int, default=40, help='minibatch size')
+    parser.add_argument('-epochs', type=int, default=3, help='number of measured epochs per setting')
+    parser.add_argument('-prefetch_factor', type=int, default=2, help='batches prefetched by every worker')
+    parser.add_argument('-load_only', action='store_true', help='measure only loading and batching of the graphs')
+    args, _ = parser.parse_known_args()
+
+    trainset, _, _ = generate_cnf_datasets_for_training(args.cnf_dir,
+                                                        os.path.join(args.cnf_dir, "splits.csv"),
+                                                        os.path.join(args.cnf_dir, "all_data_y.csv"))
+
+    print(f"{'workers':>8} {'epoch':>10} {'speedup':>10}")
+    baseline = None
+    for num_workers in [int(workers) for workers in args.workers.split('-')]:
+        torch.manual_seed(0)
+        predictor = optimizer = loss_func = None
+        if not args.load_only:
+            predictor = GCN(trainset.hidden_features_dim, 31, [64, 64, 64], "leaky", {"negative_slope": 0.2}, 0.0)
+            optimizer = optim.Adam(predictor.parameters(), lr=0.001)
+            loss_func = nn.MSELoss()
+
+        data_loader = create_data_loader(trainset, args.batch_size, True, num_workers,
+                                         prefetch_factor=args.prefetch_factor)
+        # The first epoch starts the workers
+        run_epoch(data_loader, predictor, optimizer, loss_func)
+        epoch_time = min(run_epoch(data_loader, predictor, optimizer, loss_func) for _ in range(args.epochs))
+
+        baseline = epoch_time if baseline is None else baseline
+        print(f"{num_workers:>8} {epoch_time:>9.2f}s {baseline / epoch_time:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
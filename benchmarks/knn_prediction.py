@@ -0,0 +1,60 @@
+"""
+Compares the final KNN model, MultiOutputKNeighborsRegressor, with the MultiOutputRegressor of KNeighborsRegressor on
+the Python distance callables that it replaced: checks that both predict the same outputs on random data and
+reports the prediction latency per instance for every metric.
+
+Run from the repository root: python -m benchmarks.knn_prediction
+"""
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+from sklearn import multioutput
+from sklearn.neighbors import KNeighborsRegressor
+
+from code.knn import MultiOutputKNeighborsRegressor
+from code.preprocessing.algorithms.math import lorentzian_distance, angular_distance
+
+
+def latency(model, x) -> float:
+    time_start = timer()
+    model.predict(x)
+    return (timer() - time_start) / len(x)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KNN prediction with one query for all outputs')
+    parser.add_argument('-num_train', type=int, default=2000, help='number of training instances')
+    parser.add_argument('-num_test', type=int, default=50, help='number of predicted instances')
+    parser.add_argument('-num_features', type=int, default=50, help='number of features')
+    parser.add_argument('-num_outputs', type=int, default=31, help='number of outputs (solvers)')
+    parser.add_argument('-n_neighbors', type=int, default=5, help='number of neighbours')
+    args, _ = parser.parse_known_args()
+
+    rng = np.random.default_rng(0)
+    x_train = rng.standard_normal((args.num_train, args.num_features))
+    y_train = rng.standard_normal((args.num_train, args.num_outputs))
+    x_test = rng.standard_normal((args.num_test, args.num_features))
+
+    metrics = {"euclidean": "euclidean", "manhattan": "manhattan", "lorentzian": lorentzian_distance,
+               "angular": angular_distance}
+    print(f"{'metric':>12} {'old':>12} {'new':>12} {'speedup':>10}")
+    for name, metric in metrics.items():
+        old_model = multioutput.MultiOutputRegressor(KNeighborsRegressor(n_neighbors=args.n_neighbors,
+                                                                         weights="distance", metric=metric,
+                                                                         algorithm='brute', n_jobs=-1))
+        old_model.fit(x_train, y_train)
+        new_model = MultiOutputKNeighborsRegressor(n_neighbors=args.n_neighbors, weights="distance", metric=name)
+        new_model.fit(x_train, y_train)
+
+        difference = np.max(np.abs(old_model.predict(x_test) - new_model.predict(x_test)))
+        if difference > 1e-9:
+            raise AssertionError(f"The {name} predictions differ by {difference}")
+
+        old_latency = latency(old_model, x_test)
+        new_latency = latency(new_model, x_test)
+        print(f"{name:>12} {1e6 * old_latency:>10.1f}us {1e6 * new_latency:>10.1f}us {old_latency / new_latency:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the pivot of the SAT12 runtime tables into all_data_y.csv with the row by row loop of prepare_output_data
+that it replaced: checks that both give the same instance x solver matrix on random runtime tables and times them.
+The previous loop never saved the last instance of the tables, so it is left out of the comparison.
+
+Run from the repository root: python -m benchmarks.output_pivot
+"""
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from code.common.process_instances import pivot_runtimes
+
+
+def previous_pivot(data: pd.DataFrame, available_instances: list) -> pd.DataFrame:
+    """
+        The pivot of the previous prepare_output_data, with its filter of the available instances
+    """
+    instance_ids = []
+    instance_id = None
+    new_row = None
+    columns = None
+    ys = []
+    for i in range(len(data)):
+        old_row = data.iloc[i]
+        inst_id = old_row["instance_id"]
+        if inst_id != instance_id:
+            if new_row is not None:
+                if inst_id in instance_ids:
+                    continue
+                ys.append(pd.DataFrame([new_row], columns=columns))
+                instance_ids.append(instance_id)
+
+            new_row = [inst_id]
+            columns = ["instance_id"]
+            instance_id = inst_id
+        new_row.append(old_row["runtime"])
+        columns.append(old_row["solver name"])
+
+    y = pd.concat(ys)
+    y = y.loc[[y.iloc[i]["instance_id"] in available_instances for i in range(len(y))], :]
+    return y.sort_values(by=["instance_id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pivot of the SAT12 runtime tables')
+    parser.add_argument('-num_instances', type=int, default=2000, help='number of instances')
+    parser.add_argument('-num_solvers', type=int, default=31, help='number of solvers')
+    parser.add_argument('-repeated', type=float, default=0.05, help='fraction of instances that are run again')
+    args, _ = parser.parse_known_args()
+
+    rng = np.random.default_rng(0)
+    instance_ids = [f"instance_{i:05d}.cnf" for i in rng.permutation(args.num_instances)]
+    solver_names = [f"solver_{i}" for i in range(args.num_solvers)]
+    runs = instance_ids + list(rng.choice(instance_ids[:-1], int(args.repeated * args.num_instances)))
+    # The repetitions come before the last instance, which the previous loop dropped
+    runs = runs[:args.num_instances - 1] + runs[args.num_instances:] + runs[args.num_instances - 1:args.num_instances]
+    data = pd.DataFrame({
+        "instance_id": np.repeat(runs, args.num_solvers),
+        "solver name": np.tile(solver_names, len(runs)),
+        "runtime": rng.exponential(100, len(runs) * args.num_solvers),
+    })
+    available_instances = instance_ids[::2]
+    print(f"{len(data)} runs of {args.num_instances} instances and {args.num_solvers} solvers")
+
+    time_start = timer()
+    y = pivot_runtimes(data)
+    y = y[y.index.isin(available_instances)].sort_index().reset_index()
+    new_time = timer() - time_start
+
+    time_start = timer()
+    previous_y = previous_pivot(data, available_instances).reset_index(drop=True)
+    old_time = timer() - time_start
+
+    y = y[y["instance_id"] != runs[-1]].reset_index(drop=True)
+    previous_y = previous_y[previous_y["instance_id"] != runs[-1]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(y, previous_y)
+    print(f"Identical runtime matrices of {len(y)} instances")
+    print(f"old {1000 * old_time:.1f}ms, new {1000 * new_time:.1f}ms, speedup {old_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
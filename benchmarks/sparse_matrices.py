@@ -0,0 +1,88 @@
+"""
+Compares the PyTorch construction of the DGCNN message passing matrices with the one of the compiled libgnn.so:
+checks that n2n, e2n and subg have identical indices and values on random literal-clause graphs and times both,
+with and without the per-graph cache.
+
+The compiled library must be built first: cd code/libs/dgcnn/lib && make
+Run from the repository root: python -m benchmarks.sparse_matrices [-msg_average 1]
+"""
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+
+from code.libs.dgcnn.lib.sparse_matrices import SparseMatrixBuilder
+from code.preprocessing.cnf.graph_cache import GraphCache
+
+
+class RandomGraph(object):
+    def __init__(self, instance_id: str, num_of_clauses: int, num_of_vars: int, clause_length: int, rng):
+        """
+            Literal-clause graph with the attributes of GNNGraph used by the matrix construction
+        """
+        self.instance_id = instance_id
+        self.num_nodes = num_of_clauses + 2 * num_of_vars
+        clauses = np.repeat(np.arange(num_of_clauses), clause_length)
+        literals = num_of_clauses + rng.integers(0, 2 * num_of_vars, len(clauses))
+        self.num_edges = len(clauses)
+        self.edge_pairs = np.stack([clauses, literals], axis=1).astype(np.int32).reshape(-1)
+
+
+def same_matrix(a: torch.Tensor, b: torch.Tensor):
+    return a.shape == b.shape and torch.equal(a._indices(), b._indices()) and torch.equal(a._values(), b._values())
+
+
+def time_batches(builder, batches: list, repeats: int):
+    time_start = timer()
+    for _ in range(repeats):
+        for batch in batches:
+            builder.prepare_sparse_matrices(batch)
+    return (timer() - time_start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyTorch and libgnn.so sparse matrices of DGCNN')
+    parser.add_argument('-num_graphs', type=int, default=500, help='number of random graphs')
+    parser.add_argument('-batch_size', type=int, default=50, help='graphs per batch')
+    parser.add_argument('-max_clauses', type=int, default=20000, help='maximum number of clauses of a graph')
+    parser.add_argument('-repeats', type=int, default=3, help='number of timed epochs')
+    parser.add_argument('-msg_average', type=int, default=0, help='average instead of summing the messages (0/1)')
+    args, _ = parser.parse_known_args()
+
+    # libgnn.so reads -msg_average from sys.argv when it is imported
+    from code.libs.dgcnn.lib.gnn_lib import gnnlib
+
+    rng = np.random.default_rng(0)
+    graphs = []
+    for i in range(args.num_graphs):
+        num_of_clauses = int(rng.integers(1, args.max_clauses))
+        graphs.append(RandomGraph(f"graph_{i}", num_of_clauses, max(1, num_of_clauses // 4), 3, rng))
+    # An isolated node and a graph without edges
+    graphs[0].num_nodes += 1
+    graphs[1].num_edges = 0
+    graphs[1].edge_pairs = np.array([], dtype=np.int32)
+    batches = [graphs[start:start + args.batch_size] for start in range(0, len(graphs), args.batch_size)]
+
+    uncached = SparseMatrixBuilder(args.msg_average)
+    cached = SparseMatrixBuilder(args.msg_average, GraphCache(1 << 40, max_item_fraction=1.0))
+    for batch in batches:
+        reference = gnnlib.prepare_sparse_matrices(batch)
+        for builder in [uncached, cached, cached]:
+            for name, matrix, expected in zip(["n2n", "e2n", "subg"], builder.prepare_sparse_matrices(batch),
+                                              reference):
+                if not same_matrix(matrix, expected):
+                    raise AssertionError(f"{name} differs from libgnn.so")
+    print(f"Identical matrices on {len(batches)} batches of {args.batch_size} graphs " +
+          f"({sum(graph.num_edges for graph in graphs)} edges)")
+
+    libgnn_time = time_batches(gnnlib, batches, args.repeats)
+    uncached_time = time_batches(uncached, batches, args.repeats)
+    cached_time = time_batches(cached, batches, args.repeats)
+    print(f"{'method':>10} {'epoch':>10} {'speedup':>10}")
+    for name, epoch_time in [("libgnn", libgnn_time), ("torch", uncached_time), ("cached", cached_time)]:
+        print(f"{name:>10} {1000 * epoch_time:>8.1f}ms {libgnn_time / epoch_time:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares the element-wise dok_matrix construction of the adjacency matrix with the one-shot COO/CSR construction
+used by SparseMatrix.from_edgelist.
+
+Run from the repository root: python -m benchmarks.sparse_matrix_build
+"""
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+from scipy import sparse
+
+from code.preprocessing.cnf.edgelist import Edgelist, SparseMatrix
+
+
+def synthetic_edgelist(num_edges: int, seed=0):
+    rng = np.random.default_rng(seed)
+    num_nodes = max(2, num_edges // 8)
+    edgelist = Edgelist(0)
+    edgelist.data = rng.integers(0, num_nodes, size=(num_edges, 2), dtype=np.int32)
+    edgelist.max_node = int(edgelist.data.max())
+    return edgelist
+
+
+def build_dok_matrix(from_data: Edgelist):
+    n = from_data.max_node + 1
+    data = sparse.dok_matrix((n, n), dtype=np.float32)
+    for i in range(len(from_data.data)):
+        v1 = from_data.data[i][0]
+        v2 = from_data.data[i][1]
+        data[v1, v2] = 1
+    return data
+
+
+def build_csr_matrix(from_data: Edgelist):
+    graph_adj = SparseMatrix()
+    graph_adj.from_edgelist(from_data)
+    return graph_adj
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SparseMatrix build benchmark')
+    parser.add_argument('-sizes', type=str, default='10000-100000-1000000-10000000',
+                        help='number of edges in the synthetic graphs')
+    parser.add_argument('-max_dok_edges', type=int, default=1000000,
+                        help='largest graph built with the element-wise dok_matrix loop')
+    parser.add_argument('-dgl', action='store_true', help='include the DGL graph construction in the timings')
+    args = parser.parse_args()
+
+    print(f"{'edges':>12} {'dok_matrix':>12} {'COO/CSR':>12} {'speedup':>10}")
+    for num_edges in [int(size) for size in args.sizes.split('-')]:
+        edgelist = synthetic_edgelist(num_edges)
+
+        time_start = timer()
+        graph_adj = build_csr_matrix(edgelist)
+        if args.dgl:
+            graph_adj.to_dgl_graph()
+        csr_time = timer() - time_start
+
+        if num_edges <= args.max_dok_edges:
+            time_start = timer()
+            dok = build_dok_matrix(edgelist)
+            dok_time = timer() - time_start
+            assert (dok.tocsr() != graph_adj.data).nnz == 0
+            print(f"{num_edges:>12} {dok_time:>11.3f}s {csr_time:>11.3f}s {dok_time / csr_time:>9.1f}x")
+        else:
+            print(f"{num_edges:>12} {'skipped':>12} {csr_time:>11.3f}s {'-':>10}")
+
+
+if __name__ == "__main__":
+    main()
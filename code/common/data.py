@@ -3,24 +3,23 @@ import os
 import pandas as pd
 from sklearn import preprocessing
 
-from .process_instances import prepare_features_data, prepare_output_data, filter_data_by_split
+from .process_instances import prepare_features_data, prepare_output_data, load_features_data, load_output_data, \
+    split_data
 
 
-def load_data(data_dir: str):
+def load_data(data_dir: str, runtime_dedup="first", workers=None):
     print("Preparing the X and Y data")
 
     splits = pd.read_csv(os.path.join(data_dir, "splits.csv"))
 
-    prepare_features_data(data_dir, splits)
-    x = pd.read_csv(os.path.join(data_dir, "all_data_x.csv"))
+    prepare_features_data(data_dir, splits, workers)
+    x = load_features_data(data_dir)
 
-    prepare_output_data(data_dir, splits)
-    y = pd.read_csv(os.path.join(data_dir, "all_data_y.csv"))
+    prepare_output_data(data_dir, splits, runtime_dedup)
+    y = load_output_data(data_dir, runtime_dedup)
 
-    x_train, y_train = filter_data_by_split(x, y, splits, "Train")
-    x_val, y_val = filter_data_by_split(x, y, splits, "Validation")
-    x_train_val, y_train_val = filter_data_by_split(x, y, splits, "Train+Validation")
-    x_test, y_test = filter_data_by_split(x, y, splits, "Test")
+    (x_train, y_train), (x_val, y_val), (x_train_val, y_train_val), (x_test, y_test) = \
+        split_data(x, y, splits, ["Train", "Validation", "Train+Validation", "Test"])
 
     return x_train, y_train, x_val, y_val, x_train_val, y_train_val, x_test, y_test
 
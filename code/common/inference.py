@@ -0,0 +1,107 @@
+import os
+from timeit import default_timer as timer
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from .sampler import SizeBucketedBatchSampler
+
+
+def inference_batches(num_instances: int, batch_size: int, sizes=None, max_batch_edges=0, num_size_buckets=10):
+    """
+        Index lists of the prediction batches. With max_batch_edges > 0, up to batch_size graphs of similar size are
+        batched under the edge budget, otherwise the instances go in order, batch_size at a time.
+    """
+    if max_batch_edges > 0:
+        return list(SizeBucketedBatchSampler(sizes, max_batch_edges, batch_size, num_size_buckets, shuffle=False))
+    return [list(range(start, min(start + batch_size, num_instances))) for start in range(0, num_instances, batch_size)]
+
+
+class RunningMetrics(object):
+    """
+        Mean squared and absolute errors kept as per-output sums, so they are updated batch by batch without looking
+        at the earlier predictions again.
+    """
+    def __init__(self, output_dim: int):
+        self.count = 0
+        self.sum_squared_errors = np.zeros(output_dim)
+        self.sum_absolute_errors = np.zeros(output_dim)
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray):
+        errors = y_pred - y_true
+        self.count += len(y_true)
+        self.sum_squared_errors += np.sum(errors ** 2, axis=0)
+        self.sum_absolute_errors += np.sum(np.abs(errors), axis=0)
+
+    @property
+    def mse(self):
+        return np.sum(self.sum_squared_errors) / max(self.count * len(self.sum_squared_errors), 1)
+
+    @property
+    def mae(self):
+        return np.sum(self.sum_absolute_errors) / max(self.count * len(self.sum_absolute_errors), 1)
+
+
+class InferenceEngine(object):
+    """
+        Batched prediction without autograd, shared by the graph models. run() takes batches of (indices, inputs,
+        labels) and writes the predictions and labels into arrays preallocated for all instances, at the rows given
+        by the indices, so the batches can be formed by graph size instead of by position. The running metrics are
+        updated after every batch. The wall time of a batch, from requesting it from the batches, which loads and
+        collates its graphs, to its predictions on the host, is split evenly among its instances as their latency.
+
+        predict maps the inputs of a batch to a (batch size, output_dim) tensor.
+    """
+    def __init__(self, predict, num_instances: int, output_dim: int, description="Testing"):
+        self.predict = predict
+        self.num_instances = num_instances
+        self.description = description
+        self.y_pred = np.empty((num_instances, output_dim))
+        self.y_true = np.empty((num_instances, output_dim))
+        self.latencies = np.empty(num_instances)
+        self.predicted = np.zeros(num_instances, dtype=bool)
+        self.metrics = RunningMetrics(output_dim)
+
+    def run(self, batches, num_of_batches: int = None):
+        pbar = tqdm(total=num_of_batches, unit='batch')
+        with torch.no_grad():
+            batches = iter(batches)
+            while True:
+                time_start = timer()
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                indices, inputs, labels = batch
+                indices = np.asarray(indices, dtype=np.int64)
+                predictions = self.predict(inputs).detach().cpu().numpy()
+                self.latencies[indices] = (timer() - time_start) / len(indices)
+
+                labels = labels.cpu().numpy() if isinstance(labels, torch.Tensor) else np.asarray(labels)
+                self.y_pred[indices] = predictions
+                self.y_true[indices] = labels
+                self.predicted[indices] = True
+                self.metrics.update(labels, predictions)
+
+                pbar.update(n=1)
+                pbar.set_description(f'{self.description} loss: {self.metrics.mse:.5f}')
+        pbar.close()
+
+        if not np.all(self.predicted):
+            raise ValueError(f"{np.sum(~self.predicted)} of {self.num_instances} instances were not predicted")
+        return self
+
+    def save(self, pred_filename: str, true_filename: str = None, latency_filename: str = None):
+        np.savetxt(pred_filename, self.y_pred, "%.6f")
+        if true_filename is not None:
+            np.savetxt(true_filename, self.y_true, "%.6f")
+        if latency_filename is None:
+            latency_filename = os.path.join(os.path.dirname(pred_filename), "Test_latency.txt")
+        np.savetxt(latency_filename, self.latencies, "%.6f",
+                   header="Prediction latency per instance in seconds, with loading and batching")
+
+    def latency_summary(self) -> str:
+        return (f"Prediction latency per instance, with loading and batching: mean {1000 * np.mean(self.latencies):.2f}ms, " +
+                f"median {1000 * np.median(self.latencies):.2f}ms, " +
+                f"95th percentile {1000 * np.percentile(self.latencies, 95):.2f}ms, " +
+                f"total {np.sum(self.latencies):.2f}s")
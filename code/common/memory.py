@@ -0,0 +1,88 @@
+import os
+import gc
+import sys
+import resource
+from timeit import default_timer as timer
+
+import torch
+
+
+def resident_bytes() -> int:
+    """
+        Resident memory of the process. Read from /proc on Linux, elsewhere the peak resident memory is the best
+        available estimate.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        ru_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return ru_maxrss if sys.platform == "darwin" else ru_maxrss * 1024
+
+
+def device_bytes() -> int:
+    return torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+
+
+class MemoryManager(object):
+    """
+        Replaces a full garbage collection after every batch. step() is called after every batch and measures the
+        resident host memory and the allocated CUDA memory; a collection runs only when either of them grew by more
+        than threshold_bytes since the last collection. With threshold_bytes = 0 it collects after every batch, like
+        the training loops used to. Collections, the time spent in them and the peak memory are counted until
+        reset_statistics is called.
+    """
+    def __init__(self, threshold_bytes: int):
+        self.threshold_bytes = threshold_bytes
+        self.host_baseline = resident_bytes()
+        self.device_baseline = device_bytes()
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        self.steps = 0
+        self.collections = 0
+        self.collection_time = 0.0
+        self.peak_host_bytes = 0
+        self.peak_device_bytes = 0
+
+    def step(self):
+        self.steps += 1
+        host = resident_bytes()
+        device = device_bytes()
+        self.peak_host_bytes = max(self.peak_host_bytes, host)
+        self.peak_device_bytes = max(self.peak_device_bytes, device)
+
+        if host - self.host_baseline >= self.threshold_bytes or device - self.device_baseline >= self.threshold_bytes:
+            self.collect()
+
+    def collect(self):
+        time_start = timer()
+        gc.collect()
+        self.collection_time += timer() - time_start
+        self.collections += 1
+        # Memory freed by the collection may stay mapped by the allocator, so the baseline is measured again
+        self.host_baseline = resident_bytes()
+        self.device_baseline = device_bytes()
+
+    def statistics(self) -> dict:
+        return {
+            "steps": self.steps,
+            "collections": self.collections,
+            "collection_time": self.collection_time,
+            "peak_host_bytes": self.peak_host_bytes,
+            "peak_device_bytes": self.peak_device_bytes,
+        }
+
+    def __str__(self):
+        stats = self.statistics()
+        return (f"Memory: {stats['collections']} collections in {stats['steps']} batches " +
+                f"({stats['collection_time']:.2f}s), peak {stats['peak_host_bytes'] / (1024 * 1024):.1f}MB host, " +
+                f"{stats['peak_device_bytes'] / (1024 * 1024):.1f}MB device")
+
+
+def print_memory_statistics(memory_manager: MemoryManager):
+    if memory_manager is None:
+        return
+    print(f"\t{memory_manager}")
+    memory_manager.reset_statistics()
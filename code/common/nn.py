@@ -1,25 +1,94 @@
 import os
-import gc
 
 import numpy as np
 from tqdm import tqdm
 import dgl
 import torch
+from torch.utils.data import DataLoader
+
+from .sampler import SizeBucketedBatchSampler
+from .memory import MemoryManager
+from .inference import InferenceEngine, inference_batches
 
 from .process_results import calculate_r2_and_rmse_metrics
 
 
-def collate(dev):
-    def collate_fn(samples):
-        graphs, labels = map(list, zip(*samples))
-        batched_graph = dgl.batch(graphs)
-        batched_labels = torch.tensor(labels, device=dev, dtype=torch.float32)
-        return batched_graph, batched_labels
+def collate(samples):
+    graphs, labels = map(list, zip(*samples))
+    batched_graph = dgl.batch(graphs)
+    # Labels are created on the CPU, so the collation can run in worker processes; the loops move them to the device
+    batched_labels = torch.from_numpy(np.stack(labels).astype(np.float32))
+    return batched_graph, batched_labels
+
+
+def create_data_loader(dataset, batch_size: int, shuffle: bool, num_workers=0, pin_memory=False, prefetch_factor=2,
+                       max_batch_edges=0, num_size_buckets=10):
+    """
+        With num_workers > 0, graphs are loaded and batched in worker processes, which prefetch prefetch_factor
+        batches each while the model is busy with the current one. The workers are kept alive between epochs. A
+        graph cache of the dataset would be filled separately in every worker, so it is meant for num_workers == 0.
+
+        With max_batch_edges > 0, batches of up to batch_size graphs of similar size are formed under the edge
+        budget by a SizeBucketedBatchSampler.
+    """
+    worker_params = {}
+    if num_workers > 0:
+        worker_params = {"prefetch_factor": prefetch_factor, "persistent_workers": True}
+    if max_batch_edges > 0:
+        batch_sampler = SizeBucketedBatchSampler(dataset.graph_sizes(), max_batch_edges, batch_size, num_size_buckets,
+                                                 shuffle)
+        return DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=collate, num_workers=num_workers,
+                          pin_memory=pin_memory, **worker_params)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate, num_workers=num_workers,
+                      pin_memory=pin_memory, **worker_params)
+
+
+def create_inference_loader(dataset, batch_size: int, max_batch_edges=0, num_size_buckets=10, num_workers=0,
+                            pin_memory=False, prefetch_factor=2, persistent_workers=False):
+    """
+        Batches of dataset indices for prediction and the DataLoader that loads them in the same order. With
+        max_batch_edges > 0 the batches are formed under the edge budget, otherwise they hold batch_size consecutive
+        graphs.
+    """
+    sizes = dataset.graph_sizes() if max_batch_edges > 0 else None
+    batches = inference_batches(len(dataset), batch_size, sizes, max_batch_edges, num_size_buckets)
+    worker_params = {}
+    if num_workers > 0:
+        worker_params = {"prefetch_factor": prefetch_factor, "persistent_workers": persistent_workers}
+    data_loader = DataLoader(dataset, batch_sampler=batches, collate_fn=collate, num_workers=num_workers,
+                             pin_memory=pin_memory, **worker_params)
+    return batches, data_loader
+
+
+def run_inference(predictor, batches, data_loader, device, output_dim=31, description="Testing"):
+    """
+        Predicts the batches of a loader from create_inference_loader with an InferenceEngine, which writes every
+        prediction at the row of its instance.
+    """
+    predictor.eval()
+    engine = InferenceEngine(lambda graph: predictor(graph.to(device)), len(data_loader.dataset), output_dim,
+                             description)
+    return engine.run(((indices, graph, labels) for indices, (graph, labels) in zip(batches, data_loader)),
+                      len(batches))
+
+
+def predict_dataset(predictor, dataset, device, batch_size: int, max_batch_edges=0, num_size_buckets=10, num_workers=0,
+                    pin_memory=False, prefetch_factor=2, output_dim=31, description="Testing"):
+    batches, data_loader = create_inference_loader(dataset, batch_size, max_batch_edges, num_size_buckets, num_workers,
+                                                   pin_memory, prefetch_factor)
+    return run_inference(predictor, batches, data_loader, device, output_dim, description)
 
-    return collate_fn
 
+def print_graph_cache_statistics(dataset):
+    graph_cache = getattr(dataset, "graph_cache", None)
+    if graph_cache is None:
+        return
+    print(f"\t{graph_cache}")
+    graph_cache.reset_statistics()
 
-def train_one_epoch(data_loader_train, num_of_batches, loss_func, model, optimizer, train_device):
+
+def train_one_epoch(data_loader_train, num_of_batches, loss_func, model, optimizer, train_device,
+                    memory_manager: MemoryManager = None):
     model.train()
     train_loss = 0
     iter_idx = 0
@@ -27,7 +96,7 @@ def train_one_epoch(data_loader_train, num_of_batches, loss_func, model, optimiz
 
     for iter_idx, (bg, label) in enumerate(data_loader_train):
         # Get the data
-        inputs, labels = bg.to(train_device), label.to(train_device)
+        inputs, labels = bg.to(train_device), label.to(train_device, non_blocking=True)
 
         # Zero the parameter gradients
         optimizer.zero_grad()
@@ -46,42 +115,29 @@ def train_one_epoch(data_loader_train, num_of_batches, loss_func, model, optimiz
 
         del inputs
         del labels
-        gc.collect()
+        if memory_manager is not None:
+            memory_manager.step()
 
     pbar.close()
 
     return np.round(train_loss / (iter_idx + 1), 3)
 
 
-def validate_one_epoch(model_root, epoch, predictor, loss_func, data_loader_val, num_of_batches, train_device,
-                       test_device):
-    predictor.to(test_device)
-    predictor.eval()
-    val_loss = 0
-    iter_num = 0
-    y_pred = np.empty((0, 31))
-    y_true = np.empty((0, 31))
-    pbar = tqdm(total=num_of_batches, unit='batch')
-
-    for iter_num, (bg, label) in enumerate(data_loader_val):
-        # Get the data
-        prediction = predictor(bg.to(test_device))
-
-        # Calculate loss
-        loss = loss_func(prediction, label.to(test_device))
-        curr_loss = loss.detach().item()
-        val_loss += curr_loss
-
-        # Save prediction for calculating R^2 and RMSE scores
-        pred_y = predictor(bg.to(test_device))
-        pred_y = np.array(pred_y.to(test_device).detach().numpy())
-        y_pred = np.vstack((y_pred, pred_y))
-        y_true = np.vstack((y_true, label.to(test_device)))
-
-        pbar.update(n=1)
-        pbar.set_description(f'Validation loss: {curr_loss:.5f}')
-
-    pbar.close()
+def validate_one_epoch(model_root, epoch, predictor, loss_func, val_batches, data_loader_val, train_device,
+                       test_device, output_dim=31):
+    """
+        Evaluates the model on the batches of a loader from create_inference_loader, without building autograd
+        graphs. The predictions and labels are written into arrays preallocated for the whole validation set, at the
+        rows of their instances, so the batches can be formed under the edge budget. The model is moved to
+        test_device only if it is not the train_device, so passing the train_device validates in place. The loss is
+        the average over the instances, so it does not depend on the batching.
+    """
+    move_model = torch.device(test_device) != torch.device(train_device)
+    if move_model:
+        predictor.to(test_device)
+    engine = run_inference(predictor, val_batches, data_loader_val, test_device, output_dim, "Validation")
+    y_pred, y_true = engine.y_pred, engine.y_true
+    val_loss = loss_func(torch.from_numpy(y_pred), torch.from_numpy(y_true)).item()
 
     outputs_filename = os.path.join(model_root, f"Validation_{epoch}_outputs.txt")
     np.savetxt(outputs_filename, y_pred, "%.6f")
@@ -90,9 +146,10 @@ def validate_one_epoch(model_root, epoch, predictor, loss_func, data_loader_val,
         np.savetxt(ytrue_filename, y_true, "%.6f")
 
     r2_score_val_avg, rmse_score_val_avg, _, _ = calculate_r2_and_rmse_metrics(None, None, y_true, y_pred)
-    predictor.to(train_device)
+    if move_model:
+        predictor.to(train_device)
 
-    return np.round([val_loss / (iter_num + 1), r2_score_val_avg, rmse_score_val_avg], 3)
+    return np.round([val_loss, r2_score_val_avg, rmse_score_val_avg], 3)
 
 
 def time_for_early_stopping(val_losses: list, look_behind: int):
@@ -1,112 +1,157 @@
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
 from ..preprocessing.algorithms.math import log10_transform_data
 
 
-def filter_by_available_instances(available_instances: list):
-    def closure(df: pd.DataFrame):
-        filter_array = []
-        for i in range(len(df)):
-            value = df.iloc[i]["instance_id"] in available_instances
-            filter_array.append(value)
-        return filter_array
-    return closure
+def read_features_file(data_dir: str, file: str) -> tuple:
+    """
+        Header and first row of the SATzilla features of an instance, as lines of CSV text
+    """
+    with open(os.path.join(data_dir, file), "r") as f:
+        return f.readline().rstrip("\r\n"), f.readline().rstrip("\r\n")
 
 
-def prepare_features_data(data_dir: str, splits: pd.DataFrame):
+def parse_features(files: list, lines: list) -> pd.DataFrame:
+    """
+        Features of the instances as a single DataFrame with their instance_id in front. The rows of the files with
+        the same header are parsed together, as a single CSV text.
+    """
+    rows_by_header = {}
+    for file, (header, row) in zip(files, lines):
+        # Files without a row of features are left out, like before
+        if not row:
+            continue
+        instance_id = file[:-len(".features")].replace('"', '""')
+        rows_by_header.setdefault(header, []).append(f'"{instance_id}",{row}\n')
+
+    xs = [pd.read_csv(io.StringIO("instance_id," + header + "\n" + "".join(rows)), dtype={"instance_id": str})
+          for header, rows in rows_by_header.items()]
+    return pd.concat(xs, ignore_index=True)
+
+
+def prepare_features_data(data_dir: str, splits: pd.DataFrame, workers=None):
     all_data_x_file = os.path.join(data_dir, "all_data_x.csv")
     if os.path.exists(all_data_x_file):
         return
 
-    instance_ids = []
-    for basedir, _, files in os.walk(data_dir):
-        for file in files:
-            if file.endswith(".features"):
-                instance_id = os.path.relpath(os.path.join(basedir, file), data_dir)
-                instance_ids.append(instance_id)
-
-    xs = []
-    for i in range(len(instance_ids)):
-        file = instance_ids[i]
-        n_series = pd.Series([file[:-9]], name="instance_id")
-        data = pd.read_csv(os.path.join(data_dir, file))
-        x = pd.merge(n_series, data, left_index=True, right_index=True)
-        xs.append(x)
-
-    x = pd.concat(xs)
-
-    available_instances = list(splits["instance_id"])
-    x = x.loc[filter_by_available_instances(available_instances), :]
+    # Only the features of the instances in the splits are read, by a pool of threads, and parsed at once
+    available_instances = set(splits["instance_id"])
+    files = []
+    for basedir, _, filenames in os.walk(data_dir):
+        for filename in filenames:
+            if filename.endswith(".features"):
+                file = os.path.relpath(os.path.join(basedir, filename), data_dir)
+                if file[:-len(".features")] in available_instances:
+                    files.append(file)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        lines = list(executor.map(lambda file: read_features_file(data_dir, file), files))
+
+    x = parse_features(files, lines)
     x = x.sort_values(by=["instance_id"])
     x.to_csv(all_data_x_file, index=False)
+    x.to_pickle(os.path.join(data_dir, "all_data_x.pkl"))
+
+
+# Aggregations of the runtimes of an instance and solver that appear more than once in the runtime tables
+RUNTIME_DEDUP_POLICIES = ["first", "mean", "min"]
 
 
-def prepare_output_data(data_dir: str, splits: pd.DataFrame):
+def pivot_runtimes(data: pd.DataFrame, dedup="first") -> pd.DataFrame:
+    """
+        Instance x solver runtime matrix of runtime tables with one row per run, indexed by instance_id. The solvers
+        are the columns in the order of their first appearance in the tables, which is the column order of the
+        previous all_data_y.csv files.
+    """
+    if dedup not in RUNTIME_DEDUP_POLICIES:
+        raise ValueError(f"Unknown dedup policy: {dedup}. Must be one of: {', '.join(RUNTIME_DEDUP_POLICIES)}")
+
+    solver_names = pd.unique(data["solver name"])
+    y = data.groupby(["instance_id", "solver name"], sort=False)["runtime"].agg(dedup).unstack("solver name")
+    y = y.reindex(columns=solver_names)
+    y.columns.name = None
+    return y
+
+
+def read_runtime_dedup(data_dir: str) -> str:
+    """
+        Dedup policy of all_data_y.csv, stored next to it in all_data_y.dedup. Files without it were built before
+        the policy could be chosen, with the first runtimes.
+    """
+    dedup_file = os.path.join(data_dir, "all_data_y.dedup")
+    if not os.path.exists(dedup_file):
+        return "first"
+    with open(dedup_file, "r") as f:
+        return f.read().strip()
+
+
+def prepare_output_data(data_dir: str, splits: pd.DataFrame, dedup="first"):
     all_data_y_file = os.path.join(data_dir, "all_data_y.csv")
-    if os.path.exists(all_data_y_file):
+    # The runtimes are pivoted again when they were aggregated with another dedup policy
+    if os.path.exists(all_data_y_file) and read_runtime_dedup(data_dir) == dedup:
         return
 
     data = pd.concat(
-        [pd.read_csv(os.path.join(data_dir, "SAT12-HAND.csv")), pd.read_csv(os.path.join(data_dir, "SAT12-INDU.csv"))])
-
-    instance_ids = []
-    instance_id = None
-    n = len(data)
-    new_row = None
-    columns = None
-    ys = []
-    for i in range(n):
-        old_row = data.iloc[i]
-        inst_id = old_row["instance_id"]
-        if inst_id != instance_id:
-            if new_row is not None:
-                if inst_id in instance_ids:
-                    continue
-                y = pd.DataFrame([new_row], columns=columns)
-                ys.append(y)
-                instance_ids.append(instance_id)
-
-            new_row = [inst_id]
-            columns = ["instance_id"]
-            instance_id = inst_id
-        new_row.append(old_row["runtime"])
-        columns.append(old_row["solver name"])
-
-    y = pd.concat(ys)
-
-    available_instances = list(splits["instance_id"])
-    y = y.loc[filter_by_available_instances(available_instances), :]
-    y = y.sort_values(by=["instance_id"])
-
-    # Save all y data
+        [pd.read_csv(os.path.join(data_dir, "SAT12-HAND.csv")), pd.read_csv(os.path.join(data_dir, "SAT12-INDU.csv"))],
+        ignore_index=True)
+
+    y = pivot_runtimes(data, dedup)
+    y = y[y.index.isin(splits["instance_id"])].sort_index()
+    y = y.reset_index()
+
+    # Save all y data, with a binary copy per dedup policy that is faster to load
     y.to_csv(all_data_y_file, index=False)
+    y.to_pickle(os.path.join(data_dir, f"all_data_y.{dedup}.pkl"))
+    with open(os.path.join(data_dir, "all_data_y.dedup"), "w") as f:
+        f.write(dedup)
+
+
+def read_data_file(csv_file: str, cache_file: str = None) -> pd.DataFrame:
+    """
+        A CSV file of prepared data, from its binary copy if that is not older than the CSV file. The binary copy is
+        the .pkl file of the same name, unless cache_file is given.
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(csv_file)[0] + ".pkl"
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(csv_file):
+        return pd.read_pickle(cache_file)
+    return pd.read_csv(csv_file)
+
+
+def load_features_data(data_dir: str) -> pd.DataFrame:
+    return read_data_file(os.path.join(data_dir, "all_data_x.csv"))
+
+
+def load_output_data(data_dir: str, dedup="first") -> pd.DataFrame:
+    if read_runtime_dedup(data_dir) != dedup:
+        raise ValueError(f"The runtimes in {data_dir} were aggregated with the dedup policy " +
+                         f"{read_runtime_dedup(data_dir)}, not {dedup}")
+    return read_data_file(os.path.join(data_dir, "all_data_y.csv"), os.path.join(data_dir, f"all_data_y.{dedup}.pkl"))
+
+
+def split_data(x_features: pd.DataFrame, y_outputs: pd.DataFrame, splits: pd.DataFrame, split_names: list) -> list:
+    """
+        (x, y) of every split in split_names, where a split is a split name or names joined with +, e.g.
+        Train+Validation. The features and outputs are joined on instance_id once, the instances with both keep the
+        order of the features and every split selects its rows with a mask. The outputs are log10 transformed.
+    """
+    x = x_features.set_index("instance_id")
+    y = y_outputs.set_index("instance_id")
+    index = x.index[x.index.isin(y.index)]
+    x = x.loc[index]
+    y = log10_transform_data(y.loc[index].copy())
+    instance_splits = splits.drop_duplicates(subset=["instance_id"]).set_index("instance_id")["split"].reindex(index)
+
+    data = []
+    for split in split_names:
+        mask = instance_splits.isin(split.split("+")).to_numpy()
+        data.append((x[mask].reset_index(drop=True), y[mask].reset_index(drop=True)))
+    return data
 
 
 def filter_data_by_split(x_features: pd.DataFrame, y_outputs: pd.DataFrame, splits: pd.DataFrame, split: str):
-    split_criteria = split.split("+")
-    chosen_instances = []
-    for i in range(len(splits)):
-        instance_split = splits.iloc[i]["split"]
-        if instance_split in split_criteria:
-            instance_id = splits.iloc[i]["instance_id"]
-            chosen_instances.append(instance_id)
-
-    filter_indices = []
-    for i in range(len(x_features)):
-        instance_id = x_features.iloc[i]["instance_id"]
-        filter_indices.append(instance_id in chosen_instances)
-
-    x_result = x_features[filter_indices]
-    x_result.index = pd.Series(list(range(len(chosen_instances))))
-
-    filter_indices = []
-    for i in range(len(y_outputs)):
-        instance_id = y_outputs.iloc[i]["instance_id"]
-        filter_indices.append(instance_id in chosen_instances)
-
-    y_result = y_outputs[filter_indices]
-    y_result.index = pd.Series(list(range(len(chosen_instances))))
-
-    return x_result.drop(columns=["instance_id"]), log10_transform_data(y_result.drop(columns=["instance_id"]))
\ No newline at end of file
+    return split_data(x_features, y_outputs, splits, [split])[0]
@@ -0,0 +1,67 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class SizeBucketedBatchSampler(Sampler):
+    """
+        Forms batches of graphs of similar size whose total size stays under max_batch_size, instead of a fixed number
+        of graphs per batch. The graphs are split into num_buckets buckets by the quantiles of their log-size. Every
+        epoch the graphs are shuffled within the buckets, packed greedily into batches and the batches of all buckets
+        are shuffled together. A graph larger than the budget gets a batch of its own.
+
+        sizes are any measure proportional to the memory of a graph, e.g. the number of edges.
+    """
+    def __init__(self, sizes, max_batch_size: int, max_batch_graphs: int = None, num_buckets=10, shuffle=True,
+                 seed=None):
+        super(SizeBucketedBatchSampler, self).__init__()
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.max_batch_size = max_batch_size
+        self.max_batch_graphs = max_batch_graphs
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+        order = np.argsort(self.sizes, kind='stable')
+        num_buckets = max(1, min(num_buckets, len(order)))
+        log_sizes = np.log1p(self.sizes[order])
+        boundaries = np.quantile(log_sizes, np.linspace(0, 1, num_buckets + 1)[1:-1]) if len(order) > 0 else []
+        bucket_ids = np.searchsorted(boundaries, log_sizes, side='right')
+        self.buckets = [order[bucket_ids == bucket] for bucket in range(num_buckets)]
+        self.buckets = [bucket for bucket in self.buckets if len(bucket) > 0]
+
+        self.batches = self.create_batches()
+
+    def pack(self, bucket: np.ndarray):
+        batches = []
+        batch = []
+        batch_size = 0
+        for idx in bucket:
+            size = self.sizes[idx]
+            full = self.max_batch_graphs is not None and len(batch) >= self.max_batch_graphs
+            if len(batch) > 0 and (batch_size + size > self.max_batch_size or full):
+                batches.append(batch)
+                batch = []
+                batch_size = 0
+            batch.append(int(idx))
+            batch_size += size
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def create_batches(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = self.rng.permutation(bucket)
+            batches += self.pack(bucket)
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        # The batches of the next epoch are prepared in advance, so __len__ is exact for the upcoming epoch
+        batches = self.batches
+        self.batches = self.create_batches()
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches)
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class SearchResults(object):
+    """
+        Append-only store of the validation scores of a hyperparameter search, in the CSV format of the search
+        results: one row per solver with the parameters of the grid cell, the solver name and its R^2 and RMSE scores.
+        The rows of a cell are appended and flushed to disk as soon as the cell is scored, so a restarted search skips
+        the cells in the file. Cells are keyed by the string values of their parameters, as they are written.
+    """
+    def __init__(self, filename: str, param_names: list, solver_names: list):
+        self.filename = filename
+        self.param_names = list(param_names)
+        self.solver_names = list(solver_names)
+        self.completed = set()
+
+        if os.path.exists(filename):
+            self.remove_partial_line()
+            data = self.read()
+            counts = data.groupby(self.param_names).size()
+            # Cells cut by a crash have fewer rows than solvers and are scored again
+            self.completed = {key if isinstance(key, tuple) else (key,)
+                              for key, count in counts.items() if count >= len(self.solver_names)}
+
+    def remove_partial_line(self):
+        with open(self.filename, "rb+") as csv:
+            content = csv.read()
+            if content and not content.endswith(b"\n"):
+                csv.truncate(content.rfind(b"\n") + 1)
+
+    def read(self) -> pd.DataFrame:
+        data = pd.read_csv(self.filename, dtype={name: str for name in self.param_names + ["solver name"]})
+        return data.drop_duplicates(subset=self.param_names + ["solver name"], keep="last")
+
+    @staticmethod
+    def key(params) -> tuple:
+        return tuple(str(param) for param in params)
+
+    def is_completed(self, *params) -> bool:
+        return self.key(params) in self.completed
+
+    def append(self, params: tuple, r2_scores, rmse_scores):
+        key = self.key(params)
+        prefix = ",".join(key)
+        rows = "".join(f"{prefix},{solver_name},{r2_score},{rmse_score}\n"
+                       for solver_name, r2_score, rmse_score in zip(self.solver_names, r2_scores, rmse_scores))
+
+        with open(self.filename, "a", encoding="utf-8") as csv:
+            if csv.tell() == 0:
+                csv.write(",".join(self.param_names) + ",solver name,r2 score,rmse score\n")
+            csv.write(rows)
+            csv.flush()
+            os.fsync(csv.fileno())
+        self.completed.add(key)
+
+    def load(self, param_grids: list) -> tuple:
+        """
+            R^2 and RMSE scores as arrays (len(grid) for grid in param_grids) + (solvers,), NaN for missing cells
+        """
+        index = pd.MultiIndex.from_product([[str(param) for param in grid] for grid in param_grids] +
+                                           [self.solver_names], names=self.param_names + ["solver name"])
+        shape = tuple(len(grid) for grid in param_grids) + (len(self.solver_names),)
+        if not os.path.exists(self.filename):
+            return np.full(shape, np.nan), np.full(shape, np.nan)
+
+        data = self.read().set_index(self.param_names + ["solver name"]).reindex(index)
+        return data["r2 score"].to_numpy(dtype=np.float64).reshape(shape), \
+            data["rmse score"].to_numpy(dtype=np.float64).reshape(shape)
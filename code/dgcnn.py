@@ -6,8 +6,9 @@ import pandas as pd
 import torch
 
 from .libs.dgcnn.classes import DGCNNPredictor
-from .libs.dgcnn.util import loop_dataset, load_next_batch
+from .libs.dgcnn.util import loop_dataset, load_next_batch, dgcnn_graph_sizes, predict_instances
 from .common.nn import time_for_early_stopping
+from .common.memory import print_memory_statistics
 
 
 def print_box(message: str, length=80):
@@ -23,6 +24,8 @@ def print_box(message: str, length=80):
 def train_one_epoch(dgcnn: DGCNNPredictor, epoch: int, batch_size: int, idxes: list, train_losses: dict,
                     dataset_type: str, print_auc: bool):
     dgcnn.predictor.train()
+    if dgcnn.max_batch_edges > 0 and dgcnn.graph_sizes is None:
+        dgcnn.graph_sizes = dgcnn_graph_sizes(dgcnn.cnf_dir, dgcnn.instance_ids, dgcnn.graph_store, dgcnn.pickle_ext)
     avg_loss = loop_dataset(cnf_dir=dgcnn.cnf_dir,
                             model_output_dir=dgcnn.model_output_dir,
                             model=dgcnn.model,
@@ -34,7 +37,13 @@ def train_one_epoch(dgcnn: DGCNNPredictor, epoch: int, batch_size: int, idxes: l
                             random_shuffle=True,
                             optimizer=dgcnn.optimizer,
                             batch_size=batch_size,
-                            dataset_type=dataset_type)
+                            dataset_type=dataset_type,
+                            graph_store=dgcnn.graph_store,
+                            pickle_ext=dgcnn.pickle_ext,
+                            graph_sizes=dgcnn.graph_sizes,
+                            max_batch_edges=dgcnn.max_batch_edges,
+                            num_size_buckets=dgcnn.num_size_buckets,
+                            memory_manager=dgcnn.memory_manager)
     if not print_auc:
         avg_loss[2] = 0.0
     if dgcnn.regression:
@@ -45,6 +54,9 @@ def train_one_epoch(dgcnn: DGCNNPredictor, epoch: int, batch_size: int, idxes: l
     else:
         print('\033[92m  Average training of epoch %d: loss %.5f acc %.5f auc %.5f\033[0m' % (
             epoch, avg_loss[0], avg_loss[1], avg_loss[2]))
+    print(f"  {dgcnn.predictor.assembler()}")
+    dgcnn.predictor.assembler().reset_statistics()
+    print_memory_statistics(dgcnn.memory_manager)
 
 
 def validate_one_epoch(dgcnn: DGCNNPredictor, epoch: int, batch_size: int, val_losses: dict, print_auc: bool):
@@ -63,7 +75,10 @@ def validate_one_epoch(dgcnn: DGCNNPredictor, epoch: int, batch_size: int, val_l
                             random_shuffle=False,
                             optimizer=None,
                             batch_size=batch_size,
-                            dataset_type="Validation")
+                            dataset_type="Validation",
+                            graph_store=dgcnn.graph_store,
+                            pickle_ext=dgcnn.pickle_ext,
+                            memory_manager=dgcnn.memory_manager)
     if not print_auc:
         val_loss[2] = 0.0
     if dgcnn.regression:
@@ -74,6 +89,7 @@ def validate_one_epoch(dgcnn: DGCNNPredictor, epoch: int, batch_size: int, val_l
     else:
         print('\033[92m  Average validation of epoch %d: loss %.5f acc %.5f auc %.5f\033[0m' % (
             epoch, val_loss[0], val_loss[1], val_loss[2]))
+    print_memory_statistics(dgcnn.memory_manager)
 
 
 def train(dgcnn: DGCNNPredictor, num_epochs: int, batch_size: int, look_behind: int, print_auc=False):
@@ -154,7 +170,9 @@ def retrain(dgcnn: DGCNNPredictor, batch_size: int, extract_features=False, prin
                                            instance_ids=dgcnn.instance_ids,
                                            selected_idx=list(sorted(train_validation_idxes)),
                                            splits=dgcnn.splits,
-                                           dataset_type="Train+Validation")
+                                           dataset_type="Train+Validation",
+                                           graph_store=dgcnn.graph_store,
+                                           pickle_ext=dgcnn.pickle_ext)
         features, labels = dgcnn.predictor.output_features(train_val_graphs)
         labels = labels.type('torch.FloatTensor')
         np.savetxt(os.path.join(dgcnn.model_output_dir, dgcnn.model, 'extracted_features_train.txt'),
@@ -179,18 +197,42 @@ def test(dgcnn: DGCNNPredictor, batch_size: int, extract_features=False, print_a
 
     # Test the final model
     dgcnn.predictor.eval()
-    test_loss = loop_dataset(cnf_dir=dgcnn.cnf_dir,
-                             model_output_dir=dgcnn.model_output_dir,
-                             model=dgcnn.model,
-                             instance_ids=dgcnn.instance_ids,
-                             splits=dgcnn.splits,
-                             epoch=0,
-                             classifier=dgcnn.predictor,
-                             sample_idxes=test_idxes,
-                             random_shuffle=False,
-                             optimizer=None,
-                             batch_size=batch_size,
-                             dataset_type="Test")
+    if dgcnn.regression:
+        if dgcnn.max_batch_edges > 0 and dgcnn.graph_sizes is None:
+            dgcnn.graph_sizes = dgcnn_graph_sizes(dgcnn.cnf_dir, dgcnn.instance_ids, dgcnn.graph_store,
+                                                  dgcnn.pickle_ext)
+        engine = predict_instances(cnf_dir=dgcnn.cnf_dir,
+                                   instance_ids=dgcnn.instance_ids,
+                                   splits=dgcnn.splits,
+                                   classifier=dgcnn.predictor,
+                                   sample_idxes=test_idxes,
+                                   batch_size=batch_size,
+                                   graph_store=dgcnn.graph_store,
+                                   pickle_ext=dgcnn.pickle_ext,
+                                   graph_sizes=dgcnn.graph_sizes,
+                                   max_batch_edges=dgcnn.max_batch_edges,
+                                   num_size_buckets=dgcnn.num_size_buckets)
+        engine.save(predictions_filename)
+        with open(os.path.join(dgcnn.model_output_dir, dgcnn.model, "test_ypred_instances.txt"), "w") as f:
+            f.write("".join(dgcnn.instance_ids[idx] + "\n" for idx in test_idxes))
+        print(engine.latency_summary())
+        test_loss = np.array([engine.metrics.mse, engine.metrics.mae, 0.0])
+    else:
+        test_loss = loop_dataset(cnf_dir=dgcnn.cnf_dir,
+                                 model_output_dir=dgcnn.model_output_dir,
+                                 model=dgcnn.model,
+                                 instance_ids=dgcnn.instance_ids,
+                                 splits=dgcnn.splits,
+                                 epoch=0,
+                                 classifier=dgcnn.predictor,
+                                 sample_idxes=test_idxes,
+                                 random_shuffle=False,
+                                 optimizer=None,
+                                 batch_size=batch_size,
+                                 dataset_type="Test",
+                                 graph_store=dgcnn.graph_store,
+                                 pickle_ext=dgcnn.pickle_ext,
+                                 memory_manager=dgcnn.memory_manager)
     if not print_auc:
         test_loss[2] = 0.0
     if dgcnn.regression:
@@ -199,13 +241,16 @@ def test(dgcnn: DGCNNPredictor, batch_size: int, extract_features=False, print_a
     else:
         print('\033[92m  Average test of epoch %d: loss %.5f acc %.5f auc %.5f\033[0m' % (
               0, test_loss[0], test_loss[1], test_loss[2]))
+    print_memory_statistics(dgcnn.memory_manager)
 
     if extract_features:
         test_graphs = load_next_batch(cnf_dir=dgcnn.cnf_dir,
                                       instance_ids=dgcnn.instance_ids,
                                       selected_idx=list(range(dgcnn.splits["Test"])),
                                       splits=dgcnn.splits,
-                                      dataset_type="Test")
+                                      dataset_type="Test",
+                                      graph_store=dgcnn.graph_store,
+                                      pickle_ext=dgcnn.pickle_ext)
         features, labels = dgcnn.predictor.output_features(test_graphs)
         labels = labels.type('torch.FloatTensor')
         np.savetxt(os.path.join(dgcnn.model_output_dir, dgcnn.model, 'extracted_features_test.txt'),
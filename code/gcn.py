@@ -8,12 +8,11 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from dgl.nn.pytorch import GraphConv, SumPooling, MaxPooling, AvgPooling
-from sklearn import metrics
-from torch.utils.data import DataLoader
 from matplotlib import pyplot as plt
-from tqdm import tqdm
 
-from .common.nn import collate, train_one_epoch, validate_one_epoch, time_for_early_stopping
+from .common.nn import create_data_loader, create_inference_loader, train_one_epoch, validate_one_epoch, \
+    time_for_early_stopping, print_graph_cache_statistics, predict_dataset
+from .common.memory import print_memory_statistics
 from .common.process_results import calculate_r2_and_rmse_metrics_nn, plot_r2_and_rmse_scores_nn
 
 
@@ -83,22 +82,28 @@ class GCN(nn.Module):
 
 
 # Train the model
-def train(model_output_dir, model, trainset, valset, trainvalset, train_device, test_device):
+def train(model_output_dir, model, trainset, valset, trainvalset, train_device, test_device, num_workers=0,
+          pin_memory=False, prefetch_factor=2, max_batch_edges=0, num_size_buckets=10, memory_manager=None,
+          val_batch_size=0, validate_on_train_device=False):
     # Load train data
     batch_size = 40
-    data_loader_train = DataLoader(trainset, batch_size=batch_size, shuffle=True, collate_fn=collate(train_device))
-    train_num_of_batches = int(np.ceil(trainset.__len__() / batch_size))
+    data_loader_train = create_data_loader(trainset, batch_size, True, num_workers, pin_memory, prefetch_factor,
+                                           max_batch_edges, num_size_buckets)
+    train_num_of_batches = len(data_loader_train)
 
     # Load val data
-    val_batch_size = 1
-    data_loader_val = DataLoader(valset, batch_size=val_batch_size, shuffle=False, collate_fn=collate(train_device))
-    val_num_of_batches = int(np.ceil(valset.__len__() / val_batch_size))
+    # Without autograd graphs, validation batches can be as large as the training ones, under the same edge budget
+    val_batch_size = val_batch_size if val_batch_size > 0 else batch_size
+    val_batches, data_loader_val = create_inference_loader(valset, val_batch_size, max_batch_edges, num_size_buckets,
+                                                           num_workers, pin_memory, prefetch_factor,
+                                                           persistent_workers=True)
+    val_device = train_device if validate_on_train_device else test_device
 
     # Load train+val data
     retrain_batch_size = batch_size
-    data_loader_trainval = DataLoader(trainvalset, batch_size=retrain_batch_size, shuffle=True,
-                                      collate_fn=collate(train_device))
-    retrain_num_of_batches = int(np.ceil(trainvalset.__len__() / retrain_batch_size))
+    data_loader_trainval = create_data_loader(trainvalset, retrain_batch_size, True, num_workers, pin_memory,
+                                              prefetch_factor, max_batch_edges, num_size_buckets)
+    retrain_num_of_batches = len(data_loader_trainval)
 
     print("\n")
 
@@ -249,7 +254,8 @@ def train(model_output_dir, model, trainset, valset, trainvalset, train_device,
 
             # Train on training data
             time_start = timer()
-            train_loss = train_one_epoch(data_loader_train, train_num_of_batches, loss_func, predictor, optimizer, train_device)
+            train_loss = train_one_epoch(data_loader_train, train_num_of_batches, loss_func, predictor, optimizer, train_device,
+                                         memory_manager)
             time_elapsed = timer() - time_start
             train_times.append(time_elapsed)
             train_losses.append(train_loss)
@@ -260,8 +266,8 @@ def train(model_output_dir, model, trainset, valset, trainvalset, train_device,
 
             # Validate on validating data
             time_start = timer()
-            val_loss, r2_score_val_avg, rmse_score_val_avg = validate_one_epoch(model_root, current_epoch, predictor, loss_func, data_loader_val,
-                                                                                val_num_of_batches, train_device, test_device)
+            val_loss, r2_score_val_avg, rmse_score_val_avg = validate_one_epoch(model_root, current_epoch, predictor, loss_func, val_batches,
+                                                                                data_loader_val, train_device, val_device)
             time_elapsed = timer() - time_start
             val_times.append(time_elapsed)
             val_losses.append(val_loss)
@@ -281,7 +287,10 @@ def train(model_output_dir, model, trainset, valset, trainvalset, train_device,
             print(f'\tTrain loss: {train_loss}; training time: {train_times[-1]:.2f}s')
             print(f'\tValidation loss: {val_loss}; validation time: {val_times[-1]:.2f}s')
             print(f'\tValidation R^2 score: {r2_score_val_avg}')
-            print(f'\tValidation RMSE score: {rmse_score_val_avg}\n')
+            print(f'\tValidation RMSE score: {rmse_score_val_avg}')
+            print_graph_cache_statistics(trainset)
+            print_memory_statistics(memory_manager)
+            print()
             
             # Serialize model for later usage
             torch.save([predictor, train_losses, val_losses, r2_scores, rmse_scores, train_times, val_times, []], model_path)
@@ -337,10 +346,13 @@ def train(model_output_dir, model, trainset, valset, trainvalset, train_device,
                 f"{t.tm_year}.")
     
             time_start = timer()
-            train_one_epoch(data_loader_trainval, retrain_num_of_batches, loss_func, predictor, optimizer, train_device)
+            train_one_epoch(data_loader_trainval, retrain_num_of_batches, loss_func, predictor, optimizer, train_device,
+                            memory_manager)
             time_elapsed = timer() - time_start
             retrain_times.append(time_elapsed)
             print(f"\tFinished epoch {current_epoch} of {best_epoch}")
+            print_graph_cache_statistics(trainvalset)
+            print_memory_statistics(memory_manager)
     
             # Serialize model for later usage
             torch.save([predictor, train_losses, val_losses, r2_scores, rmse_scores, train_times, val_times, retrain_times],
@@ -352,10 +364,10 @@ def train(model_output_dir, model, trainset, valset, trainvalset, train_device,
 
 
 # Test the model
-def test(model_output, model, testset, predict_device, test_device):
-    test_batch_size = 1
-    data_loader_test = DataLoader(testset, batch_size=test_batch_size, shuffle=False, collate_fn=collate(predict_device))
-    test_num_of_batches = int(np.ceil(testset.__len__() / test_batch_size))
+def test(model_output, model, testset, predict_device, test_device, num_workers=0, pin_memory=False, prefetch_factor=2,
+         test_batch_size=0, max_batch_edges=0, num_size_buckets=10):
+    # Without autograd graphs, test batches can be as large as the training ones
+    test_batch_size = test_batch_size if test_batch_size > 0 else 40
 
     # Load the model
     model_output_dir = os.path.join(model_output, model)
@@ -369,35 +381,17 @@ def test(model_output, model, testset, predict_device, test_device):
     print(f"Started testing at: {t.tm_hour}:{t.tm_min}:{t.tm_sec} {t.tm_mday}.{t.tm_mon}.{t.tm_year}.")
     print(80 * "=")
 
-    predictor.eval()
-    y_pred = np.empty((0, 31))
-    y_true = np.empty((0, 31))
-
     # Predict
     print("\nPredicting...\n")
-    
+
     pred_data_name = os.path.join(model_output, model, "Test_ypred.txt")
     true_data_name = os.path.join(model_output, model, "Test_ytrue.txt")
-    if os.path.exists(pred_data_name) and os.path.exists(true_data_name):
-        y_pred = np.loadtxt(pred_data_name)
-        y_true = np.loadtxt(true_data_name)
-    else:
-        with torch.no_grad():
-            pbar = tqdm(total=test_num_of_batches, unit='batch')
-            
-            for i, (graph, true_y) in enumerate(data_loader_test):
-                pred_y = predictor(graph.to(predict_device))
-                pred_y = np.array(pred_y.to(test_device))
-                y_pred = np.vstack((y_pred, pred_y))
-                y_true = np.vstack((y_true, true_y.to(test_device)))
-                
-                pbar.update(n=1)
-                pbar.set_description(f'Testing loss: {metrics.mean_squared_error(y_true, y_pred)}')
-
-            pbar.close()
-            # Save the predicted data
-            np.savetxt(pred_data_name, y_pred, "%.6f")
-            np.savetxt(true_data_name, y_true, "%.6f")
+    if not (os.path.exists(pred_data_name) and os.path.exists(true_data_name)):
+        engine = predict_dataset(predictor, testset, predict_device, test_batch_size, max_batch_edges, num_size_buckets,
+                                 num_workers, pin_memory, prefetch_factor)
+        # Save the predicted data
+        engine.save(pred_data_name, true_data_name)
+        print(engine.latency_summary())
 
     # Evaluate
     print("\nEvaluating...")
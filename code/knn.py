@@ -2,88 +2,120 @@ import os
 import pickle
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import KNeighborsRegressor
 from sklearn import metrics
-from sklearn import multioutput
 
-from .preprocessing.algorithms.math import lorentzian_distance, angular_distance
-
-
-def search_for_the_best_model(x_train, y_train, x_val, y_val, n_neighbors, weights, distances, model_dir):
+from .common.search_results import SearchResults
+from .preprocessing.algorithms.math import lorentzian_distance, angular_distance, pairwise_distances, \
+    pairwise_distance_functions
+
+
+def neighbor_average(neighbor_outputs, neighbor_distances, weights: str):
+    """
+        Predictions of KNeighborsRegressor from the outputs (instances, neighbours, outputs) of the nearest
+        neighbours and their distances (instances, neighbours). With distance weights, an instance with neighbours
+        at distance 0 is predicted from those neighbours only, like in sklearn.
+    """
+    if weights == "uniform":
+        return np.mean(neighbor_outputs, axis=1)
+    if weights != "distance":
+        raise ValueError(f"Unknown weights: {weights}")
+
+    with np.errstate(divide="ignore"):
+        inverse_distances = 1.0 / neighbor_distances
+    exact_matches = np.isinf(inverse_distances)
+    exact_rows = np.any(exact_matches, axis=1)
+    inverse_distances[exact_rows] = exact_matches[exact_rows]
+    return np.einsum("ij,ijk->ik", inverse_distances, neighbor_outputs) / \
+        np.sum(inverse_distances, axis=1)[:, np.newaxis]
+
+
+class MultiOutputKNeighborsRegressor(object):
+    """
+        KNN regressor of all outputs at once: one neighbour query per instance answers every solver, instead of a
+        KNeighborsRegressor per output. metric is a name of pairwise_distance_functions, a vectorized kernel
+        (x, y) -> distance matrix, or "precomputed", when predict takes the (instances, training instances) distances
+        instead of the features. predict works on batches of batch_size instances.
+    """
+    def __init__(self, n_neighbors=5, weights="uniform", metric="euclidean", batch_size=1024):
+        if metric != "precomputed" and not callable(metric) and metric not in pairwise_distance_functions:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.metric = metric
+        self.batch_size = batch_size
+
+    def fit(self, x, y):
+        self.x_train = None if self.metric == "precomputed" else np.asarray(x, dtype=np.float64)
+        self.y_train = np.asarray(y, dtype=np.float64)
+        return self
+
+    def kneighbors(self, x):
+        """
+            Distances and indices (instances, n_neighbors) of the nearest training instances, nearest first
+        """
+        if self.metric == "precomputed":
+            distances = np.asarray(x, dtype=np.float64)
+        else:
+            distances = pairwise_distances(x, self.x_train, self.metric)
+        # Ties are broken by the training order, like in search_for_the_best_model
+        neighbors = np.argsort(distances, axis=1, kind="stable")[:, :self.n_neighbors]
+        return np.take_along_axis(distances, neighbors, axis=1), neighbors
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        y_pred = np.empty((x.shape[0], self.y_train.shape[1]))
+        for start in range(0, x.shape[0], self.batch_size):
+            neighbor_distances, neighbors = self.kneighbors(x[start:start + self.batch_size])
+            y_pred[start:start + self.batch_size] = neighbor_average(self.y_train[neighbors], neighbor_distances,
+                                                                     self.weights)
+        return y_pred
+
+
+def search_for_the_best_model(x_train, y_train, x_val, y_val, n_neighbors, weights, distances, solver_names,
+                              model_dir):
     print("Searching for the best model")
-    number_of_solvers = y_train.shape[1]
-
-    # Validation scores
-    shape = (len(n_neighbors), len(weights), len(distances), number_of_solvers)
-    r2_scores = np.empty(shape)
-    rmse_scores = np.empty(shape)
-
-    model_search_results = os.path.join(model_dir, f"KNN_model_search_results.csv")
-    if os.path.exists(model_search_results):
-        data = pd.read_csv(model_search_results)
-        i_mult = len(weights) * len(distances) * number_of_solvers
-        j_mult = len(distances) * number_of_solvers
-        k_mult = number_of_solvers
-
-        for i in range(len(n_neighbors)):
-            for j in range(len(weights)):
-                for k in range(len(distances)):
-                    for l in range(number_of_solvers):
-                        idx = i * i_mult + k * k_mult + j * j_mult + l
-                        r2_score = data.iloc[idx]["r2 score"]
-                        r2_scores[i, j, k, l] = r2_score
-                        rmse_score = data.iloc[idx]["rmse score"]
-                        rmse_scores[i, j, k, l] = rmse_score
-
-        return r2_scores, rmse_scores
-
-    max_count = np.product(shape)
-    count = 0
-
-    # Searching procedure
-    for i in range(len(n_neighbors)):
-        param_n_neighbors = n_neighbors[i]
-        for j in range(len(weights)):
+
+    # Validation scores of the finished cells are kept in the results file, a restarted search skips them
+    results = SearchResults(os.path.join(model_dir, f"KNN_model_search_results.csv"),
+                            ["n_neighbors", "weights", "distance"], solver_names)
+
+    x_train = np.asarray(x_train, dtype=np.float64)
+    x_val = np.asarray(x_val, dtype=np.float64)
+    y_train = np.asarray(y_train, dtype=np.float64)
+    y_val = np.asarray(y_val, dtype=np.float64)
+
+    # Searching procedure: the neighbours of every metric are sorted once, every number of neighbours, weighting
+    # and solver is a slice of them
+    for k in range(len(distances)):
+        param_distance = distances[k]
+        cells = [(i, j) for i in range(len(n_neighbors)) for j in range(len(weights))
+                 if not results.is_completed(n_neighbors[i], weights[j], param_distance["name"])]
+        if len(cells) == 0:
+            continue
+
+        print(f"\tComputing the {param_distance['name']} distances ({len(x_val)}x{len(x_train)})")
+        max_neighbors = min(int(max(n_neighbors[i] for i, _ in cells)), len(x_train))
+        val_distances = pairwise_distances(x_val, x_train, param_distance["name"])
+        neighbors = np.argsort(val_distances, axis=1, kind="stable")[:, :max_neighbors]
+        neighbor_distances = np.take_along_axis(val_distances, neighbors, axis=1)
+        del val_distances
+        # (validation instances, neighbours, solvers)
+        neighbor_outputs = y_train[neighbors]
+
+        for i, j in cells:
+            param_n_neighbors = n_neighbors[i]
             param_weights = weights[j]
-            for k in range(len(distances)):
-                param_distance = distances[k]
-                for l in range(number_of_solvers):
-                    count += 1
-                    print(f"\tTraining model {count}/{max_count}")
-                    model = KNeighborsRegressor(n_neighbors=param_n_neighbors,
-                                                weights=param_weights,
-                                                metric=param_distance["metric"],
-                                                algorithm='brute',
-                                                n_jobs=-1)
-                    model.fit(x_train, y_train.iloc[:, l:l + 1])
-                    y_true, y_pred = y_val.iloc[:, l:l + 1], model.predict(x_val)
-                    r2_score = metrics.r2_score(y_true, y_pred)
-                    r2_scores[i, j, k, l] = r2_score
-                    rmse_score = metrics.mean_squared_error(y_true, y_pred, squared=False)
-                    rmse_scores[i, j, k, l] = rmse_score
-
-    return r2_scores, rmse_scores
-
-
-def save_training_data(r2_scores, rmse_scores, n_neighbors, weights, distances, solver_names, model_dir):
-    print("Saving the training results")
-    number_of_solvers = len(solver_names)
+            y_pred = neighbor_average(neighbor_outputs[:, :param_n_neighbors],
+                                      neighbor_distances[:, :param_n_neighbors], param_weights)
+            results.append((param_n_neighbors, param_weights, param_distance["name"]),
+                           metrics.r2_score(y_val, y_pred, multioutput="raw_values"),
+                           np.sqrt(np.mean((y_val - y_pred) ** 2, axis=0)))
 
-    model_search_results = os.path.join(model_dir, f"KNN_model_search_results.csv")
-    if not os.path.exists(model_search_results):
-        with open(model_search_results, "w", encoding="utf-8") as csv:
-            csv.write("n_neighbors,weights,distance,solver name,r2 score,rmse score\n")
-            for i in range(len(n_neighbors)):
-                param_n_neighbors = n_neighbors[i]
-                for j in range(len(weights)):
-                    param_weights = weights[j]
-                    for k in range(len(distances)):
-                        param_distance = distances[k]
-                        for l in range(number_of_solvers):
-                            solver_name = solver_names[l]
-                            row = f"{param_n_neighbors},{param_weights},{param_distance['name']},{solver_name}," + \
-                                  f"{r2_scores[i, j, k, l]},{rmse_scores[i, j, k, l]}\n"
-                            csv.write(row)
+    return results.load([n_neighbors, weights, [distance["name"] for distance in distances]])
+
+
+def save_training_data(r2_scores, rmse_scores, n_neighbors, weights, distances, model_dir):
+    print("Saving the training results")
 
     model_search_group_results = os.path.join(model_dir, f"KNN_model_search_group_results.csv")
     if not os.path.exists(model_search_group_results):
@@ -124,18 +156,11 @@ def retrain_the_best_model(x_train_val, y_train_val, model_dir):
     best_params = {
         "n_neighbors": int(best_data["n_neighbors"]),
         "weights": best_data["weights"],
+        "metric": best_data["distance"],
     }
-    if best_data["distance"] == "euclidean" or best_data["distance"] == "manhattan":
-        best_params["metric"] = best_data["distance"]
-    elif best_data["distance"] == "lorentzian":
-        best_params["metric"] = lorentzian_distance
-    elif best_data["distance"] == "angular":
-        best_params["metric"] = angular_distance
-    else:
-        raise ValueError(f"Unknown metric: {best_data['distance']}")
 
     print(f"\tBest params: {best_params}")
-    best_model = multioutput.MultiOutputRegressor(KNeighborsRegressor(**best_params, algorithm='brute', n_jobs=-1))
+    best_model = MultiOutputKNeighborsRegressor(**best_params)
     best_model.fit(x_train_val, y_train_val)
 
     return best_model
@@ -149,5 +174,6 @@ def train(x_train, y_train, x_val, y_val, solver_names, model_dir):
                  {"metric": "euclidean", "name": "euclidean"},
                  {"metric": "manhattan", "name": "manhattan"}]
 
-    r2_scores, rmse_scores = search_for_the_best_model(x_train, y_train, x_val, y_val, n_neighbors, weights, distances, model_dir)
-    save_training_data(r2_scores, rmse_scores, n_neighbors, weights, distances, solver_names, model_dir)
+    r2_scores, rmse_scores = search_for_the_best_model(x_train, y_train, x_val, y_val, n_neighbors, weights, distances,
+                                                       solver_names, model_dir)
+    save_training_data(r2_scores, rmse_scores, n_neighbors, weights, distances, model_dir)
@@ -7,7 +7,9 @@ import torch.optim as optim
 
 from .dgcnn_embedding import DGCNN
 from .mlp_dropout import MLPClassifier, MLPRegression
-from .features import prepare_feature_labels
+from .features import BatchAssembler
+from .lib.sparse_matrices import sparse_matrix_builder
+from ...preprocessing.cnf.graph_cache import GraphCache
 
 
 IntOfFloat = Union[int, float]
@@ -46,21 +48,22 @@ class Predictor(nn.Module):
         return self.mlp(embed, labels)
 
     def output_features(self, batch_graph):
-        node_feat = None
-        edge_feat = None
-        labels = None
-        feature_label = prepare_feature_labels(batch_graph, self.feat_dim, self.edge_feat_dim, self.mode,
-                                               self.regression)
-
-        if len(feature_label) == 2:
-            node_feat, labels = feature_label
-            edge_feat = None
-        elif len(feature_label) == 3:
-            node_feat, edge_feat, labels = feature_label
-
-        embed = self.gnn(batch_graph, node_feat, edge_feat)
+        node_tags, node_feat, edge_feat, labels = self.assembler().prepare_feature_labels(batch_graph)
+
+        embed = self.gnn(batch_graph, node_feat, edge_feat, node_tags)
         return embed, labels
 
+    def assembler(self):
+        # Created on demand, because the buffers are not persisted with the model
+        if getattr(self, 'batch_assembler', None) is None:
+            self.batch_assembler = BatchAssembler(self.edge_feat_dim, self.mode, self.regression)
+        return self.batch_assembler
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['batch_assembler'] = None
+        return state
+
 
 class DGCNNPredictor(object):
     def __init__(self, cnf_dir: str, model_output_dir: str, model: str,
@@ -68,10 +71,19 @@ class DGCNNPredictor(object):
                  latent_dim: int, out_dim: int, hidden: int, num_class: int, dropout: bool,
                  feat_dim: int, attr_dim: int, edge_feat_dim: int,
                  sortpooling_k: IntOfFloat, conv1d_activation: str, learning_rate: float,
-                 mode: str, regression=True):
+                 mode: str, regression=True, graph_store=None, pickle_ext=".dgcnn.pickled", max_batch_edges=0,
+                 num_size_buckets=10, msg_average=False, sparse_cache_mb=0, memory_manager=None):
         # Inits
         self.predictor = None
         self.cnf_dir = cnf_dir
+        self.graph_store = graph_store
+        self.pickle_ext = pickle_ext
+        self.max_batch_edges = max_batch_edges
+        self.num_size_buckets = num_size_buckets
+        self.graph_sizes = None
+        self.memory_manager = memory_manager
+        sparse_matrix_builder.msg_average = bool(msg_average)
+        sparse_matrix_builder.cache = GraphCache(sparse_cache_mb * 1024 * 1024) if sparse_cache_mb > 0 else None
         self.model_output_dir = model_output_dir
         self.model = model
         self.model_filename = os.path.join(model_output_dir, model, "best_DGCNN_model")
@@ -1,11 +1,47 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.autograd import Variable
 
-from .lib.gnn_lib import gnnlib
+from .lib.sparse_matrices import sparse_matrix_builder
 from .lib.pytorch_util import weights_init, gnn_spmm
 
 
+def sort_pooling(node_embeddings: torch.Tensor, graph_sizes: list, k: int):
+    """
+        Keeps the k nodes of every graph with the largest values in the last channel, in descending order, and pads
+        the graphs with less than k nodes with zero rows. The graphs are laid out as segments of node_embeddings.
+        All graphs are sorted at once: the sort channel is scattered into a (num_graphs, max_nodes) matrix padded
+        with -inf, so a single topk over its rows finds the nodes of every graph.
+    """
+    k = int(k)
+    device = node_embeddings.device
+    num_graphs = len(graph_sizes)
+    num_nodes, dim = node_embeddings.shape
+    sizes = torch.as_tensor(graph_sizes, dtype=torch.long, device=device)
+    offsets = torch.cumsum(sizes, 0) - sizes
+    max_nodes = int(sizes.max()) if num_graphs > 0 else 0
+
+    # Position of every node in its graph
+    node_graph = torch.repeat_interleave(torch.arange(num_graphs, device=device), sizes)
+    node_position = torch.arange(num_nodes, device=device) - offsets[node_graph]
+
+    padded = torch.full((num_graphs, max_nodes), float('-inf'), dtype=node_embeddings.dtype, device=device)
+    padded[node_graph, node_position] = node_embeddings[:, -1].detach()
+
+    topk = min(k, max_nodes)
+    _, topk_positions = padded.topk(topk, dim=1)
+    valid = torch.arange(topk, device=device).unsqueeze(0) < sizes.unsqueeze(1)
+    topk_indices = (topk_positions + offsets.unsqueeze(1)).clamp(max=max(num_nodes - 1, 0))
+
+    # Rows past the end of the smaller graphs are zeroed, the rest are exact copies of the selected nodes
+    sortpooling_graphs = node_embeddings[topk_indices] * valid.unsqueeze(2).to(node_embeddings.dtype)
+    if topk < k:
+        sortpooling_graphs = torch.cat(
+            [sortpooling_graphs, node_embeddings.new_zeros(num_graphs, k - topk, dim)], 1)
+    return sortpooling_graphs
+
+
 class DGCNN(nn.Module):
     def __init__(self, output_dim, num_node_feats, num_edge_feats, latent_dim=None, k=30, conv1d_channels=None,
                  conv1d_kws=None, conv1d_activation='ReLU'):
@@ -48,33 +84,30 @@ class DGCNN(nn.Module):
 
         weights_init(self)
 
-    def forward(self, graph_list, node_feat, edge_feat):
+    def forward(self, graph_list, node_feat, edge_feat, node_tags=None):
         graph_sizes = [graph_list[i].num_nodes for i in range(len(graph_list))]
-        node_degs = [torch.Tensor(graph_list[i].degs) + 1 for i in range(len(graph_list))]
-        node_degs = torch.cat(node_degs).unsqueeze(1)
 
-        n2n_sp, e2n_sp, subg_sp = gnnlib.prepare_sparse_matrices(graph_list)
+        propagation_sp, node_inv_degs, e2n_sp = \
+            sparse_matrix_builder.prepare_propagation(graph_list, edge_pooling=edge_feat is not None)
 
         if torch.cuda.is_available() and isinstance(node_feat, torch.cuda.FloatTensor):
-            n2n_sp = n2n_sp.cuda()
-            e2n_sp = e2n_sp.cuda()
-            subg_sp = subg_sp.cuda()
-            node_degs = node_degs.cuda()
+            propagation_sp = propagation_sp.cuda()
+            node_inv_degs = node_inv_degs.cuda()
+            if e2n_sp is not None:
+                e2n_sp = e2n_sp.cuda()
         node_feat = Variable(node_feat)
         if edge_feat is not None:
             edge_feat = Variable(edge_feat)
             if torch.cuda.is_available() and isinstance(node_feat, torch.cuda.FloatTensor):
                 edge_feat = edge_feat.cuda()
-        n2n_sp = Variable(n2n_sp)
-        e2n_sp = Variable(e2n_sp)
-        subg_sp = Variable(subg_sp)
-        node_degs = Variable(node_degs)
 
-        h = self.sortpooling_embedding(node_feat, edge_feat, n2n_sp, e2n_sp, subg_sp, graph_sizes, node_degs)
+        h = self.sortpooling_embedding(node_feat, edge_feat, propagation_sp, e2n_sp, graph_sizes, node_inv_degs,
+                                       node_tags)
 
         return h
 
-    def sortpooling_embedding(self, node_feat, edge_feat, n2n_sp, e2n_sp, subg_sp, graph_sizes, node_degs):
+    def sortpooling_embedding(self, node_feat, edge_feat, propagation_sp, e2n_sp, graph_sizes, node_inv_degs,
+                              node_tags=None):
         # If exists edge feature, concatenate to node feature vector
         if edge_feat is not None:
             # input_edge_linear = self.w_e2l(edge_feat)
@@ -87,38 +120,26 @@ class DGCNN(nn.Module):
         cur_message_layer = node_feat
         cat_message_layers = []
         while lv < len(self.latent_dim):
-            n2npool = gnn_spmm(n2n_sp, cur_message_layer) + cur_message_layer  # Y = (A + I) * X
-            node_linear = self.conv_params[lv](n2npool)  # Y = Y * W
-            normalized_linear = node_linear.div(node_degs)  # Y = D^-1 * Y
-            cur_message_layer = torch.tanh(normalized_linear)
+            conv = self.conv_params[lv]
+            if lv == 0 and node_tags is not None:
+                # The node tags are one-hot features in the first columns of the weights, so their columns are looked
+                # up instead of multiplied. The features are projected before the propagation, which is the same
+                num_tags = conv.in_features - cur_message_layer.shape[1]
+                node_linear = F.embedding(node_tags, conv.weight[:, :num_tags].t()) + \
+                    cur_message_layer.mm(conv.weight[:, num_tags:].t())  # Y = X * W
+                node_linear = torch.addcmul(gnn_spmm(propagation_sp, node_linear), node_inv_degs,
+                                            conv.bias)  # Y = D^-1 * (A + I) * Y + D^-1 * b
+            else:
+                n2npool = gnn_spmm(propagation_sp, cur_message_layer)  # Y = D^-1 * (A + I) * X
+                node_linear = torch.addmm(node_inv_degs * conv.bias, n2npool, conv.weight.t())  # Y = Y * W + D^-1 * b
+            cur_message_layer = torch.tanh(node_linear)
             cat_message_layers.append(cur_message_layer)
             lv += 1
 
         cur_message_layer = torch.cat(cat_message_layers, 1)
 
         # Sortpooling layer
-        sort_channel = cur_message_layer[:, -1]
-        batch_sortpooling_graphs = torch.zeros(len(graph_sizes), self.k, self.total_latent_dim)
-        if torch.cuda.is_available() and isinstance(node_feat.data, torch.cuda.FloatTensor):
-            batch_sortpooling_graphs = batch_sortpooling_graphs.cuda()
-
-        batch_sortpooling_graphs = Variable(batch_sortpooling_graphs)
-        accum_count = 0
-        for i in range(subg_sp.size()[0]):
-            to_sort = sort_channel[accum_count: accum_count + graph_sizes[i]]
-            k = self.k if self.k <= graph_sizes[i] else graph_sizes[i]
-            _, topk_indices = to_sort.topk(k)
-            topk_indices += accum_count
-            sortpooling_graph = cur_message_layer.index_select(0, topk_indices)
-            if k < self.k:
-                to_pad = torch.zeros(self.k-k, self.total_latent_dim)
-                if torch.cuda.is_available() and isinstance(node_feat.data, torch.cuda.FloatTensor):
-                    to_pad = to_pad.cuda()
-
-                to_pad = Variable(to_pad)
-                sortpooling_graph = torch.cat((sortpooling_graph, to_pad), 0)
-            batch_sortpooling_graphs[i] = sortpooling_graph
-            accum_count += graph_sizes[i]
+        batch_sortpooling_graphs = sort_pooling(cur_message_layer, graph_sizes, self.k)
 
         # Traditional 1d convlution and dense layers
         to_conv1d = batch_sortpooling_graphs.view((-1, 1, self.k * self.total_latent_dim))
@@ -1,78 +1,116 @@
+from timeit import default_timer as timer
+
+import numpy as np
 import torch
 
 
-def prepare_feature_labels(batch_graph: list, feat_dim: int, edge_feat_dim: int, mode: str, regression=True):
-    if regression:
-        labels = torch.FloatTensor(len(batch_graph), len(batch_graph[0].labels))
-    else:
-        labels = torch.LongTensor(len(batch_graph), len(batch_graph[0].labels))
-    n_nodes = 0
-
-    concat_feat = None
-    concat_tag = None
-    concat_edge_feat = None
-    node_tag = None
-    node_feat = None
-    edge_feat = None
-
-    if batch_graph[0].node_tags is not None:
-        node_tag_flag = True
-        concat_tag = []
-    else:
-        node_tag_flag = False
-
-    if batch_graph[0].node_features is not None:
-        node_feat_flag = True
-        concat_feat = []
-    else:
-        node_feat_flag = False
-
-    if edge_feat_dim > 0:
-        edge_feat_flag = True
-        concat_edge_feat = []
-    else:
-        edge_feat_flag = False
-
-    for i in range(len(batch_graph)):
-        labels[i] = torch.FloatTensor(batch_graph[i].labels)
-        n_nodes += batch_graph[i].num_nodes
-        if node_tag_flag:
-            concat_tag += batch_graph[i].node_tags
-        if node_feat_flag:
-            tmp = torch.from_numpy(batch_graph[i].node_features).type('torch.FloatTensor')
-            concat_feat.append(tmp)
-        if edge_feat_flag:
-            if batch_graph[i].edge_features is not None:  # in case no edge in graph[i]
-                tmp = torch.from_numpy(batch_graph[i].edge_features).type('torch.FloatTensor')
-                concat_edge_feat.append(tmp)
-
-    if node_tag_flag:
-        concat_tag = torch.LongTensor(concat_tag).view(-1, 1)
-        node_tag = torch.zeros(n_nodes, feat_dim)
-        node_tag.scatter_(1, concat_tag, 1)
-
-    if node_feat_flag:
-        node_feat = torch.cat(concat_feat, 0)
-
-    if node_feat_flag and node_tag_flag:
-        # concatenate one-hot embedding of node tags (node labels) with continuous node features
-        node_feat = torch.cat([node_tag.type_as(node_feat), node_feat], 1)
-    elif not node_feat_flag and node_tag_flag:
-        node_feat = node_tag
-    elif node_feat_flag and not node_tag_flag:
-        pass
-    else:
-        node_feat = torch.ones(n_nodes, 1)  # use all-one vector as node features
-
-    if edge_feat_flag:
-        edge_feat = torch.cat(concat_edge_feat, 0)
-
-    if mode == 'gpu':
-        node_feat = node_feat.cuda()
-        labels = labels.cuda()
-        if edge_feat_flag:
-            edge_feat = edge_feat.cuda()
-
-    if edge_feat_flag:
-        return node_feat, edge_feat, labels
-    return node_feat, labels
+class BatchAssembler(object):
+    """
+        Assembles the inputs of a DGCNN batch into buffers that are kept between batches and grow only when a batch
+        does not fit, so a steady state epoch allocates no host memory. The node features and labels of every graph
+        are copied straight from its numpy arrays into the float32 buffers, without intermediate tensors. Node tags
+        are returned as indices instead of a dense one-hot matrix, the first DGCNN layer looks up their weights.
+
+        The returned tensors are views of the buffers, valid until the next call. With the gpu mode, the buffers are
+        pinned and copied asynchronously, and the next call waits for the copies before overwriting them.
+    """
+    def __init__(self, edge_feat_dim: int, mode: str, regression=True, growth=1.5):
+        self.edge_feat_dim = edge_feat_dim
+        self.mode = mode
+        self.regression = regression
+        self.growth = growth
+        self.pin_memory = mode == 'gpu' and torch.cuda.is_available()
+        self.buffers = {}
+        self.copies_done = None
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        self.batches = 0
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.assembly_time = 0.0
+
+    def statistics(self) -> dict:
+        return {
+            "batches": self.batches,
+            "allocations": self.allocations,
+            "allocated_bytes": self.allocated_bytes,
+            "assembly_time": self.assembly_time,
+            "buffer_bytes": sum(buffer.element_size() * buffer.nelement() for buffer in self.buffers.values()),
+        }
+
+    def __str__(self):
+        stats = self.statistics()
+        return (f"Batch assembly: {stats['batches']} batches in {stats['assembly_time']:.2f}s, " +
+                f"{stats['allocations']} buffer allocations, {stats['buffer_bytes'] / (1024 * 1024):.1f}MB of buffers")
+
+    def buffer(self, name: str, rows: int, cols: int, dtype) -> np.ndarray:
+        """
+            Returns the first rows of the buffer as a numpy view, reallocating the buffer if it is too small.
+        """
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape[0] < rows or buffer.shape[1] != cols or buffer.dtype != dtype:
+            capacity = rows if buffer is None else max(rows, int(self.growth * buffer.shape[0]))
+            buffer = torch.empty((capacity, cols), dtype=dtype, pin_memory=self.pin_memory)
+            self.buffers[name] = buffer
+            self.allocations += 1
+            self.allocated_bytes += buffer.element_size() * buffer.nelement()
+        return buffer[:rows].numpy()
+
+    def prepare_feature_labels(self, batch_graph: list):
+        """
+            Returns the node tags (num_nodes,) or None, the continuous node features (num_nodes, dim), the edge
+            features or None and the labels of a batch.
+        """
+        time_start = timer()
+        if self.copies_done is not None:
+            self.copies_done.synchronize()
+
+        num_nodes = [graph.num_nodes for graph in batch_graph]
+        node_offsets = np.concatenate([[0], np.cumsum(num_nodes)])
+        n_nodes = int(node_offsets[-1])
+
+        labels = self.buffer("labels", len(batch_graph), len(batch_graph[0].labels),
+                             torch.float32 if self.regression else torch.int64)
+        labels[:] = [graph.labels for graph in batch_graph]
+
+        node_tags = None
+        if batch_graph[0].node_tags is not None:
+            node_tags = self.buffer("node_tags", n_nodes, 1, torch.int64)
+            for i, graph in enumerate(batch_graph):
+                node_tags[node_offsets[i]:node_offsets[i + 1], 0] = graph.node_tags
+
+        if batch_graph[0].node_features is not None:
+            node_feat = self.buffer("node_features", n_nodes, batch_graph[0].node_features.shape[1], torch.float32)
+            for i, graph in enumerate(batch_graph):
+                node_feat[node_offsets[i]:node_offsets[i + 1]] = graph.node_features
+        elif node_tags is not None:
+            node_feat = self.buffer("node_features", n_nodes, 0, torch.float32)
+        else:
+            # All-one vector as node features
+            node_feat = self.buffer("node_features", n_nodes, 1, torch.float32)
+            node_feat[:] = 1
+
+        edge_feat = None
+        if self.edge_feat_dim > 0:
+            # Graphs without edges have no edge features
+            edge_features = [graph.edge_features for graph in batch_graph if graph.edge_features is not None]
+            edge_offsets = np.concatenate([[0], np.cumsum([len(features) for features in edge_features])])
+            edge_feat = self.buffer("edge_features", int(edge_offsets[-1]), self.edge_feat_dim, torch.float32)
+            for i, features in enumerate(edge_features):
+                edge_feat[edge_offsets[i]:edge_offsets[i + 1]] = features
+
+        tensors = [torch.from_numpy(array) if array is not None else None
+                   for array in [node_tags, node_feat, edge_feat, labels]]
+        if tensors[0] is not None:
+            tensors[0] = tensors[0].view(-1)
+
+        if self.mode == 'gpu':
+            tensors = [tensor.cuda(non_blocking=True) if tensor is not None else None for tensor in tensors]
+            if self.pin_memory:
+                self.copies_done = torch.cuda.Event()
+                self.copies_done.record()
+
+        self.batches += 1
+        self.assembly_time += timer() - time_start
+        return tuple(tensors)
@@ -0,0 +1,190 @@
+import numpy as np
+import torch
+from scipy import sparse
+
+
+def directed_edges(edge_pairs) -> tuple:
+    """
+        Sources and destinations of the directed edges of an undirected edge list: edge j of edge_pairs is the
+        directed edges 2j (x -> y) and 2j + 1 (y -> x).
+    """
+    pairs = np.asarray(edge_pairs).astype(np.int64).reshape((-1, 2))
+    src = np.stack([pairs[:, 0], pairs[:, 1]], axis=1).reshape(-1)
+    dst = np.stack([pairs[:, 1], pairs[:, 0]], axis=1).reshape(-1)
+    return src, dst
+
+
+def propagation_matrix(edge_pairs, num_nodes: int, msg_average=False) -> tuple:
+    """
+        CSR arrays (indptr, indices, values) of the propagation operator D^-1 (A + I) of one DGCNN graph convolution
+        and the inverse degrees D^-1 as a (num_nodes, 1) column. D counts the node itself, as the degree + 1 of
+        DGCNN. With msg_average, the entries of A are averaged over the incoming edges.
+    """
+    src, dst = directed_edges(edge_pairs)
+    in_degrees = np.bincount(dst, minlength=num_nodes)
+    inverse_degrees = 1.0 / (in_degrees + 1.0)
+
+    values = 1.0 / in_degrees[dst] if msg_average else np.ones(len(dst))
+    self_loops = np.arange(num_nodes)
+    rows = np.concatenate([dst, self_loops])
+    cols = np.concatenate([src, self_loops])
+    values = np.concatenate([values, np.ones(num_nodes)]) * inverse_degrees[rows]
+    # The conversion sums up duplicated edges, like the sparse matrix product with n2n
+    matrix = sparse.coo_matrix((values, (rows, cols)), shape=(num_nodes, num_nodes)).tocsr()
+    matrix.sort_indices()
+    return (matrix.indptr.astype(np.int64), matrix.indices.astype(np.int64), matrix.data.astype(np.float32),
+            inverse_degrees.astype(np.float32).reshape((-1, 1)))
+
+
+def edge_pooling_matrix(edge_pairs, num_nodes: int, msg_average=False) -> tuple:
+    """
+        CSR arrays (indptr, indices, values) of e2n, which sums up the features of the incoming edges of every node.
+    """
+    src, dst = directed_edges(edge_pairs)
+    edge_order = np.argsort(dst, kind='stable')
+    in_degrees = np.bincount(dst, minlength=num_nodes)
+    indptr = np.concatenate([[0], np.cumsum(in_degrees)]).astype(np.int64)
+    values = 1.0 / in_degrees[dst[edge_order]] if msg_average else np.ones(len(dst))
+    return indptr, edge_order.astype(np.int64), values.astype(np.float32)
+
+
+def block_diagonal_csr(matrices: list, num_rows: list, num_cols: list) -> torch.Tensor:
+    """
+        Puts CSR matrices given as (indptr, indices, values) tensors on the diagonal of a single CSR matrix. Only
+        the indices are shifted, by the number of columns before a matrix, and the row pointers, by the number of
+        entries before it.
+    """
+    num_rows = torch.as_tensor(num_rows, dtype=torch.long)
+    num_cols = torch.as_tensor(num_cols, dtype=torch.long)
+    num_entries = torch.tensor([len(indices) for _, indices, _ in matrices], dtype=torch.long)
+    row_offsets = torch.cumsum(num_entries, 0) - num_entries
+    col_offsets = torch.cumsum(num_cols, 0) - num_cols
+
+    indptr = torch.cat([indptr[:-1] for indptr, _, _ in matrices] + [num_entries.sum().reshape(1)])
+    indptr[:-1] += torch.repeat_interleave(row_offsets, num_rows)
+    indices = torch.cat([indices for _, indices, _ in matrices])
+    indices += torch.repeat_interleave(col_offsets, num_entries)
+    values = torch.cat([values for _, _, values in matrices])
+    return torch.sparse_csr_tensor(indptr, indices, values, torch.Size([int(num_rows.sum()), int(num_cols.sum())]))
+
+
+class SparseMatrixBuilder(object):
+    """
+        PyTorch replacement of GNNLIB.prepare_sparse_matrices with the same matrices, entry for entry:
+            n2n (nodes x nodes) with an entry (y, x) for every directed edge x -> y,
+            e2n (nodes x directed edges) with an entry (y, e) for every directed edge e = x -> y,
+            subg (graphs x nodes) with an entry (g, n) for every node n of graph g.
+        Every undirected edge j of edge_pairs is the directed edges 2j (x -> y) and 2j + 1 (y -> x) and the entries
+        are ordered by row and by edge index within a row. The values are 1, or 1 / row size with msg_average.
+
+        The entries of a graph depend only on the graph, so they are computed once per graph with local indices and
+        kept in the cache, keyed by the instance id of the graph. A batch then only shifts the local indices by the
+        node and edge offsets of the graphs and concatenates them.
+
+        prepare_propagation builds the fused operators of the DGCNN convolutions in the same way, as block-diagonal
+        CSR matrices. Graphs pickled with a propagation attribute bring their operator with them.
+    """
+    def __init__(self, msg_average=False, cache=None):
+        self.msg_average = bool(msg_average)
+        self.cache = cache
+
+    def cached(self, kind: str, graph, create):
+        instance_id = getattr(graph, 'instance_id', None)
+        if self.cache is None or instance_id is None:
+            return create(graph)
+        key = (kind, instance_id)
+        entries = self.cache.get(key)
+        if entries is None:
+            entries = create(graph)
+            nbytes = sum(entry.element_size() * entry.nelement() for entry in entries if entry is not None)
+            self.cache.put(key, entries, nbytes)
+        return entries
+
+    def graph_entries(self, graph):
+        return self.cached("n2n", graph, self.create_graph_entries)
+
+    def create_graph_entries(self, graph):
+        src, dst = directed_edges(graph.edge_pairs)
+        # A stable sort keeps the incoming edges of a node in edge order, like the adjacency lists of libgnn
+        edge_order = np.argsort(dst, kind='stable')
+        rows = dst[edge_order]
+
+        values = None
+        if self.msg_average:
+            in_degrees = np.bincount(dst, minlength=graph.num_nodes)
+            values = torch.from_numpy((1.0 / in_degrees[rows]).astype(np.float32))
+
+        n2n_indices = torch.from_numpy(np.stack([rows, src[edge_order]]))
+        e2n_indices = torch.from_numpy(np.stack([rows, edge_order]))
+        return n2n_indices, e2n_indices, values
+
+    def graph_propagation(self, graph):
+        return self.cached("propagation", graph, self.create_graph_propagation)
+
+    def create_graph_propagation(self, graph):
+        # The operator pickled with the graph sums up the messages
+        if getattr(graph, 'propagation', None) is not None and not self.msg_average:
+            return tuple(torch.from_numpy(array) for array in graph.propagation)
+        return tuple(torch.from_numpy(array)
+                     for array in propagation_matrix(graph.edge_pairs, graph.num_nodes, self.msg_average))
+
+    def graph_edge_pooling(self, graph):
+        return self.cached("edge_pooling", graph, self.create_graph_edge_pooling)
+
+    def create_graph_edge_pooling(self, graph):
+        return tuple(torch.from_numpy(array)
+                     for array in edge_pooling_matrix(graph.edge_pairs, graph.num_nodes, self.msg_average))
+
+    def prepare_propagation(self, graph_list, edge_pooling=False):
+        """
+            Returns the block-diagonal propagation operator D^-1 (A + I) of the batch, the (num_nodes, 1) inverse
+            degrees and, with edge_pooling, the block-diagonal e2n matrix, otherwise None.
+        """
+        num_nodes = [graph.num_nodes for graph in graph_list]
+        operators = [self.graph_propagation(graph) for graph in graph_list]
+        propagation_sp = block_diagonal_csr([operator[:3] for operator in operators], num_nodes, num_nodes)
+        inverse_degrees = torch.cat([operator[3] for operator in operators])
+
+        e2n_sp = None
+        if edge_pooling:
+            num_directed_edges = [2 * graph.num_edges for graph in graph_list]
+            e2n_sp = block_diagonal_csr([self.graph_edge_pooling(graph) for graph in graph_list], num_nodes,
+                                        num_directed_edges)
+        return propagation_sp, inverse_degrees, e2n_sp
+
+    def prepare_sparse_matrices(self, graph_list, is_directed=0):
+        assert not is_directed
+        entries = [self.graph_entries(graph) for graph in graph_list]
+        num_nodes = torch.tensor([graph.num_nodes for graph in graph_list], dtype=torch.long)
+        num_entries = torch.tensor([n2n_indices.shape[1] for n2n_indices, _, _ in entries], dtype=torch.long)
+        node_offsets = torch.cumsum(num_nodes, 0) - num_nodes
+        edge_offsets = torch.cumsum(num_entries, 0) - num_entries
+        total_num_nodes = int(num_nodes.sum())
+        total_num_entries = int(num_entries.sum())
+
+        # Rows and columns of n2n are shifted by the node offset of the graph, the columns of e2n by its edge offset
+        entry_node_offsets = torch.repeat_interleave(node_offsets, num_entries)
+        n2n_indices = torch.cat([entry[0] for entry in entries], 1)
+        n2n_indices += entry_node_offsets
+        e2n_indices = torch.cat([entry[1] for entry in entries], 1)
+        e2n_indices[0] += entry_node_offsets
+        e2n_indices[1] += torch.repeat_interleave(edge_offsets, num_entries)
+        if self.msg_average:
+            values = torch.cat([entry[2] for entry in entries])
+        else:
+            values = torch.ones(total_num_entries)
+
+        subg_rows = torch.repeat_interleave(torch.arange(len(graph_list)), num_nodes)
+        if self.msg_average:
+            subg_values = (1.0 / num_nodes.double()).float()[subg_rows]
+        else:
+            subg_values = torch.ones(total_num_nodes)
+
+        n2n_sp = torch.sparse_coo_tensor(n2n_indices, values, torch.Size([total_num_nodes, total_num_nodes]))
+        e2n_sp = torch.sparse_coo_tensor(e2n_indices, values.clone(), torch.Size([total_num_nodes, total_num_entries]))
+        subg_sp = torch.sparse_coo_tensor(torch.stack([subg_rows, torch.arange(total_num_nodes)]), subg_values,
+                                          torch.Size([len(graph_list), total_num_nodes]))
+        return n2n_sp, e2n_sp, subg_sp
+
+
+sparse_matrix_builder = SparseMatrixBuilder()
@@ -11,16 +11,46 @@ from sklearn.preprocessing import MinMaxScaler
 from tqdm import tqdm
 
 from .classes import Predictor
-
-
-def load_next_batch(cnf_dir: str, instance_ids: list, selected_idx: list, splits: dict, dataset_type: str):
+from ...common.sampler import SizeBucketedBatchSampler
+from ...common.inference import InferenceEngine, inference_batches
+
+# Extension of the file with the number of edges of a pickled graph
+NUM_EDGES_EXT = ".num_edges"
+
+
+class StoredGNNGraph(object):
+    def __init__(self, graph_store, row: int):
+        """
+            Zero-copy view of a graph in a graph store with the attributes of GNNGraph
+        """
+        self.instance_id = graph_store.instance_ids[row]
+        self.num_nodes = graph_store.num_nodes(row)
+        self.node_tags = graph_store.node_tags(row) if graph_store.has_section("node_tags") else None
+        self.labels = graph_store.labels(row)
+        self.node_features = graph_store.node_features(row)
+        self.degs = graph_store.node_degrees(row)
+        self.num_edges = graph_store.num_edges(row)
+        self.edge_pairs = graph_store.edges(row).reshape(-1) if self.num_edges > 0 else np.array([])
+        self.edge_features = None
+
+
+def load_next_batch(cnf_dir: str, instance_ids: list, selected_idx: list, splits: dict, dataset_type: str,
+                    graph_store=None, pickle_ext=".dgcnn.pickled"):
     batch_graph = []
     labels = []
+    if graph_store is not None:
+        for idx in selected_idx:
+            batch_graph.append(StoredGNNGraph(graph_store, graph_store.index[instance_ids[idx]]))
+            labels.append(batch_graph[-1].labels)
+        return batch_graph, labels
+
     for idx in selected_idx:
         instance_id = instance_ids[idx]
-        pickle_file = os.path.join(cnf_dir, instance_id + ".dgcnn.pickled")
+        pickle_file = os.path.join(cnf_dir, instance_id + pickle_ext)
         with open(pickle_file, "rb") as f:
             batch_graph.append(pkl.load(f))
+            # The sparse matrices of the graph are cached under its instance id
+            batch_graph[-1].instance_id = instance_id
             labels.append(batch_graph[-1].labels)
             # label = ys[ys["instance_id"] == instance_id].drop(columns="instance_id").values[0].reshape(1, -1)
             # labels.append(label)
@@ -29,46 +59,103 @@ def load_next_batch(cnf_dir: str, instance_ids: list, selected_idx: list, splits
     return batch_graph, labels
 
 
+def pickled_num_edges(pickle_file: str) -> int:
+    """
+        Number of edges of a pickled graph, from the file written next to it. Graphs pickled without that file are
+        loaded once to write it.
+    """
+    num_edges_file = pickle_file + NUM_EDGES_EXT
+    if os.path.exists(num_edges_file):
+        with open(num_edges_file, "r") as f:
+            return int(f.read())
+
+    with open(pickle_file, "rb") as f:
+        num_edges = pkl.load(f).num_edges
+    with open(num_edges_file, "w") as f:
+        f.write(str(num_edges))
+    return num_edges
+
+
+def dgcnn_graph_sizes(cnf_dir: str, instance_ids: list, graph_store=None, pickle_ext=".dgcnn.pickled"):
+    """
+        Number of edges of every graph, from the graph store or from the pickled graphs
+    """
+    if graph_store is not None:
+        rows = [graph_store.index[instance_id] for instance_id in instance_ids]
+        return np.diff(graph_store.edge_offsets)[rows]
+    return np.array([pickled_num_edges(os.path.join(cnf_dir, instance_id + pickle_ext)) for instance_id in instance_ids],
+                    dtype=np.int64)
+
+
+def predict_instances(cnf_dir: str, instance_ids: list, splits: dict, classifier: Predictor, sample_idxes: list,
+                      batch_size=1, graph_store=None, pickle_ext=".dgcnn.pickled", graph_sizes=None, max_batch_edges=0,
+                      num_size_buckets=10, dataset_type="Test"):
+    """
+        Regression outputs of the instances at sample_idxes with the inference engine, in the order of sample_idxes
+    """
+    sample_idxes = np.asarray(sample_idxes, dtype=np.int64)
+    # graph_sizes is indexed like instance_ids
+    sizes = np.asarray(graph_sizes)[sample_idxes] if max_batch_edges > 0 else None
+    batches = inference_batches(len(sample_idxes), batch_size, sizes, max_batch_edges, num_size_buckets)
+
+    def batch_inputs():
+        for selected_idx in batches:
+            batch_graph, targets = load_next_batch(cnf_dir, instance_ids, sample_idxes[selected_idx].tolist(), splits,
+                                                   dataset_type, graph_store, pickle_ext)
+            yield selected_idx, batch_graph, np.stack(targets)
+
+    classifier.eval()
+    engine = InferenceEngine(lambda batch_graph: classifier.mlp(classifier.output_features(batch_graph)[0]),
+                             len(sample_idxes), classifier.mlp.h2_weights.out_features, dataset_type)
+    return engine.run(batch_inputs(), len(batches))
+
+
 def loop_dataset(cnf_dir: str, model_output_dir: str, model: str, instance_ids: list, splits: dict, epoch: int,
                  classifier: Predictor, sample_idxes: list, random_shuffle=False, optimizer=None, batch_size=1, dataset_type="Train",
-                 print_auc=False):
+                 print_auc=False, graph_store=None, pickle_ext=".dgcnn.pickled", graph_sizes=None, max_batch_edges=0,
+                 num_size_buckets=10, memory_manager=None):
+    if max_batch_edges > 0:
+        # graph_sizes is indexed like instance_ids
+        sizes = np.asarray(graph_sizes)[np.asarray(sample_idxes, dtype=np.int64)]
+
     instance_ids_tmp = []
     for idx in sample_idxes:
         instance_ids_tmp.append(instance_ids[idx])
     instance_ids = instance_ids_tmp
     sample_idxes = list(range(len(instance_ids)))
-    
+
+    if max_batch_edges > 0:
+        # Batches of graphs of similar size under the edge budget
+        batches = list(SizeBucketedBatchSampler(sizes, max_batch_edges, batch_size, num_size_buckets,
+                                                shuffle=random_shuffle, seed=random.getrandbits(32)))
+        sample_idxes = [idx for selected_idx in batches for idx in selected_idx]
+    else:
+        if random_shuffle:
+            random.shuffle(sample_idxes)
+        total_iters = (len(sample_idxes) + (batch_size - 1) * (optimizer is None)) // batch_size
+        batches = [sample_idxes[pos * batch_size: (pos + 1) * batch_size] for pos in range(total_iters)]
+
     if random_shuffle:
-        random.shuffle(sample_idxes)
         instances_filename = os.path.join(model_output_dir, model, f"{dataset_type}_{epoch}_instances.txt")
         with open(instances_filename, "w") as f:
-            for idx in sample_idxes:
-                f.write(instance_ids[idx] + "\n")
+            f.write("".join(instance_ids[idx] + "\n" for idx in sample_idxes))
     
     total_loss = []
-    total_iters = (len(sample_idxes) + (batch_size - 1) * (optimizer is None)) // batch_size
-    pbar = tqdm(range(total_iters), unit='batch')
+    pbar = tqdm(batches, unit='batch')
     all_targets = []
     all_scores = []
     
-    y_pred_instances_filename = os.path.join(model_output_dir, model, "test_ypred_instances.txt")
-    if dataset_type == "Test":
-        if os.path.exists(y_pred_instances_filename):
-            os.remove(y_pred_instances_filename)
+    # Test instances in the order of the predictions, written once after the loop
+    test_instance_ids = []
 
     n_samples = 0
-    for pos in pbar:
-        selected_idx = sample_idxes[pos * batch_size: (pos + 1) * batch_size]
-
-        batch_graph, targets = load_next_batch(cnf_dir, instance_ids, selected_idx, splits, dataset_type)
+    for selected_idx in pbar:
+        batch_graph, targets = load_next_batch(cnf_dir, instance_ids, selected_idx, splits, dataset_type, graph_store,
+                                               pickle_ext)
         all_targets += targets
 
         if dataset_type == "Test":
-            for i in range(len(selected_idx)):
-                idx = selected_idx[i]
-                instance_id = instance_ids[idx]
-                with open(y_pred_instances_filename, "a") as f:
-                    f.write(instance_id + '\n')
+            test_instance_ids += [instance_ids[idx] for idx in selected_idx]
 
         if classifier.regression:
             pred, mae, loss = classifier(batch_graph)
@@ -95,7 +182,8 @@ def loop_dataset(cnf_dir: str, model_output_dir: str, model: str, instance_ids:
             total_loss.append(np.array([loss, acc]) * len(selected_idx))
 
         n_samples += len(selected_idx)
-        gc.collect()
+        if memory_manager is not None:
+            memory_manager.step()
         
     if optimizer is None:
         assert n_samples == len(sample_idxes)
@@ -109,6 +197,9 @@ def loop_dataset(cnf_dir: str, model_output_dir: str, model: str, instance_ids:
     else:
         predictions_filename = os.path.join(model_output_dir, model, f"{dataset_type}_{epoch}_outputs.txt")
     np.savetxt(predictions_filename, all_scores, "%.6f")  # output predictions
+    if dataset_type == "Test":
+        with open(os.path.join(model_output_dir, model, "test_ypred_instances.txt"), "w") as f:
+            f.write("".join(instance_id + "\n" for instance_id in test_instance_ids))
 
     if not classifier.regression and print_auc:
         all_targets = np.array(all_targets)
@@ -16,3 +16,47 @@ def angular_distance(x, y):
     numerator = np.sum(np.prod(xy, axis=0))
     denominator = np.sqrt(np.sum(np.float_power(x, 2))) * np.sqrt(np.sum(np.float_power(y, 2)))
     return 1 - numerator/denominator
+
+
+def euclidean_distances(x, y):
+    squared = np.sum(x ** 2, axis=1)[:, np.newaxis] - 2 * x @ y.T + np.sum(y ** 2, axis=1)[np.newaxis, :]
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def manhattan_distances(x, y):
+    return np.sum(np.fabs(x[:, np.newaxis, :] - y[np.newaxis, :, :]), axis=2)
+
+
+def lorentzian_distances(x, y):
+    return np.sum(np.log1p(np.fabs(x[:, np.newaxis, :] - y[np.newaxis, :, :])), axis=2)
+
+
+def angular_distances(x, y):
+    norms = np.sqrt(np.sum(x ** 2, axis=1))[:, np.newaxis] * np.sqrt(np.sum(y ** 2, axis=1))[np.newaxis, :]
+    return 1 - (x @ y.T) / norms
+
+
+# Vectorized versions of the metrics, on all pairs of rows of x and y
+pairwise_distance_functions = {
+    "euclidean": euclidean_distances,
+    "manhattan": manhattan_distances,
+    "lorentzian": lorentzian_distances,
+    "angular": angular_distances,
+}
+
+
+def pairwise_distances(x, y, metric, max_chunk_bytes=256 * 1024 * 1024):
+    """
+        Distance matrix (len(x), len(y)) of a metric of pairwise_distance_functions, or of a vectorized kernel
+        (x, y) -> matrix. The rows of x are processed in chunks whose intermediate (rows, len(y), features) array
+        stays under max_chunk_bytes.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    distance_function = metric if callable(metric) else pairwise_distance_functions[metric]
+    chunk_rows = max(1, max_chunk_bytes // max(1, 8 * y.shape[0] * y.shape[1]))
+
+    distances = np.empty((x.shape[0], y.shape[0]))
+    for start in range(0, x.shape[0], chunk_rows):
+        distances[start:start + chunk_rows] = distance_function(x[start:start + chunk_rows], y)
+    return distances
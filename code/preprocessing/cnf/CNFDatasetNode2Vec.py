@@ -1,84 +1,36 @@
 import os
-import pickle
 
 import numpy as np
 import pandas as pd
-from scipy import sparse
-from dgl import DGLGraph
+import dgl
+import torch
 from dgl.data import save_graphs, load_graphs
-from graphvite import graph as vite_graph
-from graphvite import solver as vite_solver
+from dgl.data.utils import load_labels
 from torch.utils.data import Dataset
 from tqdm import tqdm
 
 from ..algorithms.math import log10_transform_data
+from ..cnf.edgelist import Edgelist, SparseMatrix, edgelist_path
+from ..cnf.embedding_backends import EmbeddingBackend, create_embedding_backend
+from ..cnf.node_features import NODE2VEC, CNFGraph, parse_node_features, create_node_feature_generators, \
+    generate_node_features, read_num_of_clauses
+from ..cnf.graph_store import GraphStore
+from ..cnf.graph_cache import GraphCache, dgl_graph_nbytes
 
 
-class Edgelist:
-    def __init__(self, graph_id: int):
-        self.data = []
-        self.graph_id = graph_id
-        self.__num_of_rows = 0
-        self.__is_pickled = False
-        self.max_node = -1
-
-    def load_from_file(self, filepath: str):
-        with open(filepath, "r") as file:
-            lines = file.readlines()
-
-        self.data = []
-        for i in range(len(lines)):
-            if lines[i].find(" ") != -1:
-                row_data = lines[i].split(" ")
-            elif lines[i].find("\t") != -1:
-                row_data = lines[i].split("\t")
-            else:
-                raise ValueError(fr'Unknown separator for edgelist format. The data found is: {lines[i]}')
-            v1 = np.int32(row_data[0])
-            v2 = np.int32(row_data[1])
-            self.add_edge(v1, v2)
-            if self.max_node < v1:
-                self.max_node = v1
-            if self.max_node < v2:
-                self.max_node = v2
-
-    def add_edge(self, v1: np.int32, v2: np.int32):
-        if self.__is_pickled:
-            raise ValueError('Cannot add an edge to already pickled object')
-
-        self.data.append([v1, v2])
-        self.__num_of_rows += 1
-
-    def pickle(self, filename):
-        print('Serializing data to: ' + filename)
-        self.data = np.array(self.data, dtype=np.int32)
-        data_dump = [self.data, self.graph_id, self.__num_of_rows]
-        with open(filename, 'wb') as f:
-            pickle.dump(data_dump, f)
-        self.__is_pickled = True
-
-    def unpickle(self, filename):
-        print('De-serializing data from: ' + filename)
-        with open(filename, 'rb') as f:
-            data_dump = pickle.load(f)
-            self.data = data_dump[0]
-            self.graph_id = data_dump[1]
-            self.__num_of_rows = data_dump[2]
-
-
-class SparseMatrix:
-    def __init__(self):
-        self.data: sparse.dok_matrix = None
-
-    def from_edgelist(self, from_data: Edgelist):
-        if from_data.max_node == -1:
-            raise ValueError("Edgelist is not populated")
-        n = from_data.max_node + 1
-        self.data = sparse.dok_matrix((n, n), dtype=np.float32)
-        for i in range(len(from_data.data)):
-            v1 = from_data.data[i][0]
-            v2 = from_data.data[i][1]
-            self.data[v1, v2] = 1
+def save_features(filename: str, features: np.ndarray):
+    # Save through a temporary file, so an interrupted run never leaves a truncated .npy file behind
+    tmp_filename = filename + '.tmp.npy'
+    np.save(tmp_filename, features)
+    os.replace(tmp_filename, filename + '.npy')
+
+
+def is_valid_features_file(filename: str, dim: int):
+    try:
+        features = np.load(filename, mmap_mode='r')
+    except (OSError, ValueError):
+        return False
+    return features.ndim == 2 and features.shape[1] == dim and bool(np.all(np.isfinite(features)))
 
 
 def filter_dataset_by_splits(df: pd.DataFrame, splits: list):
@@ -92,7 +44,8 @@ def filter_dataset_by_splits(df: pd.DataFrame, splits: list):
 
 
 class CNFDatasetNode2Vec(Dataset):
-    def __init__(self, csv_file_x: str, csv_file_y: str, root_dir: str, splits: str, classification=False):
+    def __init__(self, csv_file_x: str, csv_file_y: str, root_dir: str, splits: str, classification=False,
+                 embedding_backend: EmbeddingBackend = None, node_features=NODE2VEC, graph_cache: GraphCache = None):
         super(CNFDatasetNode2Vec).__init__()
         # Checks
         available_splits = ['Train', 'Validation', 'Test']
@@ -106,10 +59,22 @@ class CNFDatasetNode2Vec(Dataset):
         self.ys = []
         self.csv_data_x = pd.read_csv(csv_file_x)
         self.csv_data_y = pd.read_csv(csv_file_y)
-        self.hidden_features_dim = 64
+        self.node_features = parse_node_features(node_features)
+        self.feature_generators = create_node_feature_generators(self.node_features)
+        self.embedding_backend = None
+        if NODE2VEC in self.node_features:
+            self.embedding_backend = embedding_backend if embedding_backend is not None else create_embedding_backend()
+        self.hidden_features_dim = sum(generator.dim for generator in self.feature_generators)
+        if self.embedding_backend is not None:
+            self.hidden_features_dim += self.embedding_backend.dim
         self.indices = []
+        self.graph_store = None
+        self.graph_store_rows = None
+        self.num_edges = None
+        # The cache can be shared by datasets with the same node features, so the instances are the keys
+        self.graph_cache = graph_cache
         self.data_dir = "data"
-        self.hidden_features_type = "node2vec"
+        self.hidden_features_type = "+".join(self.node_features)
         # Keep track of unsuccessfully loaded data, so we can skip them faster
         self.__unsuccessful_txt = os.path.join(root_dir, f"{self.hidden_features_type}{self.hidden_features_dim}_unsuccessful.txt")
         self.__load_already_known_unsuccessful_graphs()
@@ -168,11 +133,11 @@ class CNFDatasetNode2Vec(Dataset):
 
             # Finally, try to pickle feature data and save the index
             try:
-                self.create_node2vec_features(i)
+                self.create_features(i)
                 self.indices.append(i)
             except ValueError as e:
                 instance_id: str = self.csv_data_x['instance_id'][i]
-                edgelist_filename = os.path.join(self.root_dir, instance_id + '.edgelist')
+                edgelist_filename = edgelist_path(self.root_dir, instance_id, missing_ok=True)
                 wrong_instances.append(edgelist_filename)
                 print(e)
 
@@ -234,19 +199,54 @@ class CNFDatasetNode2Vec(Dataset):
         g = g[0]
         return g
 
-    def load_pickled_features(self, i):
-        pickled_filename, _ = self.extract_pickle_filename_and_folder(i, features=True)
+    def load_pickled_features(self, i, features_type=None):
+        pickled_filename, _ = self.extract_pickle_filename_and_folder(i, features=True, features_type=features_type)
         return np.load(pickled_filename + '.npy')
 
+    def node2vec_features_type(self):
+        return f"{NODE2VEC}{self.embedding_backend.dim}"
+
+    def create_features(self, i):
+        # Node2Vec features are stored separately, so they are shared by all selections that include them
+        node2vec_type = self.node2vec_features_type() if self.embedding_backend is not None else None
+        if node2vec_type is not None:
+            node2vec_filename, _ = self.extract_pickle_filename_and_folder(i, features=True,
+                                                                           features_type=node2vec_type)
+            if not is_valid_features_file(node2vec_filename + '.npy', self.embedding_backend.dim):
+                self.create_node2vec_features(i)
+            if self.node_features == [NODE2VEC]:
+                return
+
+        graph = None
+        if len(self.feature_generators) > 0:
+            graph = self.create_cnf_graph(i)
+
+        features = []
+        generators = iter(self.feature_generators)
+        for name in self.node_features:
+            if name == NODE2VEC:
+                features.append(self.load_pickled_features(i, node2vec_type))
+            else:
+                features.append(generate_node_features(graph, [next(generators)]))
+
+        pickled_filename, _ = self.extract_pickle_filename_and_folder(i, features=True)
+        save_features(pickled_filename, np.concatenate(features, axis=1).astype(np.float32))
+
+    def create_cnf_graph(self, i):
+        instance_id: str = self.csv_data_x['instance_id'][i]
+        g = self.load_pickled_graph(i)
+        src, dst = g.edges()
+        edges = np.stack([src.numpy(), dst.numpy()], axis=1)
+        return CNFGraph(edges, g.number_of_nodes(), read_num_of_clauses(os.path.join(self.root_dir, instance_id)))
+
     def create_node2vec_features(self, i):
         instance_id: str = self.csv_data_x['instance_id'][i]
-        edgelist_filename = os.path.join(self.root_dir, instance_id + '.edgelist')
+        edgelist_filename = edgelist_path(self.root_dir, instance_id, self.embedding_backend.reads_binary_edgelists)
 
         # Prepare graph for Node2Vec
         # print(f"\tPreparing graph for Node2vec...")
-        v_graph = vite_graph.Graph()
-        v_graph.load(edgelist_filename, as_undirected=False)
-        v_graph_node_num = len(v_graph.id2name)
+        embedding_graph = self.embedding_backend.load_graph(edgelist_filename)
+        embedding_graph_node_num = self.embedding_backend.num_nodes(embedding_graph)
 
         # Prepare graph for DGL
         # print(f"\tPreparing graph for DGL...")
@@ -254,33 +254,22 @@ class CNFDatasetNode2Vec(Dataset):
         g_node_num = g.number_of_nodes()
 
         # Check if graphs have the same number of nodes
-        if v_graph_node_num != g_node_num:
-            raise ValueError(f"\tMismatching number of nodes: {v_graph_node_num} in graphvite != {g_node_num} in dgl.")
+        if embedding_graph_node_num != g_node_num:
+            raise ValueError(f"\tMismatching number of nodes: {embedding_graph_node_num} in " +
+                             f"{self.embedding_backend.name} != {g_node_num} in dgl.")
 
         # print(f"\tNumber of nodes: {g_node_num}")
 
-        self.train_features(v_graph, i)
+        self.train_features(embedding_graph, i)
 
-    def train_features(self, v_graph, i):
+    def train_features(self, embedding_graph, i):
         # Train Node2Vec hidden data
-        embed = vite_solver.GraphSolver(dim=self.hidden_features_dim)
-        embed.build(v_graph)
-        embed.train(model=self.hidden_features_type, num_epoch=2000, resume=False, augmentation_step=1,
-                    random_walk_length=40, random_walk_batch_size=100, shuffle_base=1, p=1, q=1, positive_reuse=1,
-                    negative_sample_exponent=0.75, negative_weight=5, log_frequency=1000)
-
-        # Extract embedded feature data
-        sorted_features = np.empty(embed.vertex_embeddings.shape, dtype=np.float32)
-        id2name = list(map(lambda x: int(x), v_graph.id2name))
-        for j in range(embed.vertex_embeddings.shape[0]):
-            sorted_features[id2name[j], :] = embed.vertex_embeddings[j]
-
-        # Clear memory and data on CPU and GPU
-        embed.clear()
+        sorted_features = self.embedding_backend.train(embedding_graph)
 
         # Pickle hidden feature data
-        pickled_filename, _ = self.extract_pickle_filename_and_folder(i, features=True)
-        np.save(pickled_filename, sorted_features)
+        pickled_filename, _ = self.extract_pickle_filename_and_folder(i, features=True,
+                                                                      features_type=self.node2vec_features_type())
+        save_features(pickled_filename, sorted_features)
 
     def create_edgelist_from_instance_id(self, i):
         instance_id: str = self.csv_data_x['instance_id'][i]
@@ -288,10 +277,8 @@ class CNFDatasetNode2Vec(Dataset):
         # Get the cnf file path
         pickled_filename, pickled_folder = self.extract_pickle_filename_and_folder(i)
 
-        # Load the edgelist data and create sparse matrix
-        edgelist_filename = os.path.join(self.root_dir, instance_id + '.edgelist')
-        if not os.path.exists(edgelist_filename):
-            raise FileNotFoundError(f"Could not find required edgelist file: {edgelist_filename}")
+        # Load the edgelist data and create sparse matrix, preferring the memory-mapped binary edgelist
+        edgelist_filename = edgelist_path(self.root_dir, instance_id)
 
         # Prepare graph for DGL
         # print(f"\tPreparing graph for DGL...")
@@ -299,10 +286,10 @@ class CNFDatasetNode2Vec(Dataset):
         edgelist.load_from_file(edgelist_filename)
         graph_adj = SparseMatrix()
         graph_adj.from_edgelist(edgelist)
-        g = DGLGraph(graph_adj.data)
+        g = graph_adj.to_dgl_graph()
 
-        # Pickle loaded data for the next load
-        save_graphs(pickled_filename, [g])
+        # Pickle loaded data for the next load, with the number of edges for the graph sizes
+        save_graphs(pickled_filename, [g], {"num_edges": torch.tensor([g.number_of_edges()])})
 
     def check_if_pickled(self, i):
         pickled_filename, _ = self.extract_pickle_filename_and_folder(i)
@@ -312,12 +299,14 @@ class CNFDatasetNode2Vec(Dataset):
         pickled_filename, _ = self.extract_pickle_filename_and_folder(i, features=True)
         return os.path.exists(pickled_filename + '.npy')
 
-    def extract_pickle_filename_and_folder(self, i, features=False):
+    def extract_pickle_filename_and_folder(self, i, features=False, features_type=None):
         instance_id: str = self.csv_data_x['instance_id'][i]
         instance_loc = instance_id.split("/" if instance_id.find("/") != -1 else "\\")
         instance_name = instance_loc[-1]
         instance_loc = instance_loc[:-1]
-        ext = f".{self.hidden_features_type}{self.hidden_features_dim}" if features else ".graph"
+        if features_type is None:
+            features_type = f"{self.hidden_features_type}{self.hidden_features_dim}"
+        ext = f".{features_type}" if features else ".graph"
         pickled_filename = os.path.join(self.csv_x_folder, *instance_loc, instance_name + ext)
         pickled_folder = os.path.dirname(pickled_filename)
         if os.path.exists(pickled_folder) and not os.path.isdir(pickled_folder):
@@ -327,28 +316,102 @@ class CNFDatasetNode2Vec(Dataset):
 
         return os.path.abspath(pickled_filename), os.path.abspath(pickled_folder)
 
+    def graph_store_record(self, item):
+        i = self.indices[item]
+        instance_id: str = self.csv_data_x['instance_id'][i]
+        graph = self.load_pickled_graph(i)
+        src, dst = graph.edges()
+        edges = np.stack([src.numpy(), dst.numpy()], axis=1)
+        features = self.load_pickled_features(i)
+        labels = log10_transform_data(self.get_ys(i))
+        return instance_id, edges, features, labels
+
+    def graph_store_sources(self, item):
+        # Files a graph store record is built from, their modification times invalidate the store
+        i = self.indices[item]
+        graph_filename, _ = self.extract_pickle_filename_and_folder(i)
+        features_filename, _ = self.extract_pickle_filename_and_folder(i, features=True)
+        return [graph_filename, features_filename + '.npy']
+
+    def use_graph_store(self, graph_store: GraphStore):
+        instance_ids = [self.csv_data_x['instance_id'][i] for i in self.indices]
+        missing = [instance_id for instance_id in instance_ids if instance_id not in graph_store]
+        if len(missing) > 0:
+            raise ValueError(f"{len(missing)} instances are missing in the graph store {graph_store.filename}, " +
+                             f"e.g. {missing[0]}")
+        if graph_store.metadata.get("features") != f"{self.hidden_features_type}{self.hidden_features_dim}":
+            raise ValueError(f"The graph store {graph_store.filename} has different node features: " +
+                             f"{graph_store.metadata.get('features')}")
+
+        self.graph_store = graph_store
+        self.graph_store_rows = np.array([graph_store.index[instance_id] for instance_id in instance_ids],
+                                         dtype=np.int64)
+
+    def graph_sizes(self):
+        """
+            Number of edges of every graph, from the graph store or from the pickled graphs. Graphs pickled without
+            their number of edges are loaded to count them.
+        """
+        if self.graph_store is not None:
+            return np.diff(self.graph_store.edge_offsets)[self.graph_store_rows]
+        if self.num_edges is None:
+            self.num_edges = np.array([self.pickled_num_edges(i) for i in self.indices], dtype=np.int64)
+        return self.num_edges
+
+    def pickled_num_edges(self, i):
+        pickled_filename, _ = self.extract_pickle_filename_and_folder(i)
+        labels = load_labels(pickled_filename)
+        if "num_edges" in labels:
+            return int(labels["num_edges"][0])
+        return self.load_pickled_graph(i).number_of_edges()
+
     def __len__(self):
         return len(self.indices)
 
     def __getitem__(self, item):
+        if self.graph_cache is None:
+            return self.load_item(item)
+
+        instance_id: str = self.csv_data_x['instance_id'][self.indices[item]]
+        cached = self.graph_cache.get(instance_id)
+        if cached is not None:
+            return cached
+
+        graph, ys = self.load_item(item)
+        self.graph_cache.put(instance_id, (graph, ys), dgl_graph_nbytes(graph))
+        return graph, ys
+
+    def load_item(self, item):
+        if self.graph_store is not None:
+            return self.get_stored_item(item)
+
         i = self.indices[item]
         
         # Unpickle graph and feature data
         graph = self.load_pickled_graph(i)
-        
-        degrees = False
-        if degrees:
-            features = graph.out_degrees().reshape((-1, 1))
-        else:
-            features = self.load_pickled_features(i)
+        features = self.load_pickled_features(i)
 
-            # Check if we need to re-pickle feature data (if nan had occurred during previous pickling)
-            while np.any(np.isnan(features)):
-                self.create_node2vec_features(i)
-                features = self.load_pickled_features(i)
+        # Check if we need to re-pickle feature data (if nan had occurred during previous pickling)
+        while np.any(np.isnan(features)):
+            self.create_features(i)
+            features = self.load_pickled_features(i)
 
         graph.ndata['features'] = features
 
         ys = self.ys[item]
 
         return graph, ys
+
+    def get_stored_item(self, item):
+        row = self.graph_store_rows[item]
+
+        # Zero-copy slices of the memory-mapped store
+        edges = self.graph_store.edges(row)
+        src = torch.from_numpy(edges[:, 0].astype(np.int64))
+        dst = torch.from_numpy(edges[:, 1].astype(np.int64))
+        graph = dgl.graph((src, dst), num_nodes=self.graph_store.num_nodes(row))
+        graph.ndata['features'] = torch.from_numpy(self.graph_store.node_features(row))
+
+        ys = self.ys[item]
+
+        return graph, ys
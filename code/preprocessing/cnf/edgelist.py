@@ -0,0 +1,110 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import dgl
+import torch
+
+from ..parsers.libparsers import load_binary_edgelist, save_binary_edgelist
+
+
+# Text edgelists larger than this are parsed in chunks and cached as a memory-mapped binary edgelist
+EDGELIST_CHUNKED_LOADING_THRESHOLD = 2 * 1024 ** 3
+EDGELIST_CHUNK_SIZE = 1 << 24
+
+
+def read_text_edgelist_chunks(filepath: str, chunk_size: int):
+    reader = pd.read_csv(filepath, sep=r"\s+", header=None, names=[0, 1], dtype=np.int32, engine="c",
+                         chunksize=chunk_size)
+    for chunk in reader:
+        yield chunk.to_numpy()
+
+
+def edgelist_path(directory: str, instance_id: str, binary=True, missing_ok=False) -> str:
+    """
+        Path of the edgelist of an instance, written as <instance>.edgelist or <instance>.edgelist.bin. When both
+        exist, the binary edgelist is preferred unless binary is False. Raises FileNotFoundError if neither exists,
+        unless missing_ok, when the text path is returned.
+    """
+    filepath = os.path.join(directory, instance_id + ".edgelist")
+    binary_filepath = filepath + ".bin"
+    if binary and os.path.exists(binary_filepath):
+        return binary_filepath
+    if os.path.exists(filepath):
+        return filepath
+    if os.path.exists(binary_filepath):
+        return binary_filepath
+    if missing_ok:
+        return filepath
+    raise FileNotFoundError(f"Could not find required edgelist file: {filepath}")
+
+
+class Edgelist:
+    def __init__(self, graph_id: int):
+        self.data = np.empty((0, 2), dtype=np.int32)
+        self.graph_id = graph_id
+        self.__num_of_rows = 0
+        self.max_node = -1
+
+    def load_from_file(self, filepath: str, chunk_size=None):
+        if filepath.endswith(".bin"):
+            _, self.data = load_binary_edgelist(filepath)
+        elif chunk_size is None and os.path.getsize(filepath) < EDGELIST_CHUNKED_LOADING_THRESHOLD:
+            self.data = pd.read_csv(filepath, sep=r"\s+", header=None, names=[0, 1], dtype=np.int32,
+                                    engine="c").to_numpy()
+            self.data = np.ascontiguousarray(self.data)
+        else:
+            # Parse the text in chunks and keep the result on disk, so only one chunk is ever held in memory
+            binary_filepath = filepath + ".bin"
+            save_binary_edgelist(binary_filepath,
+                                 read_text_edgelist_chunks(filepath, chunk_size or EDGELIST_CHUNK_SIZE))
+            _, self.data = load_binary_edgelist(binary_filepath)
+
+        self.__num_of_rows = len(self.data)
+        self.max_node = int(self.data.max()) if self.__num_of_rows > 0 else -1
+
+    def pickle(self, filename):
+        print('Serializing data to: ' + filename)
+        self.data = np.asarray(self.data, dtype=np.int32)
+        data_dump = [self.data, self.graph_id, self.__num_of_rows]
+        with open(filename, 'wb') as f:
+            pickle.dump(data_dump, f)
+
+    def unpickle(self, filename):
+        print('De-serializing data from: ' + filename)
+        with open(filename, 'rb') as f:
+            data_dump = pickle.load(f)
+            self.data = data_dump[0]
+            self.graph_id = data_dump[1]
+            self.__num_of_rows = data_dump[2]
+        self.max_node = int(self.data.max()) if self.__num_of_rows > 0 else -1
+
+
+class SparseMatrix:
+    def __init__(self):
+        self.data: sparse.csr_matrix = None
+
+    def from_edgelist(self, from_data: Edgelist):
+        if from_data.max_node == -1:
+            raise ValueError("Edgelist is not populated")
+        n = from_data.max_node + 1
+        edges = np.asarray(from_data.data)
+        values = np.ones(len(edges), dtype=np.float32)
+        self.data = sparse.coo_matrix((values, (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+        # Converting to CSR sums the duplicate edges, but an edge is present only once in the graph
+        self.data.data[:] = 1
+
+    @property
+    def num_nodes(self):
+        return self.data.shape[0]
+
+    def edges(self):
+        src = np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(self.data.indptr))
+        dst = self.data.indices.astype(np.int64)
+        return src, dst
+
+    def to_dgl_graph(self):
+        src, dst = self.edges()
+        return dgl.graph((torch.from_numpy(src), torch.from_numpy(dst)), num_nodes=self.num_nodes)
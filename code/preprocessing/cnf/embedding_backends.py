@@ -0,0 +1,213 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+import torch
+
+from ..cnf.edgelist import Edgelist, SparseMatrix
+
+try:
+    from graphvite import graph as vite_graph
+    from graphvite import solver as vite_solver
+except ImportError:
+    vite_graph = None
+    vite_solver = None
+
+
+class EmbeddingBackend(ABC):
+    """
+        Trains node embeddings for a graph stored in an edgelist file. The embeddings are returned as a
+        (num_nodes, dim) float32 array, where row i holds the embedding of node i.
+    """
+    name = None
+    default_num_epochs = 1
+    # Whether load_graph reads the binary edgelists of -edgelist_format binary
+    reads_binary_edgelists = True
+
+    def __init__(self, dim=64, num_epochs=0, walk_length=40):
+        self.dim = dim
+        self.num_epochs = num_epochs if num_epochs > 0 else self.default_num_epochs
+        self.walk_length = walk_length
+
+    @abstractmethod
+    def load_graph(self, edgelist_filename: str):
+        pass
+
+    @abstractmethod
+    def num_nodes(self, graph) -> int:
+        pass
+
+    @abstractmethod
+    def train(self, graph) -> np.ndarray:
+        pass
+
+    def embed(self, edgelist_filename: str) -> np.ndarray:
+        return self.train(self.load_graph(edgelist_filename))
+
+
+class GraphViteBackend(EmbeddingBackend):
+    name = "graphvite"
+    default_num_epochs = 2000
+    reads_binary_edgelists = False
+
+    def __init__(self, dim=64, num_epochs=0, walk_length=40):
+        if vite_graph is None:
+            raise ImportError("The graphvite embedding backend requires graphvite to be installed. " +
+                              "Use the cpu embedding backend instead.")
+        super(GraphViteBackend, self).__init__(dim, num_epochs, walk_length)
+
+    def load_graph(self, edgelist_filename: str):
+        if edgelist_filename.endswith(".bin"):
+            raise ValueError(f"The graphvite embedding backend cannot read the binary edgelist {edgelist_filename}. " +
+                             "Use -edgelist_format text or the cpu embedding backend.")
+        v_graph = vite_graph.Graph()
+        v_graph.load(edgelist_filename, as_undirected=False)
+        return v_graph
+
+    def num_nodes(self, graph) -> int:
+        return len(graph.id2name)
+
+    def train(self, graph) -> np.ndarray:
+        # Train Node2Vec hidden data
+        embed = vite_solver.GraphSolver(dim=self.dim)
+        embed.build(graph)
+        embed.train(model="node2vec", num_epoch=self.num_epochs, resume=False, augmentation_step=1,
+                    random_walk_length=self.walk_length, random_walk_batch_size=100, shuffle_base=1, p=1, q=1,
+                    positive_reuse=1, negative_sample_exponent=0.75, negative_weight=5, log_frequency=1000)
+
+        # Extract embedded feature data
+        sorted_features = np.empty(embed.vertex_embeddings.shape, dtype=np.float32)
+        id2name = np.array(list(map(lambda x: int(x), graph.id2name)))
+        if len(id2name) > 0 and id2name.max() >= sorted_features.shape[0]:
+            embed.clear()
+            raise ValueError(f"Node index {id2name.max()} is out of range for {sorted_features.shape[0]} embeddings")
+        sorted_features[id2name, :] = embed.vertex_embeddings
+
+        # Clear memory and data on CPU and GPU
+        embed.clear()
+
+        return sorted_features
+
+
+class CPUNode2VecBackend(EmbeddingBackend):
+    """
+        Node2Vec with p = q = 1 (as used with graphvite) on the CPU: uniform random walks are generated for a batch
+        of start nodes at once over the CSR adjacency, and a skip-gram model with negative sampling is trained
+        with SGD over the (node, context) pairs of the walks. One epoch starts one walk from every node.
+    """
+    name = "cpu"
+    default_num_epochs = 5
+
+    def __init__(self, dim=64, num_epochs=0, walk_length=40, window_size=5, negative_samples=5,
+                 negative_sample_exponent=0.75, walk_batch_size=10000, batch_size=16384, learning_rate=0.025,
+                 seed=0):
+        super(CPUNode2VecBackend, self).__init__(dim, num_epochs, walk_length)
+        self.window_size = window_size
+        self.negative_samples = negative_samples
+        self.negative_sample_exponent = negative_sample_exponent
+        self.walk_batch_size = walk_batch_size
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.seed = seed
+
+    def load_graph(self, edgelist_filename: str):
+        edgelist = Edgelist(0)
+        edgelist.load_from_file(edgelist_filename)
+        graph_adj = SparseMatrix()
+        graph_adj.from_edgelist(edgelist)
+        return graph_adj.data
+
+    def num_nodes(self, graph) -> int:
+        return graph.shape[0]
+
+    def random_walks(self, indptr: np.ndarray, indices: np.ndarray, start_nodes: np.ndarray, rng):
+        degrees = indptr[1:] - indptr[:-1]
+        walks = np.empty((len(start_nodes), self.walk_length), dtype=np.int64)
+        walks[:, 0] = start_nodes
+        for step in range(1, self.walk_length):
+            current = walks[:, step - 1]
+            current_degrees = degrees[current]
+            offsets = (rng.random(len(current)) * current_degrees).astype(np.int64)
+            # Nodes without neighbours stay in place
+            neighbour_idx = np.minimum(indptr[current] + offsets, len(indices) - 1)
+            walks[:, step] = np.where(current_degrees > 0, indices[neighbour_idx], current)
+        return walks
+
+    def skip_gram_pairs(self, walks: np.ndarray):
+        centers = []
+        contexts = []
+        for offset in range(1, min(self.window_size, self.walk_length - 1) + 1):
+            centers += [walks[:, :-offset].ravel(), walks[:, offset:].ravel()]
+            contexts += [walks[:, offset:].ravel(), walks[:, :-offset].ravel()]
+        return np.concatenate(centers), np.concatenate(contexts)
+
+    def train(self, graph) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        torch.manual_seed(self.seed)
+
+        n = self.num_nodes(graph)
+        indptr = graph.indptr.astype(np.int64)
+        indices = graph.indices.astype(np.int64)
+
+        # Negative samples are drawn proportionally to degree^0.75
+        noise_cdf = np.cumsum(np.power(np.diff(indptr), self.negative_sample_exponent, dtype=np.float64))
+
+        node_embeddings = (torch.rand(n, self.dim) - 0.5) / self.dim
+        context_embeddings = torch.zeros(n, self.dim)
+
+        # The gradients of the skip-gram loss are computed in closed form and applied with index_add_, as in
+        # word2vec, which is much cheaper than autograd with sparse gradients. The learning rate decays linearly.
+        total_batches = self.num_epochs * sum(
+            int(np.ceil(min(self.walk_batch_size, n - s) * self.pairs_per_walk() / self.batch_size))
+            for s in range(0, n, self.walk_batch_size))
+        batch_idx = 0
+
+        for _ in range(self.num_epochs):
+            start_nodes = rng.permutation(n)
+            for walk_batch_start in range(0, n, self.walk_batch_size):
+                walks = self.random_walks(indptr, indices,
+                                          start_nodes[walk_batch_start:walk_batch_start + self.walk_batch_size], rng)
+                centers, contexts = self.skip_gram_pairs(walks)
+                order = rng.permutation(len(centers))
+
+                for batch_start in range(0, len(order), self.batch_size):
+                    lr = self.learning_rate * max(1e-4, 1.0 - batch_idx / max(total_batches, 1))
+                    batch_idx += 1
+
+                    batch = order[batch_start:batch_start + self.batch_size]
+                    negatives = np.searchsorted(noise_cdf, rng.random((len(batch), self.negative_samples)) *
+                                                noise_cdf[-1], side="right")
+                    batch_centers = torch.from_numpy(centers[batch])
+                    batch_contexts = torch.from_numpy(contexts[batch])
+                    batch_negatives = torch.from_numpy(np.minimum(negatives, n - 1))
+
+                    u = node_embeddings[batch_centers]
+                    v = context_embeddings[batch_contexts]
+                    v_neg = context_embeddings[batch_negatives]
+
+                    # d/dx log(sigmoid(x)) = 1 - sigmoid(x) and d/dx log(sigmoid(-x)) = -sigmoid(x)
+                    positive_grad = lr * (1 - torch.sigmoid(torch.sum(u * v, dim=1)))
+                    negative_grad = -lr * torch.sigmoid(torch.bmm(v_neg, u.unsqueeze(2)).squeeze(2))
+
+                    u_grad = positive_grad.unsqueeze(1) * v + torch.bmm(negative_grad.unsqueeze(1), v_neg).squeeze(1)
+                    context_embeddings.index_add_(0, batch_contexts, positive_grad.unsqueeze(1) * u)
+                    context_embeddings.index_add_(0, batch_negatives.reshape(-1),
+                                                  (negative_grad.unsqueeze(2) * u.unsqueeze(1)).reshape(-1, self.dim))
+                    node_embeddings.index_add_(0, batch_centers, u_grad)
+
+        return node_embeddings.numpy().astype(np.float32)
+
+    def pairs_per_walk(self):
+        window_size = min(self.window_size, self.walk_length - 1)
+        return sum(2 * (self.walk_length - offset) for offset in range(1, window_size + 1))
+
+
+EMBEDDING_BACKENDS = {
+    GraphViteBackend.name: GraphViteBackend,
+    CPUNode2VecBackend.name: CPUNode2VecBackend,
+}
+
+
+def create_embedding_backend(name="graphvite", **params) -> EmbeddingBackend:
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}. Available values are: {list(EMBEDDING_BACKENDS.keys())}")
+    return EMBEDDING_BACKENDS[name](**params)
@@ -2,11 +2,11 @@ import os
 from timeit import default_timer as timer
 import math
 from typing import Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
 import pickle as pkl
 import numpy as np
-import graphvite
 from tqdm import tqdm
 import networkx as nx
 
@@ -14,11 +14,20 @@ from ..parsers.libparsers import parserslib
 from ..os.process import start_process
 from ..cnf.process_cnf_attributes import sort_by_split, is_unsolvable
 from ..algorithms.math import log10_transform_data
-from ..cnf.CNFDatasetNode2Vec import CNFDatasetNode2Vec
+from ..cnf.CNFDatasetNode2Vec import CNFDatasetNode2Vec, save_features
+from ..cnf.embedding_backends import EmbeddingBackend, create_embedding_backend
+from ..cnf.edgelist import edgelist_path
+from ..cnf.node_features import NODE2VEC, CNFGraph, parse_node_features, create_node_feature_generators, \
+    generate_node_features, read_num_of_clauses
+from ..cnf.graph_store import GraphStoreWriter, graph_store_hash, open_graph_store
+from ...libs.dgcnn.lib.sparse_matrices import propagation_matrix
+from ...libs.dgcnn.util import NUM_EDGES_EXT
 
 
 IntOrFloat = Union[int, float]
 
+EDGELIST_EXTENSIONS = {"text": ".edgelist", "binary": ".edgelist.bin"}
+
 
 class GNNGraph(object):
     def __init__(self, g, labels, node_tags=None, node_features=None):
@@ -29,7 +38,7 @@ class GNNGraph(object):
             node_features: a numpy array of continuous node features
         """
         self.num_nodes = len(node_tags)
-        self.node_tags = node_tags
+        self.node_tags = np.asarray(node_tags, dtype=np.int32)
         self.labels = labels
         self.node_features = node_features  # numpy array (node_num * feature_dim)
         self.degs = list(dict(g.degree).values())
@@ -45,6 +54,9 @@ class GNNGraph(object):
             self.num_edges = 0
             self.edge_pairs = np.array([])
 
+        # CSR arrays and inverse degrees of the DGCNN propagation operator D^-1 (A + I)
+        self.propagation = propagation_matrix(self.edge_pairs, self.num_nodes)
+
         # see if there are edge features
         self.edge_features = None
         if nx.get_edge_attributes(g, 'features'):
@@ -74,19 +86,77 @@ def generate_satzilla_features(csv_filename, root_dirname, cnf_dir):
         start_process(f'{root_dirname}/third-party/SATzilla2012_features/features', [filename, features_filename])
 
 
-def generate_edgelist_formats(csv_filename, directory='.'):
+def convert_dimacs_to_edgelist(filename: str, edgelist_format="text"):
+    basedir = os.path.dirname(filename)
+    filepath = os.path.basename(filename)
+
+    time_start = timer()
+    if edgelist_format == "binary":
+        return_code = parserslib.parse_dimacs_to_binary_edgelist(basedir, filepath)
+    else:
+        return_code = parserslib.parse_dimacs_to_edgelist(basedir, filepath)
+    time_elapsed = timer() - time_start
+
+    return filename, return_code, time_elapsed
+
+
+def print_edgelist_conversion_summary(results: list):
+    if len(results) == 0:
+        return
+
+    print(80 * "=")
+    print("Edgelist conversion summary")
+    print(80 * "=")
+    total_size = 0
+    total_time = 0
+    for filename, return_code, file_size, time_elapsed in sorted(results, key=lambda r: r[3], reverse=True):
+        total_size += file_size
+        total_time += time_elapsed
+        throughput = file_size / (1024 * 1024) / max(time_elapsed, 1e-6)
+        status = "OK" if return_code == 0 else f"FAILED ({return_code})"
+        print(f"{time_elapsed:10.2f}s {throughput:10.2f}MB/s  {status}  {filename}")
+    print(80 * "=")
+    print(f"Converted {len(results)} instances ({total_size / (1024 * 1024):.2f}MB) in {total_time:.2f}s of CPU time")
+    print(80 * "=")
+
+
+def generate_edgelist_formats(csv_filename, directory='.', num_workers=1, edgelist_format="text"):
+    if edgelist_format not in EDGELIST_EXTENSIONS:
+        raise ValueError(f"Unknown edgelist format: {edgelist_format}. Available values are: " +
+                         f"{list(EDGELIST_EXTENSIONS.keys())}")
+
     data = pd.read_csv(csv_filename)
-    idx = 0
+    filenames = []
     for filename in data['instance_id']:
         filename = os.path.join(os.path.abspath(directory), filename)
-        idx += 1
-        features_filename = filename + '.edgelist'
+        features_filename = filename + EDGELIST_EXTENSIONS[edgelist_format]
+
+        # Remove leftovers of a killed run, the edgelist is renamed into place only when it is complete
+        if os.path.exists(features_filename + '.tmp'):
+            os.remove(features_filename + '.tmp')
         if os.path.exists(features_filename):
             continue
-        print('\nCreating Edgelist format for file #{0}: {1}...'.format(idx, filename))
-        basedir = os.path.dirname(filename)
-        filepath = os.path.basename(filename)
-        parserslib.parse_dimacs_to_edgelist(basedir, filepath)
+        filenames.append(filename)
+
+    # Schedule the largest files first, so a single huge instance does not end up last in the queue
+    file_sizes = {filename: os.path.getsize(filename) if os.path.exists(filename) else 0 for filename in filenames}
+    filenames.sort(key=lambda f: file_sizes[f], reverse=True)
+
+    results = []
+    if num_workers <= 1:
+        for idx, filename in enumerate(filenames):
+            print('\nCreating Edgelist format for file #{0}: {1}...'.format(idx + 1, filename))
+            filename, return_code, time_elapsed = convert_dimacs_to_edgelist(filename, edgelist_format)
+            results.append((filename, return_code, file_sizes[filename], time_elapsed))
+    else:
+        print(f'\nCreating Edgelist formats for {len(filenames)} files using {num_workers} workers...')
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(convert_dimacs_to_edgelist, filename, edgelist_format) for filename in filenames]
+            for future in tqdm(as_completed(futures), total=len(futures), unit='instance'):
+                filename, return_code, time_elapsed = future.result()
+                results.append((filename, return_code, file_sizes[filename], time_elapsed))
+
+    print_edgelist_conversion_summary(results)
 
 
 def generate_dgcnn_formats(csv_filename, csv_labels, cnf_dir, model_output_dir, model):
@@ -154,41 +224,50 @@ def generate_dgcnn_formats(csv_filename, csv_labels, cnf_dir, model_output_dir,
         pkl.dump([instance_ids, splits], instance_ids_file)
 
 
-def create_node2vec_features(cnf_dir: str, instance_id: str):
-    edgelist_filename = os.path.join(cnf_dir, instance_id + '.edgelist')
-
-    # Prepare graph for Node2Vec
-    v_graph = graphvite.graph.Graph()
-    v_graph.load(edgelist_filename, as_undirected=False)
+def create_node2vec_features(cnf_dir: str, instance_id: str, embedding_backend: EmbeddingBackend = None):
+    if embedding_backend is None:
+        embedding_backend = create_embedding_backend()
+    edgelist_filename = edgelist_path(cnf_dir, instance_id, embedding_backend.reads_binary_edgelists)
 
     # Train Node2Vec hidden data
-    embed = graphvite.solver.GraphSolver(dim=64)
-    embed.build(v_graph)
-    embed.train(model="node2vec", num_epoch=2000, resume=False, augmentation_step=1,
-                random_walk_length=40, random_walk_batch_size=100, shuffle_base=1, p=1, q=1, positive_reuse=1,
-                negative_sample_exponent=0.75, negative_weight=5, log_frequency=1000)
-
-    # Extract embedded feature data
-    sorted_features = np.empty(embed.vertex_embeddings.shape, dtype=np.float32)
-    id2name = list(map(lambda x: int(x), v_graph.id2name))
-    try:
-        for j in range(embed.vertex_embeddings.shape[0]):
-            sorted_features[id2name[j], :] = embed.vertex_embeddings[j]
-    except IndexError as e:
-        print(embed.vertex_embeddings.shape)
-        print(sorted_features.shape)
-        print(e)
-        exit(1)
-
-    # Clear memory and data on CPU and GPU
-    embed.clear()
+    sorted_features = embedding_backend.embed(edgelist_filename)
 
     # Pickle hidden feature data
-    pickled_filename = os.path.join(cnf_dir, instance_id + '.node2vec64')
-    np.save(pickled_filename, sorted_features)
+    pickled_filename = os.path.join(cnf_dir, instance_id + f'.node2vec{embedding_backend.dim}')
+    save_features(pickled_filename, sorted_features)
+
+
+def create_dgcnn_node_features(cnf_dir: str, instance_id: str, g: nx.Graph, node_features: list, feature_generators: list,
+                               embedding_backend: EmbeddingBackend = None):
+    features = []
+    graph = None
+    generators = iter(feature_generators)
+    for name in node_features:
+        if name == NODE2VEC:
+            features_filename = os.path.join(cnf_dir, instance_id + f'.node2vec{embedding_backend.dim}.npy')
+            if not os.path.exists(features_filename):
+                create_node2vec_features(cnf_dir, instance_id, embedding_backend)
+            features.append(np.load(features_filename))
+        else:
+            if graph is None:
+                graph = CNFGraph(np.array(g.edges(), dtype=np.int64).reshape((-1, 2)), len(g),
+                                 read_num_of_clauses(os.path.join(cnf_dir, instance_id)))
+            features.append(generate_node_features(graph, [next(generators)]))
+    return np.concatenate(features, axis=1).astype(np.float32)
+
 
+def dgcnn_pickle_extension(node_features: list):
+    # Graphs pickled with other node features than Node2Vec are kept apart
+    return ".dgcnn.pickled" if node_features == [NODE2VEC] else f".{'+'.join(node_features)}.dgcnn.pickled"
 
-def generate_dgcnn_pickled_data(model_output_dir: str, cnf_dir: str, instance_ids: list, splits: dict, sortpooling_k: IntOrFloat):
+
+def generate_dgcnn_pickled_data(model_output_dir: str, cnf_dir: str, instance_ids: list, splits: dict, sortpooling_k: IntOrFloat,
+                                embedding_backend: EmbeddingBackend = None, node_features=NODE2VEC):
+    node_features = parse_node_features(node_features)
+    feature_generators = create_node_feature_generators(node_features)
+    if NODE2VEC in node_features and embedding_backend is None:
+        embedding_backend = create_embedding_backend()
+    pickle_ext = dgcnn_pickle_extension(node_features)
     print('Pickling data')
 
     time_start = timer()
@@ -211,7 +290,7 @@ def generate_dgcnn_pickled_data(model_output_dir: str, cnf_dir: str, instance_id
         instance_id = instance_ids[i]
 
         # Check if a graph is already pickled
-        pickle_file = os.path.join(cnf_dir, instance_id + ".dgcnn.pickled")
+        pickle_file = os.path.join(cnf_dir, instance_id + pickle_ext)
         os.makedirs(os.path.dirname(pickle_file), exist_ok=True)
 
         if os.path.exists(pickle_file):
@@ -248,18 +327,18 @@ def generate_dgcnn_pickled_data(model_output_dir: str, cnf_dir: str, instance_id
             assert len(g) == n
 
             # Load feature data
-            features_filename = os.path.join(cnf_dir, instance_id + '.node2vec64.npy')
-            if not os.path.exists(features_filename):
-                create_node2vec_features(cnf_dir, instance_id)
-            node_features = np.load(features_filename)
+            instance_features = create_dgcnn_node_features(cnf_dir, instance_id, g, node_features, feature_generators,
+                                                           embedding_backend)
 
             # Create the graph
-            gnn_graph = GNNGraph(g, l, node_tags, node_features)
+            gnn_graph = GNNGraph(g, l, node_tags, instance_features)
             num_nodes_l.append(gnn_graph.num_nodes)
 
             # Pickle the graph for next loading
             with open(pickle_file, "wb") as pickle_f:
                 pkl.dump(gnn_graph, pickle_f)
+            with open(pickle_file + NUM_EDGES_EXT, "w") as num_edges_f:
+                num_edges_f.write(str(gnn_graph.num_edges))
 
             # Pickle the current version of metadata
             with open(metadata_filename, "wb") as meta_f:
@@ -290,23 +369,117 @@ def generate_dgcnn_pickled_data(model_output_dir: str, cnf_dir: str, instance_id
         sortpooling_k = max(10, sortpooling_k)
 
     edge_feat_dim = 0
-    attr_dim = 64
+    attr_dim = sum(generator.dim for generator in feature_generators)
+    if NODE2VEC in node_features:
+        attr_dim += embedding_backend.dim
     print(f'K used in SortPooling is: {sortpooling_k}')
 
     return num_class, feat_dim, edge_feat_dim, attr_dim, sortpooling_k
 
 
-def generate_cnf_datasets_for_training(root_dir, csv_file_x, csv_file_y):
-    trainset = CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Train")
-    valset = CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Validation")
-    trainvalset = CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Train+Validation")
+def generate_cnf_datasets_for_training(root_dir, csv_file_x, csv_file_y, embedding_backend=None, node_features=NODE2VEC,
+                                       graph_cache=None):
+    trainset = CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Train", embedding_backend=embedding_backend,
+                                  node_features=node_features, graph_cache=graph_cache)
+    valset = CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Validation", embedding_backend=embedding_backend,
+                                node_features=node_features, graph_cache=graph_cache)
+    trainvalset = CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Train+Validation",
+                                     embedding_backend=embedding_backend, node_features=node_features,
+                                     graph_cache=graph_cache)
     return trainset, valset, trainvalset
 
 
-def generate_cnf_datasets_for_testing(root_dir, csv_file_x, csv_file_y):
-    return CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Test")
-
-
-def generate_cnf_datasets(root_dir, csv_file_x, csv_file_y):
-    return generate_cnf_datasets_for_training(root_dir, csv_file_x, csv_file_y), \
-           generate_cnf_datasets_for_testing(root_dir, csv_file_x, csv_file_y)
+def generate_cnf_datasets_for_testing(root_dir, csv_file_x, csv_file_y, embedding_backend=None, node_features=NODE2VEC,
+                                      graph_cache=None):
+    return CNFDatasetNode2Vec(csv_file_x, csv_file_y, root_dir, "Test", embedding_backend=embedding_backend,
+                              node_features=node_features, graph_cache=graph_cache)
+
+
+def generate_cnf_datasets(root_dir, csv_file_x, csv_file_y, embedding_backend=None, node_features=NODE2VEC,
+                          graph_cache=None):
+    return generate_cnf_datasets_for_training(root_dir, csv_file_x, csv_file_y, embedding_backend, node_features,
+                                              graph_cache), \
+           generate_cnf_datasets_for_testing(root_dir, csv_file_x, csv_file_y, embedding_backend, node_features,
+                                             graph_cache)
+
+
+def source_files_signature(filenames: list):
+    return [(filename, os.path.getsize(filename), os.path.getmtime(filename)) for filename in filenames]
+
+
+def generate_graph_store(root_dir: str, datasets: list, rebuild=False):
+    """
+        Packs the graphs, node features and labels of all datasets into a single memory-mapped graph store and
+        switches the datasets to it. The store is rebuilt only when the instances or their files change.
+    """
+    features = f"{datasets[0].hidden_features_type}{datasets[0].hidden_features_dim}"
+    filename = os.path.join(root_dir, f"{features}.graphstore")
+
+    # Every instance is stored once, even if it is in more datasets
+    records = {}
+    for dataset in datasets:
+        for item in range(len(dataset)):
+            instance_id = dataset.csv_data_x['instance_id'][dataset.indices[item]]
+            records.setdefault(instance_id, (dataset, item))
+    instance_ids = sorted(records.keys())
+
+    print('\nChecking the graph store...')
+    sources = [source_files_signature(records[instance_id][0].graph_store_sources(records[instance_id][1]))
+               for instance_id in instance_ids]
+    store_hash = graph_store_hash(features, instance_ids, sources)
+    graph_store = None if rebuild else open_graph_store(filename, store_hash)
+
+    if graph_store is None:
+        print(f'Building the graph store {filename}...')
+        time_start = timer()
+        writer = GraphStoreWriter(filename, datasets[0].hidden_features_dim, datasets[0].num_classes, store_hash,
+                                  {"features": features})
+        for instance_id in tqdm(instance_ids, unit='graph'):
+            dataset, item = records[instance_id]
+            _, edges, node_features, labels = dataset.graph_store_record(item)
+            writer.add(instance_id, edges, node_features, labels)
+        writer.close()
+        graph_store = open_graph_store(filename)
+        print(f"Graph store with {len(graph_store)} graphs built in {timer() - time_start:.2f}s")
+
+    for dataset in datasets:
+        dataset.use_graph_store(graph_store)
+
+    return graph_store
+
+
+def generate_dgcnn_graph_store(cnf_dir: str, instance_ids: list, node_features=NODE2VEC, rebuild=False):
+    """
+        Packs the pickled DGCNN graphs into a single memory-mapped graph store, which is read by load_next_batch
+        instead of the pickles.
+    """
+    node_features = parse_node_features(node_features)
+    pickle_ext = dgcnn_pickle_extension(node_features)
+    filename = os.path.join(cnf_dir, f"dgcnn.{'+'.join(node_features)}.graphstore")
+
+    print('\nChecking the DGCNN graph store...')
+    pickle_files = [os.path.join(cnf_dir, instance_id + pickle_ext) for instance_id in instance_ids]
+    store_hash = graph_store_hash("dgcnn", list(instance_ids), source_files_signature(pickle_files))
+    graph_store = None if rebuild else open_graph_store(filename, store_hash)
+    if graph_store is not None:
+        return graph_store
+
+    print(f'Building the DGCNN graph store {filename}...')
+    time_start = timer()
+    writer = None
+    for instance_id, pickle_file in tqdm(list(zip(instance_ids, pickle_files)), unit='graph'):
+        with open(pickle_file, "rb") as pickle_f:
+            gnn_graph = pkl.load(pickle_f)
+        if writer is None:
+            writer = GraphStoreWriter(filename, gnn_graph.node_features.shape[1], len(gnn_graph.labels), store_hash,
+                                      {"features": "+".join(node_features)})
+        writer.add(instance_id, np.asarray(gnn_graph.edge_pairs, dtype=np.int32).reshape((-1, 2)),
+                   gnn_graph.node_features, np.asarray(gnn_graph.labels, dtype=np.float32),
+                   node_tags=np.asarray(gnn_graph.node_tags), node_degrees=np.asarray(gnn_graph.degs))
+    if writer is None:
+        return None
+    writer.close()
+
+    graph_store = open_graph_store(filename)
+    print(f"DGCNN graph store with {len(graph_store)} graphs built in {timer() - time_start:.2f}s")
+    return graph_store
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+def dgl_graph_nbytes(graph) -> int:
+    """
+        Approximate memory of a DGL graph with its node features: int64 source and destination ids plus the data of
+        every node feature.
+    """
+    nbytes = 2 * 8 * graph.number_of_edges()
+    for value in graph.ndata.values():
+        if hasattr(value, 'nbytes'):
+            nbytes += value.nbytes
+        else:
+            nbytes += value.element_size() * value.nelement()
+    return int(nbytes)
+
+
+class GraphCache(object):
+    """
+        In-process LRU cache of deserialized graphs with a budget in bytes. Items larger than max_item_fraction of
+        the budget are never admitted, so a few giant instances cannot push out all the small ones, which then stay
+        resident across epochs. Hits, misses and evictions are counted until reset_statistics is called.
+    """
+    def __init__(self, max_bytes: int, max_item_fraction=0.25):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = int(max_item_fraction * max_bytes)
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        if key not in self.items:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return self.items[key][0]
+
+    def put(self, key, value, nbytes: int):
+        if key in self.items:
+            self.bytes -= self.items.pop(key)[1]
+        if nbytes > self.max_item_bytes:
+            self.rejections += 1
+            return
+
+        # Evict the least recently used items until the new item fits
+        while self.bytes + nbytes > self.max_bytes and len(self.items) > 0:
+            _, (_, evicted_nbytes) = self.items.popitem(last=False)
+            self.bytes -= evicted_nbytes
+            self.evictions += 1
+
+        self.items[key] = (value, nbytes)
+        self.bytes += nbytes
+
+    def clear(self):
+        self.items.clear()
+        self.bytes = 0
+
+    def statistics(self) -> dict:
+        accesses = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / accesses if accesses > 0 else np.nan,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "items": len(self.items),
+            "bytes": self.bytes,
+        }
+
+    def __str__(self):
+        stats = self.statistics()
+        return (f"Graph cache: {stats['hits']} hits, {stats['misses']} misses ({100 * stats['hit_rate']:.1f}% hit rate), " +
+                f"{stats['evictions']} evictions, {stats['rejections']} too large; " +
+                f"{stats['items']} graphs in {stats['bytes'] / (1024 * 1024):.1f}MB of " +
+                f"{self.max_bytes / (1024 * 1024):.1f}MB")
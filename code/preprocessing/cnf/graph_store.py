@@ -0,0 +1,223 @@
+import os
+import json
+import shutil
+import hashlib
+import struct
+
+import numpy as np
+
+GRAPH_STORE_MAGIC = b'GSTR'
+GRAPH_STORE_VERSION = 1
+# magic, version, length of the JSON header
+GRAPH_STORE_PREAMBLE = struct.Struct('<4sIQ')
+GRAPH_STORE_ALIGNMENT = 64
+
+# Per-graph offsets into the concatenated arrays, like the row offsets of a CSR matrix
+OFFSET_SECTIONS = ["node_offsets", "edge_offsets"]
+DATA_SECTIONS = {
+    "edges": np.int32,
+    "node_features": np.float32,
+    "labels": np.float32,
+    "node_tags": np.int32,
+    "node_degrees": np.int32,
+}
+OPTIONAL_SECTIONS = ["node_tags", "node_degrees"]
+
+
+def graph_store_hash(*parts) -> str:
+    """
+        Hash of everything a graph store is built from, so a stale store can be detected without reading it.
+    """
+    sha = hashlib.sha1()
+    sha.update(f"{GRAPH_STORE_VERSION}".encode())
+    for part in parts:
+        sha.update(b'\0')
+        sha.update(str(part).encode())
+    return sha.hexdigest()
+
+
+def _align(offset: int):
+    return (offset + GRAPH_STORE_ALIGNMENT - 1) // GRAPH_STORE_ALIGNMENT * GRAPH_STORE_ALIGNMENT
+
+
+class GraphStoreWriter(object):
+    """
+        Writes graphs one by one into a single packed file. Every section is streamed into its own temporary file
+        and the sections are put together behind the header in close(), so the store is renamed into place only when
+        it is complete.
+    """
+    def __init__(self, filename: str, node_feature_dim: int, label_dim: int, store_hash: str, metadata: dict = None):
+        self.filename = filename
+        self.node_feature_dim = node_feature_dim
+        self.label_dim = label_dim
+        self.store_hash = store_hash
+        self.metadata = metadata if metadata is not None else {}
+        self.instance_ids = []
+        self.node_offsets = [0]
+        self.edge_offsets = [0]
+        self.optional_sections = None
+        self.section_files = {name: open(self.section_filename(name), 'wb') for name in DATA_SECTIONS}
+
+    def section_filename(self, name: str):
+        return f"{self.filename}.{name}.tmp"
+
+    def add(self, instance_id: str, edges: np.ndarray, node_features: np.ndarray, labels: np.ndarray,
+            node_tags: np.ndarray = None, node_degrees: np.ndarray = None):
+        num_nodes = node_features.shape[0]
+        if node_features.shape[1] != self.node_feature_dim:
+            raise ValueError(f"Instance {instance_id} has {node_features.shape[1]} node features instead of " +
+                             f"{self.node_feature_dim}")
+
+        optional = {"node_tags": node_tags, "node_degrees": node_degrees}
+        present = [name for name in OPTIONAL_SECTIONS if optional[name] is not None]
+        if self.optional_sections is None:
+            self.optional_sections = present
+        elif self.optional_sections != present:
+            raise ValueError(f"Instance {instance_id} has sections {present} instead of {self.optional_sections}")
+
+        arrays = {
+            "edges": np.asarray(edges).reshape((-1, 2)),
+            "node_features": node_features,
+            "labels": np.asarray(labels).reshape((1, self.label_dim)),
+        }
+        arrays.update({name: np.asarray(optional[name]).reshape(num_nodes) for name in present})
+        for name, array in arrays.items():
+            self.section_files[name].write(np.ascontiguousarray(array, dtype=DATA_SECTIONS[name]).tobytes())
+
+        self.instance_ids.append(instance_id)
+        self.node_offsets.append(self.node_offsets[-1] + num_nodes)
+        self.edge_offsets.append(self.edge_offsets[-1] + len(arrays["edges"]))
+
+    def close(self):
+        for f in self.section_files.values():
+            f.close()
+
+        num_graphs = len(self.instance_ids)
+        shapes = {
+            "node_offsets": (num_graphs + 1,),
+            "edge_offsets": (num_graphs + 1,),
+            "edges": (self.edge_offsets[-1], 2),
+            "node_features": (self.node_offsets[-1], self.node_feature_dim),
+            "labels": (num_graphs, self.label_dim),
+        }
+        for name in self.optional_sections or []:
+            shapes[name] = (self.node_offsets[-1],)
+        dtypes = {name: np.dtype(np.int64) for name in OFFSET_SECTIONS}
+        dtypes.update({name: np.dtype(dtype) for name, dtype in DATA_SECTIONS.items()})
+
+        # The header size depends on the offsets written into it, so the offsets are relative to the data start
+        sections = {}
+        offset = 0
+        for name, shape in shapes.items():
+            sections[name] = {"offset": offset, "dtype": dtypes[name].str, "shape": list(shape)}
+            offset = _align(offset + int(np.prod(shape)) * dtypes[name].itemsize)
+
+        header = json.dumps({
+            "hash": self.store_hash,
+            "num_graphs": num_graphs,
+            "instance_ids": self.instance_ids,
+            "metadata": self.metadata,
+            "sections": sections,
+        }).encode()
+        data_start = _align(GRAPH_STORE_PREAMBLE.size + len(header))
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(GRAPH_STORE_PREAMBLE.pack(GRAPH_STORE_MAGIC, GRAPH_STORE_VERSION, len(header)))
+            f.write(header)
+            for name in shapes:
+                f.seek(data_start + sections[name]["offset"])
+                if name == "node_offsets":
+                    f.write(np.array(self.node_offsets, dtype=np.int64).tobytes())
+                elif name == "edge_offsets":
+                    f.write(np.array(self.edge_offsets, dtype=np.int64).tobytes())
+                else:
+                    with open(self.section_filename(name), 'rb') as section:
+                        shutil.copyfileobj(section, f, 1 << 24)
+            f.truncate(data_start + offset)
+
+        for name in DATA_SECTIONS:
+            os.remove(self.section_filename(name))
+        os.replace(tmp_filename, self.filename)
+
+
+class GraphStore(object):
+    """
+        Read side of a packed graph store. The file is opened once and every section is memory-mapped, so the
+        arrays of a graph are zero-copy slices. The maps are copy-on-write, so the slices can be handed to torch.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, version, header_length = GRAPH_STORE_PREAMBLE.unpack(f.read(GRAPH_STORE_PREAMBLE.size))
+            if magic != GRAPH_STORE_MAGIC:
+                raise ValueError(f"Not a graph store: {filename}")
+            if version != GRAPH_STORE_VERSION:
+                raise ValueError(f"Unsupported graph store version {version} in {filename}, " +
+                                 f"expected {GRAPH_STORE_VERSION}")
+            header = json.loads(f.read(header_length).decode())
+        data_start = _align(GRAPH_STORE_PREAMBLE.size + header_length)
+
+        self.store_hash = header["hash"]
+        self.num_graphs = header["num_graphs"]
+        self.instance_ids = header["instance_ids"]
+        self.metadata = header["metadata"]
+        self.index = {instance_id: row for row, instance_id in enumerate(self.instance_ids)}
+
+        self.sections = {}
+        for name, section in header["sections"].items():
+            shape = tuple(section["shape"])
+            if int(np.prod(shape)) == 0:
+                self.sections[name] = np.empty(shape, dtype=np.dtype(section["dtype"]))
+            else:
+                # Plain ndarray views of the maps, code such as gnn_lib checks for the exact np.ndarray type
+                self.sections[name] = np.asarray(np.memmap(filename, dtype=np.dtype(section["dtype"]), mode='c',
+                                                           offset=data_start + section["offset"], shape=shape))
+        self.node_offsets = self.sections["node_offsets"]
+        self.edge_offsets = self.sections["edge_offsets"]
+
+    def __len__(self):
+        return self.num_graphs
+
+    def __contains__(self, instance_id: str):
+        return instance_id in self.index
+
+    def has_section(self, name: str):
+        return name in self.sections
+
+    def num_nodes(self, row: int) -> int:
+        return int(self.node_offsets[row + 1] - self.node_offsets[row])
+
+    def num_edges(self, row: int) -> int:
+        return int(self.edge_offsets[row + 1] - self.edge_offsets[row])
+
+    def edges(self, row: int) -> np.ndarray:
+        return self.sections["edges"][self.edge_offsets[row]:self.edge_offsets[row + 1]]
+
+    def node_features(self, row: int) -> np.ndarray:
+        return self.sections["node_features"][self.node_offsets[row]:self.node_offsets[row + 1]]
+
+    def node_tags(self, row: int) -> np.ndarray:
+        return self.sections["node_tags"][self.node_offsets[row]:self.node_offsets[row + 1]]
+
+    def node_degrees(self, row: int) -> np.ndarray:
+        return self.sections["node_degrees"][self.node_offsets[row]:self.node_offsets[row + 1]]
+
+    def labels(self, row: int) -> np.ndarray:
+        return self.sections["labels"][row]
+
+
+def open_graph_store(filename: str, store_hash: str = None):
+    """
+        Opens a graph store, or returns None if it does not exist or was built from different data.
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        store = GraphStore(filename)
+    except ValueError as e:
+        print(e)
+        return None
+    if store_hash is not None and store.store_hash != store_hash:
+        return None
+    return store
@@ -0,0 +1,170 @@
+import os
+import resource
+import sqlite3
+import sys
+from multiprocessing import Pool
+from timeit import default_timer as timer
+
+import pandas as pd
+from tqdm import tqdm
+
+from ..os.arguments import cmd_args
+from ..cnf.generate_data import create_node2vec_features
+from ..cnf.embedding_backends import EmbeddingBackend, create_embedding_backend
+from ..cnf.edgelist import edgelist_path
+from ..cnf.CNFDatasetNode2Vec import is_valid_features_file
+from ..cnf.process_cnf_attributes import is_unsolvable
+
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class EmbeddingJobQueue(object):
+    """
+        On-disk queue of Node2Vec jobs. Every state change is committed immediately, so a crashed run is resumed
+        from the jobs that have not finished yet.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                                    "instance_id TEXT PRIMARY KEY, "
+                                    "priority INTEGER NOT NULL DEFAULT 0, "
+                                    "status TEXT NOT NULL, "
+                                    "attempts INTEGER NOT NULL DEFAULT 0, "
+                                    "wall_time REAL, "
+                                    "peak_memory_mb REAL, "
+                                    "error TEXT)")
+
+    def add(self, instance_id: str, priority=0):
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO jobs (instance_id, priority, status) VALUES (?, ?, ?)",
+                                    (instance_id, priority, PENDING))
+
+    def status(self, instance_id: str):
+        row = self.connection.execute("SELECT status FROM jobs WHERE instance_id = ?", (instance_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def reset(self, instance_id: str):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = ?, attempts = 0 WHERE instance_id = ?",
+                                    (PENDING, instance_id))
+
+    def mark_done(self, instance_id: str, wall_time=None, peak_memory_mb=None):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, wall_time = ?, "
+                                    "peak_memory_mb = ?, error = NULL WHERE instance_id = ?",
+                                    (DONE, wall_time, peak_memory_mb, instance_id))
+
+    def mark_failed(self, instance_id: str, error: str, wall_time=None, peak_memory_mb=None):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, wall_time = ?, "
+                                    "peak_memory_mb = ?, error = ? WHERE instance_id = ?",
+                                    (FAILED, wall_time, peak_memory_mb, error, instance_id))
+
+    def remaining(self, max_attempts: int):
+        rows = self.connection.execute("SELECT instance_id FROM jobs WHERE status != ? AND attempts < ? "
+                                       "ORDER BY priority DESC", (DONE, max_attempts)).fetchall()
+        return [row[0] for row in rows]
+
+    def to_dataframe(self):
+        return pd.read_sql_query("SELECT * FROM jobs ORDER BY wall_time DESC", self.connection)
+
+    def close(self):
+        self.connection.close()
+
+
+def embed_instance(job):
+    cnf_dir, instance_id, embedding_backend = job
+
+    time_start = timer()
+    error = None
+    try:
+        create_node2vec_features(cnf_dir, instance_id, embedding_backend)
+    except (Exception, SystemExit) as e:
+        error = repr(e)
+    wall_time = timer() - time_start
+
+    # Every job runs in a fresh worker process, so the peak RSS of the process is the peak of this instance
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    ru_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_memory_mb = ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else ru_maxrss / 1024
+
+    return instance_id, error, wall_time, peak_memory_mb
+
+
+def generate_node2vec_features(csv_filename: str, csv_labels: str, cnf_dir: str, num_workers=1, max_attempts=3,
+                               embedding_backend: EmbeddingBackend = None):
+    if embedding_backend is None:
+        embedding_backend = create_embedding_backend()
+    features_dim = embedding_backend.dim
+
+    data = pd.read_csv(csv_filename)
+    ys = pd.read_csv(csv_labels) if csv_labels is not None and os.path.exists(csv_labels) else None
+    queue = EmbeddingJobQueue(os.path.join(cnf_dir, f"node2vec{features_dim}_jobs.sqlite"))
+
+    # Enqueue the instances and skip the ones that already have valid features
+    for instance_id, split in zip(data["instance_id"], data["split"]):
+        if split == "None" or (ys is not None and is_unsolvable(ys, instance_id)):
+            continue
+
+        edgelist_filename = edgelist_path(cnf_dir, instance_id, embedding_backend.reads_binary_edgelists,
+                                          missing_ok=True)
+        priority = os.path.getsize(edgelist_filename) if os.path.exists(edgelist_filename) else 0
+        queue.add(instance_id, priority)
+
+        features_filename = os.path.join(cnf_dir, instance_id + f".node2vec{features_dim}.npy")
+        if is_valid_features_file(features_filename, features_dim):
+            if queue.status(instance_id) != DONE:
+                queue.mark_done(instance_id)
+        elif queue.status(instance_id) == DONE:
+            queue.reset(instance_id)
+
+    # The largest graphs are scheduled first
+    jobs = [(cnf_dir, instance_id, embedding_backend) for instance_id in queue.remaining(max_attempts)]
+    print(f"\nEmbedding {len(jobs)} instances with Node2Vec ({embedding_backend.name}) using {num_workers} workers...")
+
+    with Pool(processes=num_workers, maxtasksperchild=1) as pool:
+        pbar = tqdm(pool.imap_unordered(embed_instance, jobs), total=len(jobs), unit="graph")
+        for instance_id, error, wall_time, peak_memory_mb in pbar:
+            if error is None:
+                queue.mark_done(instance_id, wall_time, peak_memory_mb)
+            else:
+                queue.mark_failed(instance_id, error, wall_time, peak_memory_mb)
+                print(f"\nFailed to embed {instance_id}: {error}")
+            pbar.set_description(f"{instance_id}: {wall_time:.2f}s, {peak_memory_mb:.0f}MB")
+
+    # Keep the statistics next to the queue, so the expensive formulas can be inspected
+    stats = queue.to_dataframe()
+    stats.to_csv(os.path.join(cnf_dir, f"node2vec{features_dim}_jobs.csv"), index=False)
+    queue.close()
+
+    timed = stats[stats["wall_time"].notna()]
+    print(f"Embedded {len(stats[stats['status'] == DONE])}/{len(stats)} instances, " +
+          f"{len(stats[stats['status'] == FAILED])} failed")
+    if len(timed) > 0:
+        print(f"Total wall time: {timed['wall_time'].sum():.2f}s, " +
+              f"maximum peak memory: {timed['peak_memory_mb'].max():.0f}MB")
+        print("Most expensive instances:")
+        for _, row in timed.head(10).iterrows():
+            print(f"\t{row['wall_time']:10.2f}s {row['peak_memory_mb']:10.0f}MB  {row['instance_id']}")
+
+    return stats
+
+
+def main():
+    generate_node2vec_features(os.path.join(cmd_args.cnf_dir, "splits.csv"),
+                               os.path.join(cmd_args.cnf_dir, "all_data_y.csv"),
+                               cmd_args.cnf_dir,
+                               max(1, cmd_args.embedding_workers),
+                               embedding_backend=create_embedding_backend(cmd_args.embedding_backend,
+                                                                          dim=cmd_args.embedding_dim,
+                                                                          num_epochs=cmd_args.embedding_epochs,
+                                                                          walk_length=cmd_args.embedding_walk_length))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+NODE2VEC = "node2vec"
+
+
+def read_num_of_clauses(cnf_filename: str):
+    """
+        Returns the number of clauses from the "p cnf" line of a DIMACS file, or None if it cannot be read.
+    """
+    if not os.path.exists(cnf_filename):
+        return None
+    with open(cnf_filename, 'r') as f:
+        for line in f:
+            if line.startswith('p cnf'):
+                return int(line.split()[3])
+            if line.strip() and not line.startswith('c'):
+                break
+    return None
+
+
+class CNFGraph(object):
+    """
+        Literal-clause graph of a CNF formula with the node order used by the parsers: clauses 0..C-1, positive
+        literals C..C+V-1 and negative literals C+V..C+2V-1. Self-loops are dropped and every edge is kept in both
+        directions. If the number of clauses is not given, it is inferred from the edges.
+    """
+    def __init__(self, edges: np.ndarray, num_nodes: int, num_of_clauses: int = None):
+        edges = np.asarray(edges)
+        src = edges[:, 0].astype(np.int64)
+        dst = edges[:, 1].astype(np.int64)
+        mask = src != dst
+        # Undirected edgelists list every edge once
+        src, dst = np.concatenate([src[mask], dst[mask]]), np.concatenate([dst[mask], src[mask]])
+
+        if num_of_clauses is None:
+            # Every edge connects a clause with a literal and clauses have the smallest indices
+            num_of_clauses = int(np.minimum(src, dst).max()) + 1 if len(src) > 0 else 0
+        if (num_nodes - num_of_clauses) % 2 != 0:
+            raise ValueError(f"A graph with {num_nodes} nodes and {num_of_clauses} clauses is not a literal-clause graph")
+
+        self.num_nodes = num_nodes
+        self.num_of_clauses = num_of_clauses
+        self.num_of_vars = (num_nodes - num_of_clauses) // 2
+
+        adjacency = sparse.coo_matrix((np.ones(len(src), dtype=np.float32), (src, dst)), shape=(num_nodes, num_nodes))
+        self.adjacency = adjacency.tocsr()
+        # Duplicated edges are summed up by the conversion, the graph is unweighted
+        self.adjacency.data[:] = 1
+        self.degrees = np.diff(self.adjacency.indptr).astype(np.float32)
+
+    def node_types(self):
+        """
+            0 for clauses, 1 for positive and 2 for negative literals.
+        """
+        types = np.zeros(self.num_nodes, dtype=np.int64)
+        types[self.num_of_clauses:self.num_of_clauses + self.num_of_vars] = 1
+        types[self.num_of_clauses + self.num_of_vars:] = 2
+        return types
+
+
+class NodeFeatureGenerator(ABC):
+    """
+        Computes a (num_nodes, dim) float32 feature matrix of a CNFGraph. Unlike embeddings, the features are
+        computed with a few sparse matrix operations, so they take seconds even for large instances.
+    """
+    name = None
+    dim = 1
+
+    @abstractmethod
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        pass
+
+
+class DegreeFeatures(NodeFeatureGenerator):
+    name = "degree"
+    dim = 1
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        return np.log1p(graph.degrees).reshape((-1, 1))
+
+
+class ClauseLengthFeatures(NodeFeatureGenerator):
+    """
+        Length of the clause for clause nodes and the average length of the clauses containing the literal for
+        literal nodes.
+    """
+    name = "clause_length"
+    dim = 1
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        lengths = np.zeros(graph.num_nodes, dtype=np.float32)
+        lengths[:graph.num_of_clauses] = graph.degrees[:graph.num_of_clauses]
+        neighbour_lengths = graph.adjacency @ lengths
+        mean_lengths = np.divide(neighbour_lengths, graph.degrees, out=np.zeros_like(lengths),
+                                 where=graph.degrees > 0)
+        features = np.where(np.arange(graph.num_nodes) < graph.num_of_clauses, lengths, mean_lengths)
+        return np.log1p(features).reshape((-1, 1))
+
+
+class PolarityFeatures(NodeFeatureGenerator):
+    """
+        Number of positive and negative literals for clause nodes, and number of positive and negative occurrences
+        of the variable for literal nodes.
+    """
+    name = "polarity"
+    dim = 2
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        c, v = graph.num_of_clauses, graph.num_of_vars
+        types = graph.node_types()
+        counts = np.zeros((graph.num_nodes, 2), dtype=np.float32)
+
+        # Clauses count their neighbours by literal type
+        indicators = np.stack([types == 1, types == 2], axis=1).astype(np.float32)
+        counts[:c] = (graph.adjacency[:c] @ indicators)
+
+        # Both literals of a variable get the occurrence counts of the positive and the negative literal
+        occurrences = np.stack([graph.degrees[c:c + v], graph.degrees[c + v:]], axis=1)
+        counts[c:c + v] = occurrences
+        counts[c + v:] = occurrences
+
+        return np.log1p(counts)
+
+
+class NodeTypeFeatures(NodeFeatureGenerator):
+    """
+        One-hot encoding of clause, positive literal and negative literal nodes.
+    """
+    name = "node_type"
+    dim = 3
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        return np.eye(3, dtype=np.float32)[graph.node_types()]
+
+
+class ClusteringFeatures(NodeFeatureGenerator):
+    """
+        The literal-clause graph is bipartite, so it has no triangles. The local clustering of a node is the
+        bipartite one (Latapy et al.): the average Jaccard similarity of the neighbourhoods of the node and the nodes
+        two hops away from it. The common neighbours are counted with A @ A on blocks of rows to bound the memory.
+    """
+    name = "clustering"
+    dim = 1
+
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        adjacency = graph.adjacency
+        degrees = graph.degrees
+        clustering = np.zeros(graph.num_nodes, dtype=np.float32)
+
+        for start in range(0, graph.num_nodes, self.block_size):
+            stop = min(start + self.block_size, graph.num_nodes)
+            common = (adjacency[start:stop] @ adjacency).tocoo()
+            rows = common.row + start
+            mask = rows != common.col
+            rows, cols, shared = rows[mask], common.col[mask], common.data[mask]
+
+            jaccard = shared / (degrees[rows] + degrees[cols] - shared)
+            sums = np.bincount(rows - start, weights=jaccard, minlength=stop - start)
+            counts = np.bincount(rows - start, minlength=stop - start)
+            clustering[start:stop] = np.divide(sums, counts, out=np.zeros(stop - start), where=counts > 0)
+
+        return clustering.reshape((-1, 1))
+
+
+class RandomProjectionFeatures(NodeFeatureGenerator):
+    """
+        A fixed random Gaussian projection propagated over the random walk matrix D^-1 A, similar to the first
+        steps of a random walk embedding but without any training.
+    """
+    name = "random_projection"
+    dim = 8
+
+    def __init__(self, num_steps=2, seed=0):
+        self.num_steps = num_steps
+        self.seed = seed
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        inverse_degrees = np.divide(1, graph.degrees, out=np.zeros_like(graph.degrees), where=graph.degrees > 0)
+        walk_matrix = sparse.diags(inverse_degrees) @ graph.adjacency
+
+        features = rng.standard_normal((graph.num_nodes, self.dim)).astype(np.float32) / np.sqrt(self.dim)
+        for _ in range(self.num_steps):
+            features = walk_matrix @ features
+        return features.astype(np.float32)
+
+
+class LaplacianFeatures(NodeFeatureGenerator):
+    """
+        Eigenvectors of the smallest non-trivial eigenvalues of the normalized Laplacian I - D^-1/2 A D^-1/2. They
+        are the largest eigenvectors of the shifted normalized adjacency I + D^-1/2 A D^-1/2, which ARPACK finds
+        quickly. The sign of every eigenvector is fixed, so the features are deterministic, and the unit eigenvectors
+        are scaled by sqrt(num_nodes), so their entries do not vanish on large graphs.
+    """
+    name = "laplacian"
+    dim = 8
+
+    def __init__(self, max_iterations=1000, tolerance=1e-4):
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+
+    def generate(self, graph: CNFGraph) -> np.ndarray:
+        n = graph.num_nodes
+        features = np.zeros((n, self.dim), dtype=np.float32)
+        # The first eigenvector is the trivial one, proportional to sqrt(degree)
+        k = min(self.dim + 1, n - 1)
+        if k <= 1:
+            return features
+
+        inverse_sqrt_degrees = np.divide(1, np.sqrt(graph.degrees), out=np.zeros_like(graph.degrees),
+                                         where=graph.degrees > 0)
+        normalized = sparse.diags(inverse_sqrt_degrees) @ graph.adjacency @ sparse.diags(inverse_sqrt_degrees)
+        shifted = sparse.identity(n, dtype=np.float32, format='csr') + normalized
+
+        if n <= 2048:
+            eigenvalues, eigenvectors = np.linalg.eigh(shifted.toarray())
+        else:
+            v0 = np.full(n, 1 / np.sqrt(n))
+            try:
+                eigenvalues, eigenvectors = sparse_linalg.eigsh(shifted, k=k, which='LA', v0=v0,
+                                                                maxiter=self.max_iterations, tol=self.tolerance)
+            except sparse_linalg.ArpackNoConvergence as e:
+                eigenvalues, eigenvectors = e.eigenvalues, e.eigenvectors
+
+        # Largest eigenvalues first, without the trivial eigenvector
+        order = np.argsort(-eigenvalues)[1:k]
+        eigenvectors = eigenvectors[:, order]
+        signs = np.sign(eigenvectors[np.argmax(np.abs(eigenvectors), axis=0), np.arange(eigenvectors.shape[1])])
+        signs[signs == 0] = 1
+        features[:, :eigenvectors.shape[1]] = eigenvectors * signs * np.sqrt(n)
+        return features
+
+
+NODE_FEATURE_GENERATORS = {
+    DegreeFeatures.name: DegreeFeatures,
+    ClauseLengthFeatures.name: ClauseLengthFeatures,
+    PolarityFeatures.name: PolarityFeatures,
+    NodeTypeFeatures.name: NodeTypeFeatures,
+    ClusteringFeatures.name: ClusteringFeatures,
+    RandomProjectionFeatures.name: RandomProjectionFeatures,
+    LaplacianFeatures.name: LaplacianFeatures,
+}
+
+
+def parse_node_features(node_features: str):
+    """
+        Splits a selection such as "degree+polarity+node2vec" into the feature names, checking each of them.
+    """
+    names = node_features.split('+')
+    available = [NODE2VEC] + list(NODE_FEATURE_GENERATORS.keys())
+    for name in names:
+        if name not in available:
+            raise ValueError(f'You have passed an unknown node feature: {name}. Available values are: {available}')
+    if len(set(names)) != len(names):
+        raise ValueError(f'Node features are selected more than once: {node_features}')
+    return names
+
+
+def create_node_feature_generators(names: list):
+    return [NODE_FEATURE_GENERATORS[name]() for name in names if name != NODE2VEC]
+
+
+def generate_node_features(graph: CNFGraph, generators: list) -> np.ndarray:
+    if len(generators) == 0:
+        return np.zeros((graph.num_nodes, 0), dtype=np.float32)
+    return np.concatenate([generator.generate(graph) for generator in generators], axis=1).astype(np.float32)
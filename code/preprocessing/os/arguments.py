@@ -32,6 +32,114 @@ cmd_opt.add_argument('-cnf_dir',
                      type=str,
                      default='~/Master-Thesis/INSTANCES',
                      help='Directory that contains CNF in DIMACS format. Default: ~/Master-Thesis/INSTANCES')
+cmd_opt.add_argument('-parser_workers',
+                     type=int,
+                     default=1,
+                     help='Number of worker processes used for converting DIMACS files to other formats. Default: 1')
+cmd_opt.add_argument('-edgelist_format',
+                     type=str,
+                     default='text',
+                     choices=['text', 'binary'],
+                     help='Edgelist output format. "binary" streams int32 edge pairs with bounded memory. Default: text')
+cmd_opt.add_argument('-embedding_workers',
+                     type=int,
+                     default=0,
+                     help='Number of worker processes of the Node2Vec embedding stage. ' +
+                          'If 0, embeddings are created on demand while preparing the datasets. Default: 0')
+cmd_opt.add_argument('-embedding_backend',
+                     type=str,
+                     default='graphvite',
+                     choices=['graphvite', 'cpu'],
+                     help='Backend used for training Node2Vec embeddings. Default: graphvite')
+cmd_opt.add_argument('-embedding_dim',
+                     type=int,
+                     default=64,
+                     help='Dimension of Node2Vec embeddings. Default: 64')
+cmd_opt.add_argument('-embedding_epochs',
+                     type=int,
+                     default=0,
+                     help='Number of Node2Vec training epochs. If 0, the default of the backend is used. Default: 0')
+cmd_opt.add_argument('-embedding_walk_length',
+                     type=int,
+                     default=40,
+                     help='Length of Node2Vec random walks. Default: 40')
+cmd_opt.add_argument('-node_features',
+                     type=str,
+                     default='node2vec',
+                     help='Node features of the graph models, joined with +, e.g. degree+polarity+node_type. ' +
+                          'Available values are: node2vec, degree, clause_length, polarity, node_type, clustering, ' +
+                          'random_projection and laplacian. Default: node2vec')
+cmd_opt.add_argument('-graph_store',
+                     action='store_true',
+                     help='Pack the graphs, node features and labels into a single memory-mapped graph store ' +
+                          'and read the batches from it')
+cmd_opt.add_argument('-graph_cache_mb',
+                     type=int,
+                     default=0,
+                     help='Memory budget in MB of the in-process LRU cache of loaded graphs. If 0, graphs are ' +
+                          'loaded from disk on every access. The cache is disabled with -num_workers. Default: 0')
+cmd_opt.add_argument('-num_workers',
+                     type=int,
+                     default=0,
+                     help='Number of worker processes loading and batching graphs for GCN and GAT. If 0, the ' +
+                          'batches are loaded in the training process, which can use -graph_cache_mb. Default: 0')
+cmd_opt.add_argument('-pin_memory',
+                     action='store_true',
+                     help='Load the batches into pinned memory, which speeds up copying them to a GPU')
+cmd_opt.add_argument('-prefetch_factor',
+                     type=int,
+                     default=2,
+                     help='Number of batches prefetched by every loading worker. Default: 2')
+cmd_opt.add_argument('-max_batch_edges',
+                     type=int,
+                     default=0,
+                     help='Maximum total number of edges in a training batch of GCN, GAT and DGCNN. Graphs of ' +
+                          'similar size are batched together under this budget. If 0, batches have a fixed number ' +
+                          'of graphs. Default: 0')
+cmd_opt.add_argument('-num_size_buckets',
+                     type=int,
+                     default=10,
+                     help='Number of graph size buckets used with -max_batch_edges. Default: 10')
+cmd_opt.add_argument('-val_batch_size',
+                     type=int,
+                     default=0,
+                     help='Maximum number of graphs in a validation batch of GCN and GAT. With -max_batch_edges, ' +
+                          'validation batches are also formed under the edge budget. If 0, the training batch size ' +
+                          'is used. Default: 0')
+cmd_opt.add_argument('-test_batch_size',
+                     type=int,
+                     default=0,
+                     help='Maximum number of graphs in a test batch of GCN and GAT. With -max_batch_edges, test ' +
+                          'batches are also formed under the edge budget. If 0, the training batch size is used. ' +
+                          'Default: 0')
+cmd_opt.add_argument('-validate_on_train_device',
+                     action='store_true',
+                     help='Validate GCN and GAT on the training device instead of moving the model to the CPU')
+cmd_opt.add_argument('-gc_threshold_mb',
+                     type=int,
+                     default=1024,
+                     help='Growth in MB of the host or GPU memory since the last garbage collection after which the ' +
+                          'training loops of GCN, GAT and DGCNN collect garbage. If 0, they collect after every ' +
+                          'batch. Default: 1024')
+cmd_opt.add_argument('-runtime_dedup',
+                     type=str,
+                     default='first',
+                     choices=['first', 'mean', 'min'],
+                     help='Runtime of an instance and solver that appear more than once in the SAT12 runtime ' +
+                          'tables: the first one, the mean or the minimum. all_data_y.csv is built again when it ' +
+                          'was built with another policy. Default: first')
+cmd_opt.add_argument('-cpu_budget',
+                     type=int,
+                     default=0,
+                     help='Number of CPU cores used by the RF model search, shared by the forests trained in ' +
+                          'parallel. If 0, all cores are used. Default: 0')
+cmd_opt.add_argument('-rf_selection',
+                     type=str,
+                     default='validation',
+                     choices=['validation', 'oob'],
+                     help='Model selection of RF. "validation" scores the forests on the validation set and retrains ' +
+                          'the best one on Train+Validation, "oob" grows the forests on Train+Validation, scores ' +
+                          'them from their out-of-bag predictions and keeps the best one. Default: validation')
 
 # DGCNN
 cmd_opt.add_argument('-mode', default='cpu', help='cpu/gpu')
@@ -59,6 +167,11 @@ cmd_opt.add_argument('-dropout', type=bool, default=False, help='whether add dro
 cmd_opt.add_argument('-print_auc', type=bool, default=False,
                      help='whether to print AUC (for binary classification only)')
 cmd_opt.add_argument('-extract_features', type=bool, default=False, help='whether to extract final graph features')
+cmd_opt.add_argument('-msg_average', type=int, default=0,
+                     help='whether to average the messages of the neighbours instead of summing them (0/1). Default: 0')
+cmd_opt.add_argument('-sparse_cache_mb', type=int, default=256,
+                     help='Memory budget in MB of the cache of per-graph DGCNN message passing matrices. If 0, ' +
+                          'they are built for every batch. Default: 256')
 
 cmd_args, _ = cmd_opt.parse_known_args()
 
@@ -0,0 +1,49 @@
+#ifndef BINARY_EDGELIST_WRITER_HPP
+#define BINARY_EDGELIST_WRITER_HPP
+
+#include <cstdint>
+#include <fstream>
+#include <string>
+#include <vector>
+
+namespace MasterThesis
+{
+
+// Header of the binary edgelist format. It is followed by num_of_edges pairs of int32 node indices.
+struct BinaryEdgelistHeader
+{
+    char magic[4];
+    std::uint32_t version;
+    std::int64_t num_of_nodes;
+    std::int64_t num_of_edges;
+};
+
+class BinaryEdgelistWriter
+{
+private:
+    std::string _output_file;
+    std::string _tmp_output_file;
+    std::ofstream _output;
+    std::vector<std::int32_t> _chunk;
+    std::size_t _chunk_size;
+    std::int64_t _num_of_nodes;
+    std::int64_t _num_of_edges;
+
+    void FlushChunk();
+    void WriteHeader();
+
+public:
+    static constexpr std::uint32_t Version = 1u;
+    static constexpr std::size_t DefaultChunkSize = 1u << 20;
+
+    BinaryEdgelistWriter(const std::string & base_dir, const std::string & file_name,
+                         const std::size_t chunk_size = DefaultChunkSize);
+
+    void SetNumberOfNodes(const std::int64_t num_of_nodes);
+    void AddEdge(const std::int32_t from, const std::int32_t to);
+    void Close();
+};
+
+}
+
+#endif // BINARY_EDGELIST_WRITER_HPP
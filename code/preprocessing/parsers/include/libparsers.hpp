@@ -3,5 +3,6 @@
 
 extern "C" int parse_dimacs_to_dgcnn_vcg(const char *base_dir, const char *file_name, const char *labels);
 extern "C" int parse_dimacs_to_edgelist(const char *base_dir, const char *file_name);
+extern "C" int parse_dimacs_to_binary_edgelist(const char *base_dir, const char *file_name);
 
 #endif // LIBPARSERS_H
@@ -1,6 +1,15 @@
 import ctypes
 import os
 
+import numpy as np
+
+
+# Header of the binary edgelist format written by `parse_dimacs_to_binary_edgelist`
+BINARY_EDGELIST_HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'), ('num_of_nodes', '<i8'),
+                                   ('num_of_edges', '<i8')])
+BINARY_EDGELIST_MAGIC = b'EDGB'
+BINARY_EDGELIST_VERSION = 1
+
 
 class ParsersLib(object):
     def __init__(self):
@@ -9,6 +18,7 @@ class ParsersLib(object):
 
         self.lib.parse_dimacs_to_dgcnn_vcg.restype = ctypes.c_int
         self.lib.parse_dimacs_to_edgelist.restype = ctypes.c_int
+        self.lib.parse_dimacs_to_binary_edgelist.restype = ctypes.c_int
 
     def parse_dimacs_to_dgcnn_vcg(self, base_dir: str, file_name: str, labels: str):
         arg0 = base_dir.encode('utf-8')
@@ -16,14 +26,70 @@ class ParsersLib(object):
         arg2 = labels.encode('utf-8')
 
         self.lib.parse_dimacs_to_dgcnn_vcg.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
-        self.lib.parse_dimacs_to_dgcnn_vcg(arg0, arg1, arg2)
+        return self.lib.parse_dimacs_to_dgcnn_vcg(arg0, arg1, arg2)
 
     def parse_dimacs_to_edgelist(self, base_dir, file_name):
         arg0 = base_dir.encode('utf-8')
         arg1 = file_name.encode('utf-8')
 
         self.lib.parse_dimacs_to_edgelist.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
-        self.lib.parse_dimacs_to_edgelist(arg0, arg1)
+        return self.lib.parse_dimacs_to_edgelist(arg0, arg1)
+
+    def parse_dimacs_to_binary_edgelist(self, base_dir, file_name):
+        arg0 = base_dir.encode('utf-8')
+        arg1 = file_name.encode('utf-8')
+
+        self.lib.parse_dimacs_to_binary_edgelist.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        return self.lib.parse_dimacs_to_binary_edgelist(arg0, arg1)
+
+
+def save_binary_edgelist(filename: str, chunks, num_of_nodes=None):
+    """
+        Writes (k, 2) int32 edge chunks to a binary edgelist file, going through a temporary file.
+        If the number of nodes is not given, it is computed as the maximum node index plus one.
+    """
+    tmp_filename = filename + '.tmp'
+    num_of_edges = 0
+    max_node = -1
+    header = np.zeros(1, dtype=BINARY_EDGELIST_HEADER)
+    header['magic'] = BINARY_EDGELIST_MAGIC
+    header['version'] = BINARY_EDGELIST_VERSION
+    with open(tmp_filename, 'wb') as f:
+        header.tofile(f)
+        for chunk in chunks:
+            chunk = np.ascontiguousarray(chunk, dtype=np.int32)
+            chunk.tofile(f)
+            num_of_edges += len(chunk)
+            if len(chunk) > 0:
+                max_node = max(max_node, int(chunk.max()))
+
+        header['num_of_nodes'] = max_node + 1 if num_of_nodes is None else num_of_nodes
+        header['num_of_edges'] = num_of_edges
+        f.seek(0)
+        header.tofile(f)
+    os.replace(tmp_filename, filename)
+
+    return int(header['num_of_nodes'][0]), num_of_edges
+
+
+def load_binary_edgelist(filename: str):
+    """
+        Memory-maps the binary edgelist file and returns the number of nodes and a (num_of_edges, 2) int32 array
+    """
+    header = np.fromfile(filename, dtype=BINARY_EDGELIST_HEADER, count=1)
+    if len(header) != 1 or header['magic'][0] != BINARY_EDGELIST_MAGIC:
+        raise ValueError(f'Not a binary edgelist file: {filename}')
+    if header['version'][0] != BINARY_EDGELIST_VERSION:
+        raise ValueError(f'Unsupported binary edgelist version {header["version"][0]} in file: {filename}')
+
+    num_of_nodes = int(header['num_of_nodes'][0])
+    num_of_edges = int(header['num_of_edges'][0])
+    if num_of_edges == 0:
+        return num_of_nodes, np.empty((0, 2), dtype=np.int32)
+
+    edges = np.memmap(filename, dtype=np.int32, mode='r', offset=BINARY_EDGELIST_HEADER.itemsize,
+                      shape=(num_of_edges, 2))
+    return num_of_nodes, edges
 
 
 dirname = os.path.dirname(os.path.realpath(__file__))
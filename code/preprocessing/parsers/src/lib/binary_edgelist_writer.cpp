@@ -0,0 +1,76 @@
+#include <filesystem>
+#include <iostream>
+
+#include "binary_edgelist_writer.hpp"
+
+namespace MasterThesis
+{
+
+BinaryEdgelistWriter::BinaryEdgelistWriter(const std::string & base_dir, const std::string & file_name,
+                                           const std::size_t chunk_size)
+    : _chunk_size{chunk_size}
+    , _num_of_nodes{0}
+    , _num_of_edges{0}
+{
+    using namespace std::string_literals;
+    namespace fs = std::filesystem;
+
+    if (!fs::exists(base_dir))
+    {
+        fs::create_directories(base_dir);
+    }
+
+    _output_file = base_dir + "/"s + file_name;
+    // Write to a temporary file first, so a killed run never leaves a half-written edgelist behind
+    _tmp_output_file = _output_file + ".tmp"s;
+
+    std::cout << "Streaming parsed data to file: " << _output_file << std::endl;
+    _output.open(_tmp_output_file, std::ios::binary | std::ios::trunc);
+    _chunk.reserve(2 * _chunk_size);
+
+    // Reserve space for the header, the number of edges is known only when the whole file is parsed
+    WriteHeader();
+}
+
+void BinaryEdgelistWriter::SetNumberOfNodes(const std::int64_t num_of_nodes)
+{
+    _num_of_nodes = num_of_nodes;
+}
+
+void BinaryEdgelistWriter::AddEdge(const std::int32_t from, const std::int32_t to)
+{
+    _chunk.push_back(from);
+    _chunk.push_back(to);
+    ++_num_of_edges;
+
+    if (_chunk.size() >= 2 * _chunk_size)
+    {
+        FlushChunk();
+    }
+}
+
+void BinaryEdgelistWriter::FlushChunk()
+{
+    _output.write(reinterpret_cast<const char *>(_chunk.data()), _chunk.size() * sizeof(std::int32_t));
+    _chunk.clear();
+}
+
+void BinaryEdgelistWriter::WriteHeader()
+{
+    BinaryEdgelistHeader header{{'E', 'D', 'G', 'B'}, Version, _num_of_nodes, _num_of_edges};
+    _output.seekp(0);
+    _output.write(reinterpret_cast<const char *>(&header), sizeof(header));
+}
+
+void BinaryEdgelistWriter::Close()
+{
+    namespace fs = std::filesystem;
+
+    FlushChunk();
+    WriteHeader();
+    _output.close();
+
+    fs::rename(_tmp_output_file, _output_file);
+}
+
+}
@@ -30,19 +30,25 @@ void EdgelistGraph::SaveToFile(const std::string & base_dir, const std::string &
     }
 
     auto output_file = base_dir + "/"s + file_name;
+    // Write to a temporary file first, so a killed run never leaves a half-written edgelist behind
+    auto tmp_output_file = output_file + ".tmp"s;
 
     std::cout << "Saving parsed data to file: " << output_file << std::endl;
-    std::ofstream output{ output_file };
-
-    for (auto i = 0u; i < _nodes.size(); ++i)
     {
-        auto g_node = std::move(_nodes[i]);
-        auto & neighbours = g_node->Neighbours();
-        std::for_each(std::cbegin(neighbours), std::cend(neighbours), [&](const auto neighbour)
+        std::ofstream output{ tmp_output_file };
+
+        for (auto i = 0u; i < _nodes.size(); ++i)
         {
-            output << i << " " << neighbour << std::endl;
-        });
+            auto g_node = std::move(_nodes[i]);
+            auto & neighbours = g_node->Neighbours();
+            std::for_each(std::cbegin(neighbours), std::cend(neighbours), [&](const auto neighbour)
+            {
+                output << i << " " << neighbour << '\n';
+            });
+        }
     }
+
+    fs::rename(tmp_output_file, output_file);
 }
 
 }
\ No newline at end of file
@@ -1,14 +1,17 @@
 #include <algorithm>
+#include <cstdlib>
 #include <fstream>
 #include <string>
 #include <sstream>
 #include <cassert>
 #include <iostream>
 #include <filesystem>
+#include <vector>
 
 #include "libparsers.hpp"
 #include "dgcnngraph.hpp"
 #include "edgelist_graph.hpp"
+#include "binary_edgelist_writer.hpp"
 
 int parse_dimacs_to_dgcnn_vcg(const char base_dir[256], const char file_name[256], const char labels[256])
 {
@@ -175,4 +178,97 @@ int parse_dimacs_to_edgelist(const char *base_dir, const char *file_name)
     edgelist->SaveToFile(output_dir, output_file);
 
     return 0;
-}
\ No newline at end of file
+}
+
+int parse_dimacs_to_binary_edgelist(const char *base_dir, const char *file_name)
+{
+    using namespace std::string_literals;
+    using namespace MasterThesis;
+    namespace fs = std::filesystem;
+
+    const auto file_path = std::string{base_dir} + "/"s + std::string{file_name};
+    if (!fs::exists(file_path))
+    {
+        std::cout << "The file does not exist: " << file_path << std::endl;
+        return -1;
+    }
+
+    std::ifstream input{file_path};
+    if (!input.is_open())
+    {
+        std::cout << "Error opening file: " << file_path << std::endl;
+        return -1;
+    }
+
+    std::cout << "Parsing file: " << file_path << std::endl;
+
+    unsigned num_of_vars = 0u;
+    unsigned num_of_clauses = 0u;
+    BinaryEdgelistWriter edgelist{std::string{base_dir}, std::string{file_name} + ".edgelist.bin"s};
+
+    // Only the current clause is kept in memory, edges are streamed to the output in fixed-size chunks
+    std::vector<std::int32_t> clause_vars;
+    std::string line;
+    unsigned clause_idx = 0u;
+    while (std::getline(input, line))
+    {
+        if (line.empty() || line[0] == 'c')
+        {
+            continue;
+        }
+        if (line[0] == 'p')
+        {
+            assert(!clause_idx);
+            std::istringstream dimacs_header_line{line};
+            std::string problem_data;
+            dimacs_header_line >> problem_data
+                               >> problem_data
+                               >> num_of_vars
+                               >> num_of_clauses;
+            edgelist.SetNumberOfNodes(2ll*num_of_vars + num_of_clauses);
+            continue;
+        }
+
+        clause_vars.clear();
+        const char *cursor = line.c_str();
+        char *next = nullptr;
+        for (long var_node = std::strtol(cursor, &next, 10); next != cursor; var_node = std::strtol(cursor, &next, 10))
+        {
+            cursor = next;
+            if (!var_node)
+            {
+                break;
+            }
+            // Calculate the var node index
+            unsigned var_idx = (var_node > 0)
+                ? (static_cast<unsigned>(var_node) - 1u + num_of_clauses)
+                : (static_cast<unsigned>(-var_node) - 1u + num_of_clauses + num_of_vars);
+            clause_vars.push_back(static_cast<std::int32_t>(var_idx));
+        }
+
+        // Repeated literals produce a single edge, as in the in-memory edgelist graph
+        std::sort(std::begin(clause_vars), std::end(clause_vars));
+        clause_vars.erase(std::unique(std::begin(clause_vars), std::end(clause_vars)), std::end(clause_vars));
+        for (const auto var_idx : clause_vars)
+        {
+            // Connect the clause with the node
+            edgelist.AddEdge(static_cast<std::int32_t>(clause_idx), var_idx);
+            // Connect the node with the clause
+            edgelist.AddEdge(var_idx, static_cast<std::int32_t>(clause_idx));
+        }
+
+        // Move on to the next clause
+        ++clause_idx;
+    }
+
+    // Every node is connected with itself, as in the in-memory edgelist graph
+    const auto num_of_nodes = 2u*num_of_vars + num_of_clauses;
+    for (auto i = 0u; i < num_of_nodes; ++i)
+    {
+        edgelist.AddEdge(static_cast<std::int32_t>(i), static_cast<std::int32_t>(i));
+    }
+
+    edgelist.Close();
+
+    return 0;
+}
@@ -1,81 +1,149 @@
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timeit import default_timer as timer
+
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
 from sklearn import metrics
-from sklearn import multioutput
 
+from .common.search_results import SearchResults
+
+N_ESTIMATORS = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+MIN_SAMPLES_SPLITS = [0.05, 0.1, 0.2, 0.3, 2, 10, 20, 50]
+
+
+def grow_forest(x_train, y_train, x_val, y_val, n_estimators, min_samples_split, n_jobs=1):
+    """
+        Scores of the forests with every number of trees in n_estimators for one min_samples_split, as arrays
+        (len(n_estimators), outputs). A single multi-output forest is grown through the sorted n_estimators with
+        warm start, so a forest of n trees is the prefix of the first n trees of the largest one. The validation
+        predictions of the trees are summed up as they are added and every prefix is scored from their mean.
+    """
+    time_start = timer()
+    order = np.argsort(n_estimators)
+    r2_scores = np.empty((len(n_estimators), y_train.shape[1]))
+    rmse_scores = np.empty((len(n_estimators), y_train.shape[1]))
+
+    model = RandomForestRegressor(n_estimators=0, min_samples_split=min_samples_split, warm_start=True, n_jobs=n_jobs)
+    prediction_sum = np.zeros(y_val.shape)
+    for i in order:
+        num_trees = len(model.estimators_) if hasattr(model, "estimators_") else 0
+        model.set_params(n_estimators=int(n_estimators[i]))
+        model.fit(x_train, y_train)
+        for tree in model.estimators_[num_trees:]:
+            prediction_sum += tree.predict(x_val).reshape(y_val.shape)
+
+        y_pred = prediction_sum / len(model.estimators_)
+        r2_scores[i] = metrics.r2_score(y_val, y_pred, multioutput="raw_values")
+        rmse_scores[i] = np.sqrt(np.mean((y_val - y_pred) ** 2, axis=0))
+
+    print(f"\tGrew {len(model.estimators_)} trees with min_samples_split={min_samples_split} " +
+          f"in {timer() - time_start:.2f}s")
+    return r2_scores, rmse_scores
+
+
+def unsampled_indices(random_state: int, num_samples: int) -> np.ndarray:
+    """
+        Instances left out of the bootstrap of a tree, drawn from its random_state like sklearn draws the bootstrap
+        without max_samples and sample weights
+    """
+    sample_indices = np.random.RandomState(random_state).randint(0, num_samples, num_samples)
+    return np.flatnonzero(np.bincount(sample_indices, minlength=num_samples) == 0)
+
+
+def grow_oob_forest(x_train_val, y_train_val, n_estimators, min_samples_split, n_jobs=1):
+    """
+        Like grow_forest, but every prefix is scored from the out-of-bag predictions of the forest, which is trained
+        on Train+Validation. The predictions of every new tree on the instances left out of its bootstrap are summed
+        up, and the instances that are in the bootstrap of every tree of a prefix are left out of its scores. Only
+        the scores are returned, so the forests are not sent back from the worker processes.
+    """
+    time_start = timer()
+    order = np.argsort(n_estimators)
+    r2_scores = np.empty((len(n_estimators), y_train_val.shape[1]))
+    rmse_scores = np.empty((len(n_estimators), y_train_val.shape[1]))
+
+    model = RandomForestRegressor(n_estimators=0, min_samples_split=min_samples_split, warm_start=True, n_jobs=n_jobs)
+    num_samples = len(y_train_val)
+    prediction_sum = np.zeros(y_train_val.shape)
+    oob_counts = np.zeros(num_samples, dtype=np.int64)
+    for i in order:
+        num_trees = len(model.estimators_) if hasattr(model, "estimators_") else 0
+        model.set_params(n_estimators=int(n_estimators[i]))
+        model.fit(x_train_val, y_train_val)
+        for tree in model.estimators_[num_trees:]:
+            unsampled = unsampled_indices(tree.random_state, num_samples)
+            if len(unsampled) > 0:
+                prediction_sum[unsampled] += tree.predict(x_train_val[unsampled]).reshape(len(unsampled), -1)
+                oob_counts[unsampled] += 1
+
+        scored = oob_counts > 0
+        y_pred = prediction_sum[scored] / oob_counts[scored, np.newaxis]
+        r2_scores[i] = metrics.r2_score(y_train_val[scored], y_pred, multioutput="raw_values")
+        rmse_scores[i] = np.sqrt(np.mean((y_train_val[scored] - y_pred) ** 2, axis=0))
+
+    print(f"\tGrew {max(n_estimators)} trees with min_samples_split={min_samples_split} " +
+          f"in {timer() - time_start:.2f}s")
+    return r2_scores, rmse_scores
 
-def search_for_the_best_model(x_train, y_train, x_val, y_val, n_estimators, min_samples_splits, model_dir):
+
+def grow_forests(grow, data: tuple, tasks: list, cpu_budget=0, on_result=None):
+    """
+        Calls grow(*data, n_estimators, min_samples_split, n_jobs) for every (n_estimators, min_samples_split) task.
+        The forests are independent and grown in parallel processes, the cores of the budget are shared among them.
+        on_result(task, result) is called as soon as a forest is finished.
+    """
+    if len(tasks) == 0:
+        return
+    cpu_budget = cpu_budget if cpu_budget > 0 else os.cpu_count()
+    max_workers = max(1, min(len(tasks), cpu_budget))
+    n_jobs = max(1, cpu_budget // max_workers)
+    print(f"\tGrowing {len(tasks)} forests in {max_workers} processes with {n_jobs} cores each")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(grow, *data, n_estimators, min_samples_split, n_jobs): (n_estimators,
+                                                                                          min_samples_split)
+                   for n_estimators, min_samples_split in tasks}
+        for future in as_completed(futures):
+            on_result(futures[future], future.result())
+
+
+def search_for_the_best_model(x_train, y_train, x_val, y_val, n_estimators, min_samples_splits, solver_names,
+                              model_dir, cpu_budget=0):
     print("Searching for the best model")
-    number_of_solvers = y_train.shape[1]
 
-    # Validation scores
-    shape = (len(n_estimators), len(min_samples_splits), number_of_solvers)
-    r2_scores = np.empty(shape)
-    rmse_scores = np.empty(shape)
+    # Validation scores of the finished cells are kept in the results file, a restarted search skips them
+    results = SearchResults(os.path.join(model_dir, f"RF_model_search_results.csv"),
+                            ["n_estimators", "min_samples_split"], solver_names)
 
-    model_search_results = os.path.join(model_dir, f"RF_model_search_results.csv")
-    if os.path.exists(model_search_results):
-        data = pd.read_csv(model_search_results)
-        i_mult = len(min_samples_splits) * number_of_solvers
-        j_mult = number_of_solvers
+    x_train = np.asarray(x_train, dtype=np.float64)
+    x_val = np.asarray(x_val, dtype=np.float64)
+    y_train = np.asarray(y_train, dtype=np.float64)
+    y_val = np.asarray(y_val, dtype=np.float64)
 
-        for i in range(len(n_estimators)):
-            for j in range(len(min_samples_splits)):
-                for k in range(number_of_solvers):
-                    idx = i * i_mult + j * j_mult + k
-                    r2_score = data.iloc[idx]["r2 score"]
-                    r2_scores[i, j, k] = r2_score
-                    rmse_score = data.iloc[idx]["rmse score"]
-                    rmse_scores[i, j, k] = rmse_score
-
-        return r2_scores, rmse_scores
-
-    max_count = np.product(shape)
-    count = 0
-
-    # Searching procedure
-    for i in range(len(n_estimators)):
-        param_n_estimator = n_estimators[i]
-        for j in range(len(min_samples_splits)):
-            param_min_samples_split = min_samples_splits[j]
-            for k in range(number_of_solvers):
-                count += 1
-                print(f"\tTraining model {count}/{max_count}")
-                model = RandomForestRegressor(n_estimators=param_n_estimator,
-                                              min_samples_split=param_min_samples_split,
-                                              n_jobs=-1)
-                model.fit(x_train, y_train.iloc[:, k:k + 1].values.ravel())
-                y_true, y_pred = y_val.iloc[:, k:k + 1], model.predict(x_val)
-                r2_score = metrics.r2_score(y_true, y_pred)
-                r2_scores[i, j, k] = r2_score
-                rmse_score = metrics.mean_squared_error(y_true, y_pred, squared=False)
-                rmse_scores[i, j, k] = rmse_score
+    # A forest is grown only through the numbers of trees that are not scored yet
+    tasks = []
+    for min_samples_split in min_samples_splits:
+        missing = [n for n in n_estimators if not results.is_completed(n, min_samples_split)]
+        if len(missing) > 0:
+            tasks.append((missing, min_samples_split))
 
-    return r2_scores, rmse_scores
+    def save_scores(task, scores):
+        missing, min_samples_split = task
+        for i in range(len(missing)):
+            results.append((missing[i], min_samples_split), scores[0][i], scores[1][i])
 
+    grow_forests(grow_forest, (x_train, y_train, x_val, y_val), tasks, cpu_budget, save_scores)
 
-def save_training_data(r2_scores, rmse_scores, n_estimators, min_samples_splits, solver_names, model_dir):
-    print("Saving the training results")
-    number_of_solvers = len(solver_names)
+    return results.load([n_estimators, min_samples_splits])
 
-    model_search_results = os.path.join(model_dir, f"RF_model_search_results.csv")
-    if not os.path.exists(model_search_results):
-        with open(model_search_results, "w", encoding="utf-8") as csv:
-            csv.write("n_estimators,min_samples_split,solver name,r2 score,rmse score\n")
-            for i in range(len(n_estimators)):
-                param_n_estimator = n_estimators[i]
-                for j in range(len(min_samples_splits)):
-                    param_min_samples_split = min_samples_splits[j]
-                    for k in range(number_of_solvers):
-                        solver_name = solver_names[k]
-                        row = f"{param_n_estimator},{param_min_samples_split}," + \
-                              f"{solver_name},{r2_scores[i, j, k]},{rmse_scores[i, j, k]}\n"
-                        csv.write(row)
 
-    model_search_group_results = os.path.join(model_dir, f"RF_model_search_group_results.csv")
+def save_training_data(r2_scores, rmse_scores, n_estimators, min_samples_splits, model_dir, model_name="RF"):
+    print("Saving the training results")
+
+    model_search_group_results = os.path.join(model_dir, f"{model_name}_model_search_group_results.csv")
     if not os.path.exists(model_search_group_results):
         with open(model_search_group_results, "w", encoding="utf-8") as csv:
             csv.write("n_estimators,min_samples_split,avg r2 score,min r2 score,max r2 score," +
@@ -117,16 +185,71 @@ def retrain_the_best_model(x_train_val, y_train_val, model_dir):
     }
 
     print(f"\tBest params: {best_params}")
-    best_model = multioutput.MultiOutputRegressor(RandomForestRegressor(**best_params, n_jobs=-1))
+    best_model = RandomForestRegressor(**best_params, n_jobs=-1)
     best_model.fit(x_train_val, y_train_val)
 
     return best_model
 
 
-def train(x_train, y_train, x_val, y_val, solver_names, model_dir):
-    n_estimators = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
-    min_samples_splits = [0.05, 0.1, 0.2, 0.3, 2, 10, 20, 50]
+def select_the_best_model_oob(x_train_val, y_train_val, n_estimators, min_samples_splits, solver_names, model_dir,
+                              cpu_budget=0):
+    """
+        Out-of-bag model selection: one forest per min_samples_split is grown on Train+Validation and scored from
+        its out-of-bag predictions. Only the scores come back from the worker processes, the final model is grown
+        once more with the best parameters, without holding out the validation set. The scores are kept in their own
+        results file.
+    """
+    print("Searching for the best model with out-of-bag scores")
+    results = SearchResults(os.path.join(model_dir, f"RF_oob_model_search_results.csv"),
+                            ["n_estimators", "min_samples_split"], solver_names)
+    x_train_val = np.asarray(x_train_val, dtype=np.float64)
+    y_train_val = np.asarray(y_train_val, dtype=np.float64)
+
+    tasks = [(n_estimators, min_samples_split) for min_samples_split in min_samples_splits
+             if not all(results.is_completed(n, min_samples_split) for n in n_estimators)]
+
+    def save_scores(task, scores):
+        _, min_samples_split = task
+        for i in range(len(n_estimators)):
+            if not results.is_completed(n_estimators[i], min_samples_split):
+                results.append((n_estimators[i], min_samples_split), scores[0][i], scores[1][i])
+
+    grow_forests(grow_oob_forest, (x_train_val, y_train_val), tasks, cpu_budget, save_scores)
+    r2_scores, rmse_scores = results.load([n_estimators, min_samples_splits])
 
-    r2_scores, rmse_scores = search_for_the_best_model(x_train, y_train, x_val, y_val, n_estimators, min_samples_splits,
-                                                       model_dir)
-    save_training_data(r2_scores, rmse_scores, n_estimators, min_samples_splits, solver_names, model_dir)
+    # Selected like in retrain_the_best_model, by the first best average R^2 score in the order of the results
+    i, j = np.unravel_index(np.argmax(np.average(r2_scores, axis=2)), r2_scores.shape[:2])
+    best_params = {
+        "n_estimators": int(n_estimators[i]),
+        "min_samples_split": min_samples_splits[j]
+    }
+
+    print(f"\tBest params: {best_params}")
+    best_model = RandomForestRegressor(**best_params, n_jobs=cpu_budget if cpu_budget > 0 else -1)
+    best_model.fit(x_train_val, y_train_val)
+
+    return r2_scores, rmse_scores, best_model
+
+
+def train(x_train, y_train, x_val, y_val, solver_names, model_dir, cpu_budget=0):
+    r2_scores, rmse_scores = search_for_the_best_model(x_train, y_train, x_val, y_val, N_ESTIMATORS,
+                                                       MIN_SAMPLES_SPLITS, solver_names, model_dir, cpu_budget)
+    save_training_data(r2_scores, rmse_scores, N_ESTIMATORS, MIN_SAMPLES_SPLITS, model_dir)
+
+
+def train_oob(x_train_val, y_train_val, solver_names, model_dir, cpu_budget=0):
+    """
+        Replaces train and retrain_the_best_model with out-of-bag model selection and returns the final model. Its
+        results and model are saved under the name RF_oob, apart from the ones of the validation search.
+    """
+    model_filepath = os.path.join(model_dir, "best_RF_oob_model")
+    if os.path.exists(model_filepath):
+        with open(model_filepath, "rb") as model_file:
+            best_model = pickle.load(model_file)
+            return best_model
+
+    r2_scores, rmse_scores, best_model = select_the_best_model_oob(x_train_val, y_train_val, N_ESTIMATORS,
+                                                                   MIN_SAMPLES_SPLITS, solver_names, model_dir,
+                                                                   cpu_budget)
+    save_training_data(r2_scores, rmse_scores, N_ESTIMATORS, MIN_SAMPLES_SPLITS, model_dir, "RF_oob")
+    return best_model
@@ -9,7 +9,13 @@ from sklearn import multioutput
 
 from code.preprocessing.os.arguments import cmd_args
 from code.preprocessing.cnf.generate_data import generate_edgelist_formats, generate_satzilla_features, \
-    generate_dgcnn_formats, generate_dgcnn_pickled_data, generate_cnf_datasets
+    generate_dgcnn_formats, generate_dgcnn_pickled_data, generate_cnf_datasets, generate_graph_store, \
+    generate_dgcnn_graph_store, dgcnn_pickle_extension
+from code.preprocessing.cnf.node_features import parse_node_features
+from code.preprocessing.cnf.graph_cache import GraphCache
+from code.common.memory import MemoryManager
+from code.preprocessing.cnf.node2vec_farm import generate_node2vec_features
+from code.preprocessing.cnf.embedding_backends import create_embedding_backend
 from code import knn, rf, gcn, gat, dgcnn
 from code.common.data import load_data, scale_the_data
 from code.common.process_results import save_the_best_model, calculate_r2_and_rmse_metrics, plot_r2_and_rmse_scores, \
@@ -47,23 +53,54 @@ best_model: ModelTypes
 def data_preparation():
     global x_train, y_train, x_val, y_val, x_train_val, y_train_val, x_test, y_test, solver_names, best_model, trainset, valset, trainvalset, testset
 
+    embedding_backend = None
+    use_node2vec = "node2vec" in cmd_args.node_features.split("+")
+    if cmd_args.model in ["GCN", "GAT", "DGCNN"] and use_node2vec:
+        embedding_backend = create_embedding_backend(cmd_args.embedding_backend,
+                                                     dim=cmd_args.embedding_dim,
+                                                     num_epochs=cmd_args.embedding_epochs,
+                                                     walk_length=cmd_args.embedding_walk_length)
+
     print('Generating edgelist formats...')
-    generate_edgelist_formats(os.path.join(cmd_args.cnf_dir, "splits.csv"), cmd_args.cnf_dir)
+    generate_edgelist_formats(os.path.join(cmd_args.cnf_dir, "splits.csv"), cmd_args.cnf_dir,
+                              cmd_args.parser_workers, cmd_args.edgelist_format)
+
+    if cmd_args.model in ["GCN", "GAT", "DGCNN"] and use_node2vec and cmd_args.embedding_workers > 0:
+        print('Generating Node2Vec features...')
+        generate_node2vec_features(os.path.join(cmd_args.cnf_dir, "splits.csv"),
+                                   os.path.join(cmd_args.cnf_dir, "all_data_y.csv"),
+                                   cmd_args.cnf_dir,
+                                   cmd_args.embedding_workers,
+                                   embedding_backend=embedding_backend)
 
     if cmd_args.model == "KNN" or cmd_args.model == "RF":
         print('Generating SATzilla2012 features...')
         generate_satzilla_features(os.path.join(cmd_args.cnf_dir, "splits.csv"), "./", cmd_args.cnf_dir)
 
-        x_train, y_train, x_val, y_val, x_train_val, y_train_val, x_test, y_test = load_data(cmd_args.cnf_dir)
+        x_train, y_train, x_val, y_val, x_train_val, y_train_val, x_test, y_test = load_data(cmd_args.cnf_dir, cmd_args.runtime_dedup)
         x_train, x_val, x_train_val, x_test = scale_the_data(x_train, x_val, x_train_val, x_test)
         solver_names = y_train.columns
     elif cmd_args.model == "GCN" or cmd_args.model == "GAT":
+        # Loading workers would each fill a cache of their own, out of sight of the training process
+        graph_cache = None
+        if cmd_args.graph_cache_mb > 0 and cmd_args.num_workers > 0:
+            print('The graph cache is disabled, since the graphs are loaded by worker processes')
+        elif cmd_args.graph_cache_mb > 0:
+            graph_cache = GraphCache(cmd_args.graph_cache_mb * 1024 * 1024)
+
         print('Generating CNF dataset with Node2Vec features...')
         training_data, testset = \
             generate_cnf_datasets(cmd_args.cnf_dir,
                                   os.path.join(cmd_args.cnf_dir, "splits.csv"),
-                                  os.path.join(cmd_args.cnf_dir, "all_data_y.csv"))
+                                  os.path.join(cmd_args.cnf_dir, "all_data_y.csv"),
+                                  embedding_backend,
+                                  cmd_args.node_features,
+                                  graph_cache)
         trainset, valset, trainvalset = training_data
+
+        if cmd_args.graph_store:
+            print('Generating the graph store...')
+            generate_graph_store(cmd_args.cnf_dir, [trainset, valset, trainvalset, testset])
     elif cmd_args.model == "DGCNN":
         print('Generating DGCNN formats...')
         generate_dgcnn_formats(os.path.join(cmd_args.cnf_dir, "splits.csv"),
@@ -86,13 +123,20 @@ def data_preparation():
                                         cmd_args.cnf_dir,
                                         instance_ids,
                                         splits,
-                                        cmd_args.sortpooling_k)
+                                        cmd_args.sortpooling_k,
+                                        embedding_backend,
+                                        cmd_args.node_features)
         cmd_args.num_class = num_class
         cmd_args.feat_dim = feat_dim
         cmd_args.edge_feat_dim = edge_feat_dim
         cmd_args.attr_dim = attr_dim
         cmd_args.sortpooling_k = sortpooling_k
 
+        graph_store = None
+        if cmd_args.graph_store:
+            print('Generating the DGCNN graph store...')
+            graph_store = generate_dgcnn_graph_store(cmd_args.cnf_dir, instance_ids, cmd_args.node_features)
+
         best_model = dgcnn.DGCNNPredictor(cmd_args.cnf_dir,
                                           cmd_args.model_output_dir,
                                           cmd_args.model,
@@ -109,7 +153,14 @@ def data_preparation():
                                           cmd_args.sortpooling_k,
                                           cmd_args.conv1d_activation,
                                           cmd_args.learning_rate,
-                                          cmd_args.mode)
+                                          cmd_args.mode,
+                                          graph_store=graph_store,
+                                          pickle_ext=dgcnn_pickle_extension(parse_node_features(cmd_args.node_features)),
+                                          max_batch_edges=cmd_args.max_batch_edges,
+                                          num_size_buckets=cmd_args.num_size_buckets,
+                                          msg_average=cmd_args.msg_average,
+                                          sparse_cache_mb=cmd_args.sparse_cache_mb,
+                                          memory_manager=MemoryManager(cmd_args.gc_threshold_mb * 1024 * 1024))
 
 
 def train_model():
@@ -118,19 +169,29 @@ def train_model():
     if cmd_args.model == "KNN":
         knn.train(x_train, y_train, x_val, y_val, solver_names, cmd_args.model_dir)
         best_model = knn.retrain_the_best_model(x_train_val, y_train_val, cmd_args.model_dir)
+    elif cmd_args.model == "RF" and cmd_args.rf_selection == "oob":
+        best_model = rf.train_oob(x_train_val, y_train_val, solver_names, cmd_args.model_dir, cmd_args.cpu_budget)
     elif cmd_args.model == "RF":
-        rf.train(x_train, y_train, x_val, y_val, solver_names, cmd_args.model_dir)
+        rf.train(x_train, y_train, x_val, y_val, solver_names, cmd_args.model_dir, cmd_args.cpu_budget)
         best_model = rf.retrain_the_best_model(x_train_val, y_train_val, cmd_args.model_dir)
     elif cmd_args.model == "GCN":
-        gcn.train(cmd_args.model_output_dir, cmd_args.model, trainset, valset, trainvalset, train_device, test_device)
+        gcn.train(cmd_args.model_output_dir, cmd_args.model, trainset, valset, trainvalset, train_device, test_device,
+                  cmd_args.num_workers, cmd_args.pin_memory, cmd_args.prefetch_factor, cmd_args.max_batch_edges,
+                  cmd_args.num_size_buckets, MemoryManager(cmd_args.gc_threshold_mb * 1024 * 1024),
+                  cmd_args.val_batch_size, cmd_args.validate_on_train_device)
     elif cmd_args.model == "GAT":
-        gat.train(cmd_args.model_output_dir, cmd_args.model, trainset, valset, trainvalset, train_device, test_device)
+        gat.train(cmd_args.model_output_dir, cmd_args.model, trainset, valset, trainvalset, train_device, test_device,
+                  cmd_args.num_workers, cmd_args.pin_memory, cmd_args.prefetch_factor, cmd_args.max_batch_edges,
+                  cmd_args.num_size_buckets, MemoryManager(cmd_args.gc_threshold_mb * 1024 * 1024),
+                  cmd_args.val_batch_size, cmd_args.validate_on_train_device)
     elif cmd_args.model == "DGCNN":
         dgcnn.train(best_model, cmd_args.num_epochs, cmd_args.batch_size, cmd_args.look_behind, cmd_args.print_auc)
         dgcnn.retrain(best_model, cmd_args.batch_size, cmd_args.extract_features, cmd_args.print_auc)
         
     if cmd_args.model == "KNN" or cmd_args.model == "RF":
-        save_the_best_model(best_model, cmd_args.model_dir, cmd_args.model)
+        # The out-of-bag selection keeps its model apart from the one retrained after the validation search
+        model_name = "RF_oob" if cmd_args.model == "RF" and cmd_args.rf_selection == "oob" else cmd_args.model
+        save_the_best_model(best_model, cmd_args.model_dir, model_name)
 
 
 def evaluate_model():
@@ -141,9 +202,13 @@ def evaluate_model():
         np.savetxt(os.path.join(cmd_args.model_output_dir, cmd_args.model, "r2_scores.txt"), r2_scores_test)
         np.savetxt(os.path.join(cmd_args.model_output_dir, cmd_args.model, "rmse_scores.txt"), rmse_scores_test)
     elif cmd_args.model == "GCN":
-        gcn.test(cmd_args.model_output_dir, cmd_args.model, testset, train_device, test_device)
+        gcn.test(cmd_args.model_output_dir, cmd_args.model, testset, train_device, test_device,
+                 cmd_args.num_workers, cmd_args.pin_memory, cmd_args.prefetch_factor, cmd_args.test_batch_size,
+                 cmd_args.max_batch_edges, cmd_args.num_size_buckets)
     elif cmd_args.model == "GAT":
-        gat.test(cmd_args.model_output_dir, cmd_args.model, testset, train_device, test_device)
+        gat.test(cmd_args.model_output_dir, cmd_args.model, testset, train_device, test_device,
+                 cmd_args.num_workers, cmd_args.pin_memory, cmd_args.prefetch_factor, cmd_args.test_batch_size,
+                 cmd_args.max_batch_edges, cmd_args.num_size_buckets)
     elif cmd_args.model == "DGCNN":
         dgcnn.test(best_model, cmd_args.batch_size, cmd_args.extract_features, cmd_args.print_auc)
         